@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+
+"""
+Downloads files concurrently into a content addressed cache and links or
+copies them to their destinations.
+
+Files are verified against the sha1 given by the caller or the one
+published next to the file (url + '.sha1', as maven repositories do).
+Cached files are stored by sha1 under cacheFolder/sha1/, so a file which
+didn't change is not downloaded again, also by other hosts sharing the
+cache folder. Interrupted downloads are resumed with HTTP range requests.
+"""
+
+import os
+import ssl
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib2
+
+from multiprocessing.pool import ThreadPool
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Downloader(object):
+    """ Parallel, resumable and verified file downloads """
+
+    blockSize = 256 * 1024
+
+    def __init__(self, cacheFolder, threads=4, tries=10, timeout=60, logIt=None):
+        self.cacheFolder = cacheFolder
+        self.threads = threads
+        self.tries = tries
+        self.timeout = timeout
+        self.retryDelay = 2
+        self.logIt = logIt or (lambda msg, errorLog=False: None)
+        self.indexFn = os.path.join(cacheFolder, 'index.json')
+        self.indexLock = threading.Lock()
+
+        for folder in ['sha1', 'partial']:
+            if not os.path.exists(os.path.join(cacheFolder, folder)):
+                os.makedirs(os.path.join(cacheFolder, folder))
+
+    def blobPath(self, sha1):
+        return os.path.join(self.cacheFolder, 'sha1', sha1[:2], sha1)
+
+    def partialPath(self, url):
+        return os.path.join(self.cacheFolder, 'partial', '%s.part' % hashlib.sha1(url).hexdigest())
+
+    def loadIndex(self):
+        try:
+            with open(self.indexFn) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def updateIndex(self, url, entry):
+        with self.indexLock:
+            index = self.loadIndex()
+            index[url] = entry
+            fd, tmpFn = tempfile.mkstemp(dir=self.cacheFolder, prefix='.index.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f, indent=2)
+            os.rename(tmpFn, self.indexFn)
+
+    def open(self, url, method=None, headers=None, verify=True):
+        request = urllib2.Request(url, headers=headers or {})
+        if method:
+            request.get_method = lambda: method
+        kwargs = {'timeout': self.timeout}
+        if not verify and hasattr(ssl, '_create_unverified_context'):
+            kwargs['context'] = ssl._create_unverified_context()
+        return urllib2.urlopen(request, **kwargs)
+
+    def publishedSha1(self, url, headers=None, verify=True):
+        """Returns sha1 published as url.sha1 or None"""
+        try:
+            response = self.open(url + '.sha1', headers=headers, verify=verify)
+            try:
+                text = response.read(1024).strip()
+            finally:
+                response.close()
+        except (urllib2.URLError, IOError):
+            return None
+
+        sha1 = text.split()[0].lower() if text else ''
+        if len(sha1) == 40 and all(c in '0123456789abcdef' for c in sha1):
+            return sha1
+        return None
+
+    def remoteState(self, url, headers=None, verify=True):
+        """Returns dict with ETag, Last-Modified and Content-Length of url"""
+        try:
+            response = self.open(url, 'HEAD', headers, verify)
+            info = response.info()
+            response.close()
+        except (urllib2.URLError, IOError):
+            return None
+        state = dict((key, info.getheader(key)) for key in ['ETag', 'Last-Modified', 'Content-Length'])
+        if not any(state.values()):
+            return None
+        return state
+
+    def place(self, blob, dest):
+        """Hard links cached blob to dest, copies it if linking fails"""
+        destDir = os.path.dirname(dest)
+        if destDir and not os.path.exists(destDir):
+            os.makedirs(destDir)
+        tmpFn = os.path.join(destDir, '.%s.download' % os.path.basename(dest))
+        if os.path.exists(tmpFn):
+            os.remove(tmpFn)
+        try:
+            os.link(blob, tmpFn)
+        except OSError:
+            shutil.copyfile(blob, tmpFn)
+        os.rename(tmpFn, dest)
+
+    def transfer(self, url, partial, headers=None, verify=True, ifRange=None):
+        """Downloads url to partial file, resuming from its current size"""
+        requestHeaders = dict(headers or {})
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset:
+            requestHeaders['Range'] = 'bytes=%d-' % offset
+            if ifRange:
+                requestHeaders['If-Range'] = ifRange
+
+        try:
+            response = self.open(url, headers=requestHeaders, verify=verify)
+        except urllib2.HTTPError, e:
+            if e.code == 416 and offset:
+                # partial file is already complete or bigger than the file
+                os.remove(partial)
+            raise
+
+        try:
+            if offset and response.getcode() != 206:
+                self.logIt("Server ignored range request for %s, downloading from start" % url)
+                offset = 0
+            with open(partial, 'ab' if offset else 'wb') as f:
+                for chunk in iter(lambda: response.read(self.blockSize), ''):
+                    f.write(chunk)
+        finally:
+            response.close()
+
+    def fileSha1(self, path):
+        fileHash = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.blockSize), ''):
+                fileHash.update(chunk)
+        return fileHash.hexdigest()
+
+    def fetch(self, url, dest, sha1=None, headers=None, verify=True):
+        """Places content of url to dest. Returns (sha1, downloaded) where
+        downloaded is False when the file came from the cache"""
+        expected = sha1.lower() if sha1 else self.publishedSha1(url, headers, verify)
+
+        if expected and os.path.exists(self.blobPath(expected)):
+            self.logIt("Using cached %s (sha1 %s)" % (url, expected))
+            self.place(self.blobPath(expected), dest)
+            return expected, False
+
+        remote = None
+        if not expected:
+            self.logIt("No published checksum for %s" % url)
+            remote = self.remoteState(url, headers, verify)
+            cached = self.loadIndex().get(url)
+            if remote and cached and cached.get('remote') == remote and os.path.exists(self.blobPath(cached['sha1'])):
+                self.logIt("Using cached %s, not modified since last download" % url)
+                self.place(self.blobPath(cached['sha1']), dest)
+                return cached['sha1'], False
+
+        partial = self.partialPath(url)
+        ifRange = remote and (remote.get('ETag') or remote.get('Last-Modified'))
+        error = None
+        for attempt in range(1, self.tries + 1):
+            try:
+                self.transfer(url, partial, headers, verify, ifRange)
+                actual = self.fileSha1(partial)
+                if expected and actual != expected:
+                    os.remove(partial)
+                    raise DownloadError("Checksum mismatch for %s: expected %s, got %s" % (url, expected, actual))
+                break
+            except (urllib2.URLError, IOError, DownloadError), e:
+                error = e
+                self.logIt("Attempt %d of %d to download %s failed: %s" % (attempt, self.tries, url, e), True)
+                if attempt < self.tries:
+                    time.sleep(self.retryDelay)
+        else:
+            raise DownloadError("Failed to download %s: %s" % (url, error))
+
+        blob = self.blobPath(actual)
+        if not os.path.exists(os.path.dirname(blob)):
+            os.makedirs(os.path.dirname(blob))
+        os.rename(partial, blob)
+        self.updateIndex(url, {'sha1': actual, 'remote': remote, 'time': int(time.time())})
+        self.place(blob, dest)
+        self.logIt("Downloaded %s to %s (sha1 %s)" % (url, dest, actual))
+        return actual, True
+
+    def fetchJob(self, job):
+        try:
+            return self.fetch(job['url'], job['dest'], job.get('sha1'), job.get('headers'), job.get('verify', True))
+        except Exception, e:
+            self.logIt(str(e), True)
+            return e
+
+    def fetchAll(self, jobs):
+        """Downloads list of dicts with url, dest and optional sha1, headers
+        and verify concurrently. Returns list of (sha1, downloaded) or the
+        exception for every job."""
+        if not jobs:
+            return []
+        pool = ThreadPool(max(1, min(int(self.threads), len(jobs))))
+        try:
+            return pool.map(self.fetchJob, jobs)
+        finally:
+            pool.close()
+            pool.join()
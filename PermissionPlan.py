@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+
+"""
+Collects ownership and permission rules for files and folders and applies
+them in process. Every tree is walked once, the final owner and mode of
+each path are computed from all rules in the order they were added, and
+chown/chmod are called only for paths which differ. In dry run mode the
+differences are returned and logged without changing anything.
+
+    plan = PermissionPlan()
+    plan.add('/etc/certs', owner='root:gluu', mode=0440, recursive=True)
+    plan.add('/etc/certs', mode='a+X')
+    plan.add('/opt', mode={0700: 0755, 0600: 0644}, recursive=True, user='root')
+    plan.apply()
+"""
+
+import os
+import pwd
+import grp
+import stat
+import fnmatch
+
+PERMISSION_BITS = 07777
+
+_WHO_BITS = {'u': 04700, 'g': 02070, 'o': 01007}
+_PERM_BITS = {'r': 0444, 'w': 0222, 'x': 0111, 's': 06000, 't': 01000}
+
+
+def apply_symbolic_mode(mode, spec, isDir=False):
+    """Applies chmod symbolic mode like 'u+w', 'a+X' or 'ug=rw,o-rwx' to
+    permission bits mode and returns the new bits"""
+    for clause in spec.split(','):
+        i = 0
+        who = 0
+        while i < len(clause) and clause[i] in 'ugoa':
+            who |= 07777 if clause[i] == 'a' else _WHO_BITS[clause[i]]
+            i += 1
+        if not who:
+            who = 07777
+        if i >= len(clause) or clause[i] not in '+-=':
+            raise ValueError("Invalid mode %s" % spec)
+        op = clause[i]
+        bits = 0
+        for c in clause[i+1:]:
+            if c == 'X':
+                if isDir or mode & 0111:
+                    bits |= 0111
+            elif c in _PERM_BITS:
+                bits |= _PERM_BITS[c]
+            else:
+                raise ValueError("Invalid mode %s" % spec)
+        bits &= who
+        if op == '+':
+            mode |= bits
+        elif op == '-':
+            mode &= ~bits
+        else:
+            mode = (mode & ~who) | bits
+    return mode
+
+
+class PermissionRule(object):
+
+    def __init__(self, path, owner=None, mode=None, recursive=False, user=None, pattern=None):
+        self.path = path
+        self.owner = owner
+        self.mode = mode
+        self.recursive = recursive
+        self.user = user
+        self.pattern = pattern
+
+    def newMode(self, mode, isDir):
+        """Returns permission bits after this rule or None if the rule does
+        not change them"""
+        if self.mode == None:
+            return None
+        if isinstance(self.mode, dict):
+            return self.mode.get(mode)
+        if isinstance(self.mode, basestring):
+            return apply_symbolic_mode(mode, self.mode, isDir)
+        return self.mode
+
+
+class PermissionPlan(object):
+    """ Ownership and permission rules applied with one walk per tree """
+
+    def __init__(self, dryRun=False, logIt=None):
+        self.dryRun = dryRun
+        self.logIt = logIt or (lambda msg, errorLog=False: None)
+        self.rules = []
+        self.links = set()
+        self.uids = {}
+        self.gids = {}
+
+    def add(self, path, owner=None, mode=None, recursive=False, user=None, pattern=None):
+        """Adds rule for path. owner is 'user:group' or 'user', mode is
+        permission bits, chmod symbolic mode or dict mapping current
+        permission bits to new ones (like find -perm 700 -exec chmod 755).
+        With recursive the rule is applied to everything under path, user
+        limits it to files owned by that user and pattern to file names
+        matching it."""
+        self.rules.append(PermissionRule(path, owner, mode, recursive, user, pattern))
+        return self
+
+    def uid(self, name):
+        if name not in self.uids:
+            try:
+                self.uids[name] = int(name) if name.isdigit() else pwd.getpwnam(name).pw_uid
+            except KeyError:
+                self.logIt("User %s does not exist" % name, True)
+                self.uids[name] = None
+        return self.uids[name]
+
+    def gid(self, name):
+        if name not in self.gids:
+            try:
+                self.gids[name] = int(name) if name.isdigit() else grp.getgrnam(name).gr_gid
+            except KeyError:
+                self.logIt("Group %s does not exist" % name, True)
+                self.gids[name] = None
+        return self.gids[name]
+
+    def resolveOwner(self, owner):
+        user, _, group = owner.partition(':')
+        uid = self.uid(user) if user else -1
+        gid = self.gid(group) if group else -1
+        if uid == None or gid == None:
+            return None
+        return uid, gid
+
+    def listTree(self, path, trees):
+        """Returns paths under path including itself, walked only once"""
+        if path not in trees:
+            paths = [path]
+            if os.path.isdir(path) and not os.path.islink(path):
+                for root, dirs, files in os.walk(path):
+                    for name in dirs + files:
+                        paths.append(os.path.join(root, name))
+            trees[path] = paths
+        return trees[path]
+
+    def plan(self):
+        """Returns list of (path, (uid, gid, mode), (uid, gid, mode)) with
+        current and wanted state of every path the rules change"""
+        trees = {}
+        states = {}
+        order = []
+        self.links = set()
+
+        for rule in self.rules:
+            owner = None
+            if rule.owner:
+                owner = self.resolveOwner(rule.owner)
+                if owner == None and rule.mode == None:
+                    continue
+            user = self.uid(rule.user) if rule.user else None
+            if rule.user and user == None:
+                continue
+
+            if not os.path.lexists(rule.path):
+                self.logIt("Can't change permissions of %s, path does not exist" % rule.path, True)
+                continue
+
+            paths = self.listTree(rule.path, trees) if rule.recursive else [rule.path]
+            for path in paths:
+                if rule.pattern and not fnmatch.fnmatch(os.path.basename(path), rule.pattern):
+                    continue
+
+                if path not in states:
+                    # top level path of a rule is followed like chown/chmod do
+                    try:
+                        st = os.stat(path) if path == rule.path else os.lstat(path)
+                    except OSError, e:
+                        # dangling symlink or a file removed during the walk,
+                        # there is nothing to change
+                        self.logIt("Skipping %s: %s" % (path, e.strerror))
+                        states[path] = None
+                        continue
+                    current = (st.st_uid, st.st_gid, stat.S_IMODE(st.st_mode))
+                    states[path] = [current, list(current), stat.S_ISDIR(st.st_mode), stat.S_ISLNK(st.st_mode)]
+                    order.append(path)
+                    if stat.S_ISLNK(st.st_mode):
+                        self.links.add(path)
+
+                if states[path] == None:
+                    continue
+                current, wanted, isDir, isLink = states[path]
+                if user != None and wanted[0] != user:
+                    continue
+                if owner:
+                    if owner[0] != -1:
+                        wanted[0] = owner[0]
+                    if owner[1] != -1:
+                        wanted[1] = owner[1]
+                if not isLink:
+                    mode = rule.newMode(wanted[2], isDir)
+                    if mode != None:
+                        wanted[2] = mode & PERMISSION_BITS
+
+        changes = []
+        for path in order:
+            if states[path] == None:
+                continue
+            current, wanted, isDir, isLink = states[path]
+            if tuple(wanted) != current:
+                changes.append((path, current, tuple(wanted)))
+        return changes
+
+    def describe(self, change):
+        path, current, wanted = change
+        text = []
+        if current[:2] != wanted[:2]:
+            text.append("owner %d:%d -> %d:%d" % (current[0], current[1], wanted[0], wanted[1]))
+        if current[2] != wanted[2]:
+            text.append("mode %04o -> %04o" % (current[2], wanted[2]))
+        return "%s: %s" % (path, ", ".join(text))
+
+    def apply(self):
+        """Applies the rules and returns list of changes. Nothing is changed
+        in dry run mode."""
+        changes = self.plan()
+        for change in changes:
+            path, current, wanted = change
+            if self.dryRun:
+                self.logIt("Would change %s" % self.describe(change))
+                continue
+
+            try:
+                isLink = path in self.links
+                if current[:2] != wanted[:2]:
+                    if isLink:
+                        os.lchown(path, wanted[0], wanted[1])
+                    else:
+                        os.chown(path, wanted[0], wanted[1])
+                if current[2] != wanted[2] and not isLink:
+                    os.chmod(path, wanted[2])
+            except OSError:
+                self.logIt("Error changing %s" % self.describe(change), True)
+
+        self.logIt("Changed ownership or permissions of %d paths" % len(changes) if not self.dryRun
+                   else "%d paths would change ownership or permissions" % len(changes))
+        return changes
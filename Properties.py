@@ -4,13 +4,38 @@
 A Python replacement for java.util.Properties class
 This is modelled as closely as possible to the Java original.
 
-Created - Anand B Pillai <abpillai@gmail.com>    
+Created - Anand B Pillai <abpillai@gmail.com>
 """
 
 import sys,os
 import re
 import time
 
+# The key runs up to the first whitespace, '=' or ':' which isn't escaped
+# with a backslash
+keyre = re.compile(r'(?:[^\s=:\\]|\\.)*')
+
+BOOLEANS = {'true': True, 'false': False}
+
+
+def typed_value(value, types=(bool, int)):
+    """ Returns value converted to the first of types it is a valid
+    literal of, bool for True/False in any case and int for decimal
+    numbers, or value unchanged """
+
+    for kind in types:
+        if kind is bool:
+            boolean = BOOLEANS.get(value.lower())
+            if boolean is not None:
+                return boolean
+        elif kind is int:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+    return value
+
+
 class IllegalArgumentException(Exception):
 
     def __init__(self, lineno, msg):
@@ -40,10 +65,6 @@ class Properties(object):
         # dictionary to pristine dictionary
         self._keymap = {}
 
-        self.othercharre = re.compile(r'(?<!\\)(\s*\=)|(?<!\\)(\s*\:)')
-        self.othercharre2 = re.compile(r'(\s*\=)|(\s*\:)')
-        self.bspacere = re.compile(r'\\(?!\s$)')
-
     def __str__(self):
         s='{'
         for key,value in self._props.items():
@@ -85,138 +106,73 @@ class Properties(object):
         # and skipped. Also any trailing or preceding whitespaces
         # are removed from the key/value.
 
-        # This is a line parser. It parses the
-        # contents like by line.
+        # This is a single pass tokenizer: every logical line is
+        # split at the first separator found by one regex search.
 
-        lineno=0
         i = iter(lines)
+        props, origprops, keymap = self._props, self._origprops, self._keymap
+        matchkey = keyre.match
 
         for line in i:
-            lineno += 1
             line = line.strip()
-            # Skip null lines
-            if not line: continue
-            # Skip lines which are comments
-            if line[0] == '#': continue
-            # Some flags
-            escaped=False
-            # Position of first separation char
-            sepidx = -1
-            # A flag for performing wspace re check
-            flag = 0
-            # Check for valid space separation
-            # First obtain the max index to which we
-            # can search.
-            m = self.othercharre.search(line)
-            if m:
-                first, last = m.span()
-                start, end = 0, first
-                flag = 1
-                wspacere = re.compile(r'(?<![\\\=\:])(\s)')
-            else:
-                if self.othercharre2.search(line):
-                    # Check if either '=' or ':' is present
-                    # in the line. If they are then it means
-                    # they are preceded by a backslash.
-
-                    # This means, we need to modify the
-                    # wspacere a bit, not to look for
-                    # : or = characters.
-                    wspacere = re.compile(r'(?<![\\])(\s)')
-                start, end = 0, len(line)
-
-            m2 = wspacere.search(line, start, end)
-            if m2:
-                # print 'Space match=>',line
-                # Means we need to split by space.
-                first, last = m2.span()
-                sepidx = first
-            elif m:
-                # print 'Other match=>',line
-                # No matching wspace char found, need
-                # to split by either '=' or ':'
-                first, last = m.span()
-                sepidx = last - 1
-                # print line[sepidx]
-
-
-            # If the last character is a backslash
-            # it has to be preceded by a space in which
-            # case the next line is read as part of the
-            # same property
+            # Skip null lines and comments
+            if not line or line[0] == '#': continue
+
+            # If the last character is a backslash the next
+            # line is read as part of the same property
             while line[-1] == '\\':
-                # Read next line
-                nextline = i.next()
-                nextline = nextline.strip()
-                lineno += 1
-                # This line will become part of the value
+                nextline = next(i, '').strip()
                 line = line[:-1] + nextline
+                if not line: break
+            if not line: continue
 
-            # Now split to key,value according to separation char
-            if sepidx != -1:
-                key, value = line[:sepidx], line[sepidx+1:]
-            else:
-                key,value = line,''
-
-            self.processPair(key, value)
+            # Whitespace followed by '=' or ':' belongs to that separator
+            end = matchkey(line).end()
+            key, value = line[:end], line[end:].lstrip()
+            if value[:1] in ('=', ':'):
+                value = value[1:]
+
+            # Same as processPair, the key can't have unescaped spaces
+            oldkey = key
+            if '\\' in key:
+                key = key.replace('\\', '')
+            if '\\' in value:
+                value = self.unescape(value)
+            value = value.strip()
+            props[key] = value
+            origprops[keymap.setdefault(key, oldkey)] = value
 
     def processPair(self, key, value):
         """ Process a (key, value) pair """
 
         oldkey = key
-        oldvalue = value
-
-        # Create key intelligently
-        keyparts = self.bspacere.split(key)
-        # print keyparts
-
-        strippable = False
-        lastpart = keyparts[-1]
-
-        if lastpart.find('\\ ') != -1:
-            keyparts[-1] = lastpart.replace('\\','')
 
-        # If no backspace is found at the end, but empty
-        # space is found, strip it
-        elif lastpart and lastpart[-1] == ' ':
-            strippable = True
-
-        key = ''.join(keyparts)
-        if strippable:
+        # Backslashes only escape characters of the key. An escaped
+        # space at the end is kept, other surrounding spaces are not.
+        escapedspace = key.endswith('\\ ')
+        key = key.replace('\\', '')
+        if not escapedspace and key.endswith(' '):
             key = key.strip()
             oldkey = oldkey.strip()
 
-        oldvalue = self.unescape(oldvalue)
-        value = self.unescape(value)
-
-        self._props[key] = value.strip()
+        value = self.unescape(value).strip()
+        self._props[key] = value
 
         # Check if an entry exists in pristine keys
-        if self._keymap.has_key(key):
-            oldkey = self._keymap.get(key)
-            self._origprops[oldkey] = oldvalue.strip()
-        else:
-            self._origprops[oldkey] = oldvalue.strip()
-            # Store entry in keymap
-            self._keymap[key] = oldkey
+        oldkey = self._keymap.setdefault(key, oldkey)
+        self._origprops[oldkey] = value
 
     def escape(self, value):
 
         # Java escapes the '=' and ':' in the value
         # string with backslashes in the store method.
         # So let us do the same.
-        newvalue = value.replace(':','\:')
-        newvalue = newvalue.replace('=','\=')
-
-        return newvalue
+        return value.replace(':', '\\:').replace('=', '\\=')
 
     def unescape(self, value):
 
         # Reverse of escape
-        newvalue = value.replace('\:',':')
-        newvalue = newvalue.replace('\=','=')
-
-        return newvalue
+        return value.replace('\\:', ':').replace('\\=', '=')
 
     def load(self, stream):
         """ Load properties from an open file stream """
@@ -228,17 +184,41 @@ class Properties(object):
         if stream.mode != 'r':
             raise ValueError,'Stream should be opened in read-only mode!'
 
-        try:
-            lines = stream.readlines()
-            self.__parse(lines)
-        except IOError, e:
-            raise
+        self.__parse(stream)
 
     def getProperty(self, key):
         """ Return a property for the given key """
 
         return self._props.get(key,'')
 
+    def getTypedProperty(self, key, types=(bool, int), default=None):
+        """ Return the property for the given key converted by
+        typed_value, default if it is not set """
+
+        if key not in self._props:
+            return default
+        return typed_value(self._props[key], types)
+
+    def getBoolean(self, key, default=None):
+        """ Return the property for the given key as bool, default if
+        it is not set or not a boolean """
+
+        value = self.getTypedProperty(key, (bool,), default)
+        return value if isinstance(value, bool) else default
+
+    def getInt(self, key, default=None):
+        """ Return the property for the given key as int, default if
+        it is not set or not a number """
+
+        value = self.getTypedProperty(key, (int,), default)
+        return value if isinstance(value, int) else default
+
+    def getTypedDict(self, types=(bool, int)):
+        """ Return a dictionary of all properties with their values
+        converted by typed_value """
+
+        return dict((key, typed_value(value, types)) for key, value in self._props.iteritems())
+
     def setProperty(self, key, value):
         """ Set the property for the given key """
 
@@ -268,18 +248,13 @@ class Properties(object):
         if out.mode[0] != 'w':
             raise ValueError,'Steam should be opened in write mode!'
 
-        try:
-            out.write(''.join(('#',header,'\n')))
-            # Write timestamp
-            tstamp = time.strftime('%a %b %d %H:%M:%S %Z %Y', time.localtime())
-            out.write(''.join(('#',tstamp,'\n')))
-            # Write properties from the pristine dictionary
-            for prop, val in self._origprops.items():
-                out.write(''.join((prop,'=',self.escape(val),'\n')))
-
-            out.close()
-        except IOError, e:
-            raise
+        # Write header, timestamp and the properties from the
+        # pristine dictionary at once
+        tstamp = time.strftime('%a %b %d %H:%M:%S %Z %Y', time.localtime())
+        lines = ['#%s\n#%s\n' % (header, tstamp)]
+        lines.extend(''.join((prop,'=',self.escape(val),'\n')) for prop, val in self._origprops.items())
+        out.write(''.join(lines))
+        out.close()
 
     def getPropertyDict(self):
         return self._props
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+
+"""
+Starts services concurrently in dependency order. A service is started as
+soon as all services it requires are ready, readiness is checked with
+probes (TCP connect or HTTP request) instead of fixed sleeps.
+
+    orchestrator = ServiceOrchestrator()
+    orchestrator.add('ldap', start_ldap, probe=tcp_probe('localhost', 1636))
+    orchestrator.add('oxauth', start_oxauth, requires=['ldap'],
+                     probe=http_probe('http://localhost:8081/'))
+    timings = orchestrator.start()
+"""
+
+import time
+import socket
+import httplib
+import urlparse
+import threading
+
+
+def tcp_probe(host, port, timeout=2):
+    """Returns probe which is ready when host:port accepts connections"""
+    def probe():
+        try:
+            sock = socket.create_connection((host, int(port)), timeout)
+            sock.close()
+            return True
+        except (socket.error, socket.timeout):
+            return False
+    probe.description = 'tcp://%s:%s' % (host, port)
+    return probe
+
+
+def http_probe(url, timeout=5, maxStatus=499):
+    """Returns probe which is ready when url answers with status up to
+    maxStatus"""
+    parsed = urlparse.urlparse(url)
+    connectionClass = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+
+    def probe():
+        connection = connectionClass(parsed.hostname, parsed.port, timeout=timeout)
+        try:
+            connection.request('GET', parsed.path or '/')
+            return connection.getresponse().status <= maxStatus
+        except (socket.error, socket.timeout, httplib.HTTPException):
+            return False
+        finally:
+            connection.close()
+    probe.description = url
+    return probe
+
+
+class ManagedService(object):
+
+    def __init__(self, name, start, requires=(), probe=None, timeout=300):
+        self.name = name
+        self.startFunction = start
+        self.requires = list(requires)
+        self.probe = probe
+        self.timeout = timeout
+        self.ready = threading.Event()
+        self.ok = None
+        self.waited = 0.0
+        self.started = None
+        self.finished = None
+
+
+class ServiceOrchestrator(object):
+    """ Dependency ordered, concurrent service start """
+
+    def __init__(self, logIt=None, pollInterval=0.5):
+        self.logIt = logIt or (lambda msg, errorLog=False: None)
+        self.pollInterval = pollInterval
+        self.services = {}
+        self.order = []
+
+    def add(self, name, start, requires=(), probe=None, timeout=300):
+        """Adds service. start is called to start it, requires lists names
+        of services which must be ready before. Requirements which were not
+        added are ignored."""
+        self.services[name] = ManagedService(name, start, requires, probe, timeout)
+        self.order.append(name)
+        return self
+
+    def waitReady(self, service):
+        if not service.probe:
+            return True
+        deadline = time.time() + service.timeout
+        while time.time() < deadline:
+            if service.probe():
+                return True
+            time.sleep(self.pollInterval)
+        return False
+
+    def runService(self, service):
+        waitStarted = time.time()
+        for name in service.requires:
+            if name in self.services:
+                self.services[name].ready.wait()
+                if not self.services[name].ok:
+                    self.logIt("Starting %s although %s it requires is not ready" % (service.name, name), True)
+        service.waited = time.time() - waitStarted
+
+        service.started = time.time()
+        try:
+            self.logIt("Starting service %s" % service.name)
+            service.startFunction()
+            service.ok = self.waitReady(service)
+            if not service.ok:
+                self.logIt("Service %s is not ready after %d seconds (%s)" % (service.name, service.timeout,
+                           getattr(service.probe, 'description', 'probe')), True)
+        except Exception, e:
+            self.logIt("Error starting service %s: %s" % (service.name, e), True)
+            service.ok = False
+        finally:
+            service.finished = time.time()
+            service.ready.set()
+
+    def checkDependencies(self):
+        visiting = set()
+        visited = set()
+
+        def visit(name, path):
+            if name in visited or name not in self.services:
+                return
+            if name in visiting:
+                raise ValueError("Circular service dependency: %s" % ' -> '.join(path + [name]))
+            visiting.add(name)
+            for required in self.services[name].requires:
+                visit(required, path + [name])
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.order:
+            visit(name, [])
+
+    def start(self):
+        """Starts all services and waits until they are ready or timed out.
+        Returns list of (name, ok, seconds waited for requirements, seconds
+        to start and become ready) in the order services were added."""
+        self.checkDependencies()
+        threads = []
+        for name in self.order:
+            thread = threading.Thread(target=self.runService, args=(self.services[name],), name='start-%s' % name)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        timings = []
+        for name in self.order:
+            service = self.services[name]
+            timings.append((name, service.ok, service.waited, service.finished - service.started))
+            self.logIt("Service %s %s in %.1f s (waited %.1f s for %s)" % (
+                        name, 'ready' if service.ok else 'NOT ready', service.finished - service.started,
+                        service.waited, ', '.join(service.requires) or 'nothing'), not service.ok)
+        return timings
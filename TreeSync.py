@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+
+"""
+Copies directory trees and files, skipping destination files which already
+have the same size and content hash as their source. Hashes are kept in a
+JSON cache keyed by path, size and mtime so unchanged files are not read
+again on the next run. Changed files are copied concurrently.
+"""
+
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import traceback
+import threading
+import ctypes
+import ctypes.util
+import multiprocessing
+
+from multiprocessing.pool import ThreadPool
+
+
+def _load_libc_sendfile():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendfile = libc.sendfile
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendfile.restype = ctypes.c_ssize_t
+    sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+    return sendfile
+
+_libc_sendfile = _load_libc_sendfile()
+
+
+def sendfile(outFd, inFd, count):
+    """Copies count bytes from inFd to outFd in kernel. Returns number of
+    bytes copied, raises OSError when sendfile can't be used for these files"""
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(outFd, inFd, None, count)
+    if not _libc_sendfile:
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+    sent = _libc_sendfile(outFd, inFd, None, count)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return sent
+
+
+class TreeSync(object):
+    """ Synchronizes files from source to destination by content """
+
+    blockSize = 1024 * 1024
+
+    def __init__(self, cacheFn=None, threads=None, logIt=None):
+        self.cacheFn = cacheFn
+        self.threads = threads or multiprocessing.cpu_count() * 2
+        self.logIt = logIt or (lambda msg, errorLog=False: None)
+        self.useSendfile = True
+        self.cacheLock = threading.Lock()
+        self.hashCache = {}
+        self.loadCache()
+
+    def loadCache(self):
+        if self.cacheFn and os.path.exists(self.cacheFn):
+            try:
+                with open(self.cacheFn) as f:
+                    self.hashCache = json.load(f)
+            except ValueError:
+                self.logIt("Ignoring invalid hash cache %s" % self.cacheFn, True)
+                self.hashCache = {}
+
+    def saveCache(self):
+        if not self.cacheFn:
+            return
+        cacheDir = os.path.dirname(os.path.abspath(self.cacheFn))
+        fd, tmpFn = tempfile.mkstemp(dir=cacheDir, prefix='.treesync.')
+        with os.fdopen(fd, 'w') as f:
+            with self.cacheLock:
+                json.dump(self.hashCache, f)
+        os.rename(tmpFn, self.cacheFn)
+
+    def fileHash(self, path, st=None):
+        """Returns sha1 of file content, read from cache if size and mtime
+        of the file didn't change"""
+        path = os.path.abspath(path)
+        st = st or os.stat(path)
+        with self.cacheLock:
+            cached = self.hashCache.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+            return cached[2]
+
+        fileHash = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.blockSize), b''):
+                fileHash.update(chunk)
+        digest = fileHash.hexdigest()
+        self.setHash(path, st, digest)
+        return digest
+
+    def setHash(self, path, st, digest):
+        with self.cacheLock:
+            self.hashCache[os.path.abspath(path)] = [st.st_size, st.st_mtime, digest]
+
+    def isUpToDate(self, src, dst):
+        try:
+            dstStat = os.stat(dst)
+        except OSError:
+            return False
+        srcStat = os.stat(src)
+        if srcStat.st_size != dstStat.st_size:
+            return False
+        return self.fileHash(src, srcStat) == self.fileHash(dst, dstStat)
+
+    def copyData(self, src, dst):
+        with open(src, 'rb') as fsrc:
+            size = os.fstat(fsrc.fileno()).st_size
+            with open(dst, 'wb') as fdst:
+                if self.useSendfile and size:
+                    copied = 0
+                    try:
+                        while copied < size:
+                            sent = sendfile(fdst.fileno(), fsrc.fileno(), size - copied)
+                            if not sent:
+                                break
+                            copied += sent
+                        return
+                    except OSError, e:
+                        if copied or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV):
+                            raise
+                        self.useSendfile = False
+                shutil.copyfileobj(fsrc, fdst, self.blockSize)
+
+    def copyFile(self, src, dst):
+        """Copies src to dst through a temporary file in the destination
+        folder, preserving mode and times"""
+        dstDir = os.path.dirname(dst)
+        fd, tmpFn = tempfile.mkstemp(dir=dstDir, prefix='.%s.' % os.path.basename(dst))
+        os.close(fd)
+        try:
+            self.copyData(src, tmpFn)
+            shutil.copystat(src, tmpFn)
+            os.rename(tmpFn, dst)
+        except:
+            if os.path.exists(tmpFn):
+                os.remove(tmpFn)
+            raise
+
+    def syncFile(self, job):
+        src, dst, overwrite, inPlace, keepGoing = job
+        try:
+            return self.syncFileData(src, dst, overwrite, inPlace)
+        except:
+            if not keepGoing:
+                raise
+            self.logIt("Error writing %s to %s" % (src, dst), True)
+            self.logIt(traceback.format_exc(), True)
+            return None, 0
+
+    def syncFileData(self, src, dst, overwrite, inPlace):
+        dstDir = os.path.dirname(dst)
+        if dstDir and not os.path.exists(dstDir):
+            try:
+                os.makedirs(dstDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        size = os.path.getsize(src)
+        if not overwrite and self.isUpToDate(src, dst):
+            return False, size
+        if inPlace:
+            # keeps inode, owner, SELinux label and symlinks of dst and
+            # works for bind mounted files like /etc/hosts in containers
+            self.copyData(src, dst)
+        else:
+            self.copyFile(src, dst)
+        srcStat = os.stat(src)
+        with self.cacheLock:
+            cached = self.hashCache.get(os.path.abspath(src))
+        if cached and cached[0] == srcStat.st_size and cached[1] == srcStat.st_mtime:
+            self.setHash(dst, os.stat(dst), cached[2])
+        return True, size
+
+    def syncFiles(self, pairs, overwrite=False, inPlace=False, keepGoing=False):
+        """Copies list of (source file, destination file) pairs. Returns dict
+        with number of files and bytes copied and skipped. inPlace writes
+        into the existing destination files instead of renaming a copy over
+        them. keepGoing logs errors of single files and counts them in
+        files_failed instead of raising."""
+        stats = {'files_copied': 0, 'bytes_copied': 0, 'files_skipped': 0, 'bytes_skipped': 0}
+        if keepGoing:
+            stats['files_failed'] = 0
+        jobs = [(src, dst, overwrite, inPlace, keepGoing) for src, dst in pairs]
+
+        if not jobs:
+            return stats
+
+        pool = ThreadPool(max(1, min(int(self.threads), len(jobs))))
+        try:
+            results = pool.map(self.syncFile, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        for copied, size in results:
+            if copied is None:
+                stats['files_failed'] += 1
+            elif copied:
+                stats['files_copied'] += 1
+                stats['bytes_copied'] += size
+            else:
+                stats['files_skipped'] += 1
+                stats['bytes_skipped'] += size
+
+        self.saveCache()
+        return stats
+
+    def syncTree(self, src, dst, overwrite=False):
+        """Copies content of src folder into dst folder. Files of dst which
+        are not in src are left in place"""
+        pairs = []
+        for root, dirs, files in os.walk(src, followlinks=True):
+            dstRoot = os.path.join(dst, os.path.relpath(root, src))
+            if not os.path.exists(dstRoot):
+                os.makedirs(dstRoot)
+            for fn in files:
+                pairs.append((os.path.join(root, fn), os.path.join(dstRoot, fn)))
+
+        return self.syncFiles(pairs, overwrite)
@@ -49,83 +49,91 @@ class SchemaGenerator(object):
             items.extend(self.__get_macro_order(macros, k))
         return items
 
-    def generate_schema(self):
-        """Function that generates the schema and returns it as a string"""
-        self.outString = u''
-        self.outString += self.header if self.header else u""
-        if len(self.outString):
-            self.outString += u"\n"
-        if len(self.data['oidMacros']) > 0:
-            macros = self.data['oidMacros']
-            root = ''
-            for definition in macros:
-                if '.' in macros[definition]:
-                    root = definition
-                    break
-            order = self.__get_macro_order(macros, root)
-
-            for oid in order:
-                self.outString += u"objectIdentifier {:15} {}\n".format(
-                        oid, macros[oid])
-            self.outString += '\n'
+    def _names(self, model, kind):
+        names = model['names']
+        if len(names) > 1:
+            return u"( {})".format(u''.join(u"'{}' ".format(name) for name in names))
+        elif len(names) == 1:
+            return u"'{}'".format(names[0])
+        print "Invalid {} data. Doesn't define a name".format(kind)
+        return u''
+
+    def _attribute(self, attr, keyword, oid, indent, end):
+        """Returns definition of attribute type as list of strings"""
+        parts = [u"{} ( {} NAME ".format(keyword, oid), self._names(attr, 'attribute')]
+        if 'desc' in attr:
+            parts.append(u"{}DESC '{}'".format(indent, attr['desc']))
+        for key, label in [('equality', u'EQUALITY'), ('substr', u'SUBSTR'),
+                           ('syntax', u'SYNTAX'), ('ordering', u'ORDERING')]:
+            if key in attr:
+                parts.append(u"{}{} {}".format(indent, label, attr[key]))
+        if 'x_origin' in attr:
+            parts.append(u"{}X-ORIGIN '{}'".format(indent, attr['x_origin']))
+        parts.append(end)
+        return parts
+
+    def _objectclass(self, obc, keyword, oid, indent, end):
+        """Returns definition of object class as list of strings"""
+        parts = [u"{} ( {} NAME ".format(keyword, oid), self._names(obc, 'objectclass')]
+        if 'desc' in obc:
+            parts.append(u"{}DESC '{}'".format(indent, obc['desc']))
+        if 'sup' in obc:
+            parts.append(u"{}SUP ( {} )".format(indent, u" $ ".join(obc['sup'])))
+        parts.append(u"{}{}".format(indent, obc['kind']))
+        if 'must' in obc:
+            parts.append(u"{}MUST ( {} )".format(indent, u" $ ".join(obc['must'])))
+        if 'may' in obc:
+            parts.append(u"{}MAY ( {} )".format(indent, u" $ ".join(obc['may'])))
+        if 'x_origin' in obc:
+            parts.append(u"{}X-ORIGIN '{}'".format(indent, obc['x_origin']))
+        parts.append(end)
+        return parts
+
+    def _header(self):
+        header = self.header if self.header else u""
+        return [header, u"\n"] if len(header) else []
+
+    def _macros(self):
+        macros = self.data['oidMacros']
+        if not len(macros) > 0:
+            return []
+        root = ''
+        for definition in macros:
+            if '.' in macros[definition]:
+                root = definition
+                break
+        parts = [u"objectIdentifier {:15} {}\n".format(oid, macros[oid])
+                 for oid in self.__get_macro_order(macros, root)]
+        parts.append(u'\n')
+        return parts
+
+    def generate_all(self):
+        """Generates the OpenLDAP schema and OpenDJ LDIF schema in one pass
+        over the definitions and returns them as (schema, ldif) strings"""
+        schema = self._header() + self._macros()
+        ldif = self._header()
+        ldif.append(u"dn: cn=schema\nobjectClass: top\nobjectClass: "
+                    u"ldapSubentry\nobjectClass: subschema\ncn: schema\n")
 
         for attr in self.data['attributeTypes']:
-            attr_str = u"attributetype ( {} NAME ".format(attr['oid'])
-            if len(attr['names']) > 1:
-                namestring = u''
-                for name in attr['names']:
-                    namestring += u"'{}' ".format(name)
-                attr_str += u"( {})".format(namestring)
-            elif len(attr['names']) == 1:
-                attr_str += u"'{}'".format(attr['names'][0])
-            else:
-                print "Invalid attribute data. Doesn't define a name"
-            if 'desc' in attr:
-                attr_str += u"\n\tDESC '{}'".format(attr['desc'])
-            if 'equality' in attr:
-                attr_str += u"\n\tEQUALITY {}".format(attr['equality'])
-            if 'substr' in attr:
-                attr_str += u"\n\tSUBSTR {}".format(attr['substr'])
-            if 'syntax' in attr:
-                attr_str += u"\n\tSYNTAX {}".format(attr['syntax'])
-            if 'ordering' in attr:
-                attr_str += u"\n\tORDERING {}".format(attr['ordering'])
-            if 'x_origin' in attr:
-                attr_str += u"\n\tX-ORIGIN '{}'".format(attr['x_origin'])
-            attr_str += u" )\n\n"
-
-            self.outString += attr_str
+            schema.extend(self._attribute(attr, u'attributetype', attr['oid'], u"\n\t", u" )\n\n"))
+            ldif.extend(self._attribute(attr, u'attributeTypes:', self._getOID(attr), u"\n  ", u" )\n"))
 
         for obc in self.data['objectClasses']:
-            obc_str = u"objectclass ( {} NAME ".format(obc['oid'])
-            if len(obc['names']) > 1:
-                namestring = ''
-                for name in obc['names']:
-                    namestring += u"'{}' ".format(name)
-                obc_str += u"( {})".format(namestring)
-            elif len(obc['names']) == 1:
-                obc_str += u"'{}'".format(obc['names'][0])
-            else:
-                print "Invalid objectclass data. Doesn't define a name"
-            if 'desc' in obc:
-                obc_str += u"\n\tDESC '{}'".format(obc['desc'])
-            if 'sup' in obc:
-                sup = u" $ ".join(obc['sup'])
-                obc_str += u"\n\tSUP ( {} )".format(sup)
-            obc_str += u"\n\t{}".format(obc['kind'])
-            if 'must' in obc:
-                must = u" $ ".join(obc['must'])
-                obc_str += "\n\tMUST ( {} )".format(must)
-            if 'may' in obc:
-                may = u" $ ".join(obc['may'])
-                obc_str += "\n\tMAY ( {} )".format(may)
-            if 'x_origin' in obc:
-                obc_str += u"\n\tX-ORIGIN '{}'".format(obc['x_origin'])
-            obc_str += u" )\n\n"
-
-            self.outString += obc_str
-
-        return self.outString.strip()
+            schema.extend(self._objectclass(obc, u'objectclass', obc['oid'], u"\n\t", u" )\n\n"))
+            ldif.extend(self._objectclass(obc, u'objectClasses:', self._getOID(obc), u"\n  ", u" )\n"))
+
+        # Remove excess spaces and a new line at the end of the file
+        return u''.join(schema).strip(), u''.join(ldif).strip() + u'\n\n'
+
+    def generate_schema(self):
+        """Function that generates the schema and returns it as a string"""
+        parts = self._header() + self._macros()
+        for attr in self.data['attributeTypes']:
+            parts.extend(self._attribute(attr, u'attributetype', attr['oid'], u"\n\t", u" )\n\n"))
+        for obc in self.data['objectClasses']:
+            parts.extend(self._objectclass(obc, u'objectclass', obc['oid'], u"\n\t", u" )\n\n"))
+        return u''.join(parts).strip()
 
     def _getOID(self, model):
         oid = model['oid']
@@ -138,69 +146,4 @@ class SchemaGenerator(object):
 
     def generate_ldif(self):
         """Function which generates the OpenDJ LDIF format schema string."""
-        self.outString = u''
-        self.outString += self.header if self.header else u""
-        if len(self.outString):
-            self.outString += u"\n"
-        self.outString += u"dn: cn=schema\nobjectClass: top\nobjectClass: " \
-            + u"ldapSubentry\nobjectClass: subschema\ncn: schema\n"
-
-        for attr in self.data['attributeTypes']:
-            attr_str = u"attributeTypes: ( {} NAME ".format(self._getOID(attr))
-            if len(attr['names']) > 1:
-                namestring = u''
-                for name in attr['names']:
-                    namestring += u"'{}' ".format(name)
-                attr_str += u"( {})".format(namestring)
-            elif len(attr['names']) == 1:
-                attr_str += u"'{}'".format(attr['names'][0])
-            else:
-                print "Invalid attribute data. Doesn't define a name"
-            if 'desc' in attr:
-                attr_str += u"\n  DESC '{}'".format(attr['desc'])
-            if 'equality' in attr:
-                attr_str += u"\n  EQUALITY {}".format(attr['equality'])
-            if 'substr' in attr:
-                attr_str += u"\n  SUBSTR {}".format(attr['substr'])
-            if 'syntax' in attr:
-                attr_str += u"\n  SYNTAX {}".format(attr['syntax'])
-            if 'ordering' in attr:
-                attr_str += u"\n  ORDERING {}".format(attr['ordering'])
-            if 'x_origin' in attr:
-                attr_str += u"\n  X-ORIGIN '{}'".format(attr['x_origin'])
-            attr_str += u" )\n"
-
-            self.outString += attr_str
-
-        for obc in self.data['objectClasses']:
-            obc_str = u"objectClasses: ( {} NAME ".format(self._getOID(obc))
-            if len(obc['names']) > 1:
-                namestring = ''
-                for name in obc['names']:
-                    namestring += u"'{}' ".format(name)
-                obc_str += u"( {})".format(namestring)
-            elif len(obc['names']) == 1:
-                obc_str += u"'{}'".format(obc['names'][0])
-            else:
-                print "Invalid objectclass data. Doesn't define a name"
-            if 'desc' in obc:
-                obc_str += u"\n  DESC '{}'".format(obc['desc'])
-            if 'sup' in obc:
-                sup = u" $ ".join(obc['sup'])
-                obc_str += u"\n  SUP ( {} )".format(sup)
-            obc_str += u"\n  {}".format(obc['kind'])
-            if 'must' in obc:
-                must = u" $ ".join(obc['must'])
-                obc_str += "\n  MUST ( {} )".format(must)
-            if 'may' in obc:
-                may = u" $ ".join(obc['may'])
-                obc_str += "\n  MAY ( {} )".format(may)
-            if 'x_origin' in obc:
-                obc_str += u"\n  X-ORIGIN '{}'".format(obc['x_origin'])
-            obc_str += u" )\n"
-
-            self.outString += obc_str
-
-        # Remove excess spaces and a new line at the end of the file
-        self.outString = self.outString.strip() + '\n\n'
-        return self.outString
+        return self.generate_all()[1]
@@ -5,11 +5,13 @@ manager.py - Script which acts as the user interface for schema management.
 """
 
 import argparse
+import hashlib
 import json
 import os
 
 from schema_parser import LDAPSchemaParser
 from generator import SchemaGenerator
+from model import SchemaModel, RENDERERS
 
 localdir = os.path.dirname(os.path.abspath(__file__))
 
@@ -31,32 +33,62 @@ def generate(infile, schema_type=None):
     print schema_str.encode('utf-8')
 
 
-def autogenerate():
+def _sha1(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def autogenerate(openldap_folder=None, opendj_folder=None, cache_dir=None):
     """Function that generates the LDAP schemas for OpenDJ, OpenLDAP from the
     gluu_schema.json and custom_schema.json and puts them in their respective
     folders.
-    """
-    openldap_folder = os.path.join(os.path.dirname(localdir), 'static/openldap/')
-    opendj_folder = os.path.join(os.path.dirname(localdir), 'static/opendj/deprecated/')
 
-    fp = open(os.path.join(localdir, 'gluu_schema.json'), 'r')
-    gluu_json = fp.read()
-    fp.close()
-    gen = SchemaGenerator(gluu_json)
-    with open(os.path.join(openldap_folder, 'gluu.schema'), 'w') as f:
-        f.write(gen.generate_schema().encode('utf-8'))
-    with open(os.path.join(opendj_folder, '101-ox.ldif'), 'w') as f:
-        f.write(gen.generate_ldif().encode('utf-8'))
-
-    fp = open(os.path.join(localdir, 'custom_schema.json'), 'r')
-    custom_json = fp.read()
-    fp.close()
-    gen = SchemaGenerator(custom_json)
-    with open(os.path.join(openldap_folder, 'custom.schema'), 'w') as f:
-        f.write(gen.generate_schema().encode('utf-8'))
-    with open(os.path.join(opendj_folder, '77-customAttributes.ldif'), 'w') \
-            as f:
-        f.write(gen.generate_ldif().encode('utf-8'))
+    A JSON file whose content and outputs are unchanged since the last run,
+    as recorded in autogenerate.json of the cache folder, is skipped.
+    """
+    openldap_folder = openldap_folder or os.path.join(os.path.dirname(localdir), 'static/openldap/')
+    opendj_folder = opendj_folder or os.path.join(os.path.dirname(localdir), 'static/opendj/deprecated/')
+    cache_dir = cache_dir or os.path.join(localdir, '.cache')
+    cache_fn = os.path.join(cache_dir, 'autogenerate.json')
+
+    cache = {}
+    if os.path.exists(cache_fn):
+        with open(cache_fn) as f:
+            cache = json.load(f)
+
+    targets = [
+        ('gluu_schema.json', os.path.join(openldap_folder, 'gluu.schema'),
+         os.path.join(opendj_folder, '101-ox.ldif')),
+        ('custom_schema.json', os.path.join(openldap_folder, 'custom.schema'),
+         os.path.join(opendj_folder, '77-customAttributes.ldif')),
+    ]
+
+    changed = False
+    for json_name, schema_fn, ldif_fn in targets:
+        with open(os.path.join(localdir, json_name), 'r') as f:
+            json_text = f.read()
+        entry = cache.get(json_name, {})
+        digest = hashlib.sha1(json_text).hexdigest()
+        if entry.get('json') == digest and entry.get('schema') == _sha1(schema_fn) \
+                and entry.get('ldif') == _sha1(ldif_fn):
+            continue
+
+        schema_str, ldif_str = SchemaGenerator(json_text).generate_all()
+        with open(schema_fn, 'w') as f:
+            f.write(schema_str.encode('utf-8'))
+        with open(ldif_fn, 'w') as f:
+            f.write(ldif_str.encode('utf-8'))
+        cache[json_name] = {'json': digest, 'schema': _sha1(schema_fn),
+                            'ldif': _sha1(ldif_fn)}
+        changed = True
+
+    if changed:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_fn, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
 
 
 def run_tests():
@@ -70,72 +102,17 @@ def make_json(filename):
     """Function that parses the input schema file and generates JSON.
     """
     parser = LDAPSchemaParser(filename)
-    definitions = parser.parse()
-    schema_dict = {}
-    objectclasses = []
-    attributetypes = []
-    for obj in definitions['objectClasses']:
-        obcl = {}
-        props = ['oid', 'names', 'desc', 'must', 'may', 'sup', 'x_origin']
-        for prop in props:
-            if hasattr(obj, prop):
-                if getattr(obj, prop):
-                    obcl[prop] = getattr(obj, prop)
-        # obcl['obsolete'] = obj.obsolete
-        if obj.kind == 0:
-            obcl['kind'] = 'STRUCTURAL'
-        elif obj.kind == 1:
-            obcl['kind'] = 'ABSTRACT'
-        elif obj.kind == 2:
-            obcl['kind'] = 'AUXILIARY'
-        objectclasses.append(obcl)
-
-    for att in definitions['attributeTypes']:
-        attype = {}
-        props = ['oid', 'names', 'desc', 'equality', 'substr', 'ordering',
-                 'syntax', 'x_origin']
-        for prop in props:
-            if hasattr(att, prop):
-                if getattr(att, prop):
-                    attype[prop] = getattr(att, prop)
-        # attype['no_user_mod'] = att.no_user_mod
-        # attype['single_value'] = att.single_value
-        # attype['obsolete'] = att.obsolete
-        attributetypes.append(attype)
-
-    schema_dict['objectClasses'] = objectclasses
-    schema_dict['attributeTypes'] = attributetypes
-    schema_dict['oidMacros'] = definitions['oidMacros']
+    schema_dict = parser.parse_json(cache_dir=os.path.join(localdir, '.cache'))
     print json.dumps(schema_dict, indent=4, sort_keys=True)
 
 
-def make_schema_docs():
-    schema = os.path.join(localdir, 'gluu_schema.json')
-    f = open(schema)
-    json_string = f.read()
-    f.close()
-    data = json.loads(json_string)
-    objClasses = data['objectClasses']
-    attTypes = data['attributeTypes']
-    docs = ''
-
-    for obj_class in objClasses:
-        docs += "\n\n## {}".format(" (or) ".join(obj_class['names']))
-        if 'desc' in obj_class:
-            docs += "\n_{}_".format(obj_class['desc'].encode('utf-8'))
-
-        for obj_attr in obj_class['may']:
-            attr_docs_added = False
-            for attr_type in attTypes:
-                if obj_attr in attr_type['names']:
-                    docs += "\n* __{}__".format(" (or) ".join(attr_type['names']))
-                    if 'desc' in attr_type:
-                        docs += ":  {}".format(attr_type['desc'].encode('utf-8'))
-                    attr_docs_added = True
-                    break
-            if not attr_docs_added:
-                docs += "\n* __{}__".format(obj_attr)
-    print docs
+def make_schema_docs(output_format='markdown'):
+    """Function that prints the documentation of the object classes and their
+    attributes of gluu_schema.json as markdown, json or html.
+    """
+    schema = SchemaModel.from_json_file(os.path.join(localdir, 'gluu_schema.json'))
+    docs = RENDERERS[output_format](schema.docs())
+    print docs.encode('utf-8')
 
 
 if __name__ == '__main__':
@@ -146,6 +123,9 @@ if __name__ == '__main__':
     parser.add_argument(
         "--type", help="the schema type you want to generate",
         choices=["openldap", "opendj"])
+    parser.add_argument(
+        "--format", help="the output format of the docs", default="markdown",
+        choices=["markdown", "json", "html"])
     parser.add_argument(
         "--filename", help="the input file for various actions")
     args = parser.parse_args()
@@ -165,4 +145,4 @@ if __name__ == '__main__':
     elif args.action == 'autogenerate':
         autogenerate()
     elif args.action == 'makedocs':
-        make_schema_docs()
+        make_schema_docs(args.format)
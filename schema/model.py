@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Module containing the schema model shared by the schema tools.
+
+The model holds attribute types and object classes in the dict format of
+gluu_schema.json and indexes them by every name, case-insensitive, and by
+OID, so lookups don't scan the definitions.
+"""
+
+import re
+import cgi
+import json
+import base64
+
+definition_re = re.compile(r"\(|\)|\$|'(?:[^'\\]|\\.)*'|[^\s()$']+")
+
+KINDS = ('STRUCTURAL', 'ABSTRACT', 'AUXILIARY')
+# keywords followed by a quoted string, a list of them or an OID list
+QDSTRING_KEYS = {'DESC': 'desc', 'X-ORIGIN': 'x_origin'}
+OIDS_KEYS = {'SUP': 'sup', 'MUST': 'must', 'MAY': 'may'}
+OID_KEYS = {'EQUALITY': 'equality', 'SUBSTR': 'substr',
+            'ORDERING': 'ordering', 'SYNTAX': 'syntax'}
+
+
+def parse_definition(text):
+    """Parses an RFC 4512 attribute type or object class description, as
+    found in .schema and LDIF schema files, into the dict format of
+    gluu_schema.json"""
+    tokens = definition_re.findall(text)
+    if not tokens or tokens[0] != '(':
+        raise ValueError("Invalid schema definition: {}".format(text))
+    definition = {'oid': tokens[1]}
+    pos = 2
+
+    def values():
+        # a single value or a parenthesized list separated by spaces or $
+        if tokens[pos] != '(':
+            return [tokens[pos]], pos + 1
+        end = tokens.index(')', pos)
+        return [t for t in tokens[pos + 1:end] if t != '$'], end + 1
+
+    while pos < len(tokens) and tokens[pos] != ')':
+        keyword = tokens[pos].upper()
+        pos += 1
+        if keyword == 'NAME':
+            names, pos = values()
+            definition['names'] = [name.strip("'") for name in names]
+        elif keyword in QDSTRING_KEYS:
+            strings, pos = values()
+            definition[QDSTRING_KEYS[keyword]] = u' '.join(s[1:-1] for s in strings)
+        elif keyword in OIDS_KEYS:
+            definition[OIDS_KEYS[keyword]], pos = values()
+        elif keyword in OID_KEYS:
+            definition[OID_KEYS[keyword]] = tokens[pos]
+            pos += 1
+        elif keyword in KINDS:
+            definition['kind'] = keyword
+        elif keyword == 'SINGLE-VALUE':
+            definition['single_value'] = True
+        elif keyword == 'USAGE':
+            pos += 1
+        elif keyword.startswith('X-'):
+            pos = values()[1]
+    return definition
+
+
+def read_ldif_schema(fileobj):
+    """Yields the unfolded attribute lines of an LDIF file, like the OpenDJ
+    schema files"""
+    line = None
+    for raw in fileobj:
+        raw = raw.rstrip('\r\n')
+        if raw.startswith(' ') and line is not None:
+            line += raw[1:]
+            continue
+        if line:
+            yield line
+        line = raw if raw and not raw.startswith('#') else None
+    if line:
+        yield line
+
+
+class SchemaModel(object):
+    """ Attribute types and object classes indexed by name and OID """
+
+    def __init__(self, data=None):
+        self.attributeTypes = []
+        self.objectClasses = []
+        self.oidMacros = {}
+        self.attributeIndex = {}
+        self.objectClassIndex = {}
+        if data:
+            self.add(data)
+
+    @classmethod
+    def from_json_file(cls, filename):
+        with open(filename) as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_ldif_file(cls, filename):
+        """Loads an LDIF schema file, like 101-ox.ldif of OpenDJ"""
+        data = {'attributeTypes': [], 'objectClasses': []}
+        keys = {'attributetypes': 'attributeTypes', 'objectclasses': 'objectClasses'}
+        with open(filename) as f:
+            for line in read_ldif_schema(f):
+                attr, _, value = line.partition(':')
+                key = keys.get(attr.lower())
+                if not key:
+                    continue
+                if value.startswith(':'):
+                    value = base64.b64decode(value[1:].strip())
+                data[key].append(parse_definition(value.strip().decode('utf-8')))
+        return cls(data)
+
+    @classmethod
+    def from_schema_file(cls, filename, cache_dir=None):
+        """Loads an OpenLDAP .schema file through LDAPSchemaParser"""
+        from schema_parser import LDAPSchemaParser
+        return cls(LDAPSchemaParser(filename).parse_json(cache_dir=cache_dir))
+
+    @classmethod
+    def from_files(cls, filenames, cache_dir=None):
+        """Loads LDIF, .schema and JSON schema files into one model"""
+        schema = cls()
+        for filename in filenames:
+            if filename.endswith('.json'):
+                part = cls.from_json_file(filename)
+            elif filename.endswith('.schema'):
+                part = cls.from_schema_file(filename, cache_dir)
+            else:
+                part = cls.from_ldif_file(filename)
+            schema.add(part.to_dict())
+        return schema
+
+    def to_dict(self):
+        return {'attributeTypes': self.attributeTypes,
+                'objectClasses': self.objectClasses,
+                'oidMacros': self.oidMacros}
+
+    def add(self, data):
+        """Adds the definitions of a gluu_schema.json like dict. Definitions
+        of names already known replace the earlier ones in the indexes."""
+        self.oidMacros.update(data.get('oidMacros') or {})
+        for attr in data.get('attributeTypes', []):
+            self.attributeTypes.append(attr)
+            self._index(self.attributeIndex, attr)
+        for obc in data.get('objectClasses', []):
+            self.objectClasses.append(obc)
+            self._index(self.objectClassIndex, obc)
+        return self
+
+    def _index(self, index, definition):
+        for name in definition.get('names', []):
+            index[name.lower()] = definition
+        index[definition['oid'].lower()] = definition
+        oid = self.expand_oid(definition['oid'])
+        if oid != definition['oid']:
+            index[oid] = definition
+
+    def expand_oid(self, oid):
+        """Returns oid with OpenLDAP style macros replaced by their dotted
+        numeric value"""
+        seen = set()
+        while ':' in oid and oid not in seen:
+            seen.add(oid)
+            macro, index = oid.split(':', 1)
+            if macro not in self.oidMacros:
+                break
+            oid = self.oidMacros[macro] + '.' + index
+        return oid
+
+    def attribute(self, name):
+        """Returns attribute type of name, alias or OID, None if unknown"""
+        return self.attributeIndex.get(name.lower())
+
+    def objectclass(self, name):
+        """Returns object class of name, alias or OID, None if unknown"""
+        return self.objectClassIndex.get(name.lower())
+
+    def docs(self):
+        """Returns list of object classes with the names and descriptions
+        of their MAY attributes for the documentation, name is the attribute
+        name as the object class lists it"""
+        docs = []
+        for obc in self.objectClasses:
+            attributes = []
+            for name in obc.get('may', []):
+                attr = self.attribute(name)
+                if attr:
+                    attributes.append({'name': name, 'names': attr['names'], 'desc': attr.get('desc')})
+                else:
+                    attributes.append({'name': name, 'names': [name], 'desc': None})
+            docs.append({'names': obc.get('names', []), 'desc': obc.get('desc'),
+                         'attributes': attributes})
+        return docs
+
+
+def render_markdown(docs):
+    parts = []
+    for obc in docs:
+        parts.append(u"\n\n## {}".format(u" (or) ".join(obc['names'])))
+        if obc['desc']:
+            parts.append(u"\n_{}_".format(obc['desc']))
+        for attr in obc['attributes']:
+            parts.append(u"\n* __{}__".format(u" (or) ".join(attr['names'])))
+            if attr['desc']:
+                parts.append(u":  {}".format(attr['desc']))
+    return u''.join(parts)
+
+
+def render_json(docs):
+    return json.dumps(docs, indent=2)
+
+
+def render_html(docs):
+    parts = [u"<html>\n<head><meta charset=\"utf-8\"><title>Gluu Server LDAP Schema</title></head>\n<body>"]
+    for obc in docs:
+        parts.append(u"<h2>{}</h2>".format(cgi.escape(u" (or) ".join(obc['names']))))
+        if obc['desc']:
+            parts.append(u"<p><em>{}</em></p>".format(cgi.escape(obc['desc'])))
+        parts.append(u"<ul>")
+        for attr in obc['attributes']:
+            item = u"<li><strong>{}</strong>".format(cgi.escape(u" (or) ".join(attr['names'])))
+            if attr['desc']:
+                item += u": {}".format(cgi.escape(attr['desc']))
+            parts.append(item + u"</li>")
+        parts.append(u"</ul>")
+    parts.append(u"</body>\n</html>\n")
+    return u'\n'.join(parts)
+
+
+RENDERERS = {
+    'markdown': render_markdown,
+    'json': render_json,
+    'html': render_html,
+}
@@ -3,10 +3,26 @@
 """Module containing the functions to parse the LDAP schema files.
 """
 
+import os
 import re
+import json
+import hashlib
 import logging
 
-from ldap.schema.models import ObjectClass, AttributeType
+try:
+    from ldap.schema.models import ObjectClass, AttributeType
+except ImportError:
+    ObjectClass = AttributeType = None
+
+OBJECTCLASS_KINDS = {0: 'STRUCTURAL', 1: 'ABSTRACT', 2: 'AUXILIARY'}
+OBJECTCLASS_PROPS = ['oid', 'names', 'desc', 'must', 'may', 'sup', 'x_origin']
+ATTRIBUTETYPE_PROPS = ['oid', 'names', 'desc', 'equality', 'substr',
+                       'ordering', 'syntax', 'x_origin']
+
+
+def _plain(value):
+    """python-ldap keeps multiple values as tuples, JSON has lists"""
+    return list(value) if isinstance(value, tuple) else value
 
 
 class LDAPSchemaParser(object):
@@ -55,11 +71,14 @@ class LDAPSchemaParser(object):
         blocks = f.read().split('\n\n')
 
         for block in blocks:
-            block = block.strip()
+            # comments may directly precede a definition, like in the
+            # schema files shipped with OpenLDAP
+            block = '\n'.join(line for line in block.split('\n')
+                              if not line.lstrip().startswith('#')).strip()
             if 'objectIdentifier' in block:
                 oid_macros = self.__parseOIDMacros(block)
                 self.macros = self.__getMacroDefinitions(block)
-            elif re.match('^objectclass', block):
+            elif re.match('^objectclass', block, re.I):
                 block = block.replace('\n', ' ').replace('\t', ' ').strip()
                 obj = ObjectClass(block[obj_len:])
                 # Extra parsing to get the X-ORIGIN values as the python-ldap
@@ -69,7 +88,7 @@ class LDAPSchemaParser(object):
                     parts = originstr.strip().split('\'')
                     obj.x_origin = parts[1]
                 self.objClasses.append(obj)
-            elif re.match('^attributetype', block):
+            elif re.match('^attributetype', block, re.I):
                 block = block.replace('\n', ' ').replace('\t', ' ').strip()
                 att = AttributeType(block[att_len:])
                 self.attrTypes.append(att)
@@ -128,14 +147,66 @@ class LDAPSchemaParser(object):
                     }
                 }
         """
+        if ObjectClass is None:
+            raise ImportError("python-ldap is required to parse schema files")
         with open(self.filename, 'r') as ldapfile:
             for line in ldapfile:
                 if 'objectClasses: ' in line or 'attributeTypes: ' in line:
                     self.__parseLDIF()
                     break
                 elif 'objectclass ' in line or 'attributetype ' in line:
-                    self.__parseSchema()
+                    self.__parseSchema(expand_oid_macros)
                     break
         return {'objectClasses': self.objClasses,
                 'attributeTypes': self.attrTypes,
                 'oidMacros': self.macros}
+
+    def parse_json(self, expand_oid_macros=False, cache_dir=None):
+        """Function to parse the LDAP Schema File into the JSON format of
+        gluu_schema.json
+
+        Args:
+            expand_oid_macros (bool) - same as for parse()
+            cache_dir (str) - folder where the result is kept, keyed by the
+                hash of the file content, so the file is parsed again only
+                when it changes. Default None, no caching.
+
+        Returns:
+            dict: A dictionary with 'objectClasses' and 'attributeTypes' as
+            lists of dicts of their properties and 'oidMacros'
+        """
+        cache_fn = None
+        if cache_dir:
+            with open(self.filename, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            cache_fn = os.path.join(cache_dir, '{}-{}.json'.format(
+                digest, int(bool(expand_oid_macros))))
+            if os.path.exists(cache_fn):
+                with open(cache_fn) as f:
+                    return json.load(f)
+
+        definitions = self.parse(expand_oid_macros)
+        schema_dict = {
+            'objectClasses': [],
+            'attributeTypes': [],
+            'oidMacros': definitions['oidMacros'],
+        }
+        for obj in definitions['objectClasses']:
+            obcl = dict((prop, _plain(getattr(obj, prop))) for prop in OBJECTCLASS_PROPS
+                        if getattr(obj, prop, None))
+            if obj.kind in OBJECTCLASS_KINDS:
+                obcl['kind'] = OBJECTCLASS_KINDS[obj.kind]
+            schema_dict['objectClasses'].append(obcl)
+        for att in definitions['attributeTypes']:
+            schema_dict['attributeTypes'].append(
+                dict((prop, _plain(getattr(att, prop))) for prop in ATTRIBUTETYPE_PROPS
+                     if getattr(att, prop, None)))
+
+        if cache_fn:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_fn = cache_fn + '.tmp'
+            with open(tmp_fn, 'w') as f:
+                json.dump(schema_dict, f)
+            os.rename(tmp_fn, cache_fn)
+        return schema_dict
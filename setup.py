@@ -40,8 +40,242 @@ import hashlib
 import re
 import glob
 import base64
+import threading
+import logging
+import tempfile
+import multiprocessing
+import struct
+import datetime
+import atexit
+import signal
+import collections
+import copy
+import tarfile
+import zipfile
+import fnmatch
+import Queue
+
+from multiprocessing.pool import ThreadPool
 
 from pyDes import *
+from TreeSync import TreeSync
+from PermissionPlan import PermissionPlan
+from Downloader import Downloader
+from ServiceOrchestrator import ServiceOrchestrator, tcp_probe, http_probe
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+except ImportError:
+    # Certificates are generated with openssl/keytool commands
+    x509 = None
+
+
+class SetupProfiler(object):
+    """Collects wall, CPU and child process times of Setup steps and of the
+    commands they run. The result is written as a Chrome trace-event file
+    (load it in chrome://tracing) and as a ranked summary."""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.started = time.time()
+
+    def now(self):
+        times = os.times()
+        return time.time(), times[0] + times[1], times[2] + times[3]
+
+    def begin(self, name, category, args=None):
+        return (name, category, args or {}, self.now())
+
+    def end(self, token):
+        name, category, args, started = token
+        wall, cpu, children = self.now()
+        event = {'name': name,
+                 'cat': category,
+                 'ph': 'X',
+                 'pid': self.pid,
+                 'tid': threading.current_thread().ident,
+                 'ts': int((started[0] - self.started) * 1000000),
+                 'dur': int((wall - started[0]) * 1000000),
+                 'args': dict(args, cpu_ms=int((cpu - started[1]) * 1000),
+                                    children_ms=int((children - started[2]) * 1000))
+                 }
+        with self.lock:
+            self.events.append(event)
+
+    def profile_method(self, func):
+        def profiled(obj, *args, **kwargs):
+            if getattr(obj, 'profiler', None) is not self:
+                return func(obj, *args, **kwargs)
+            token = self.begin(func.__name__, 'step')
+            try:
+                return func(obj, *args, **kwargs)
+            finally:
+                self.end(token)
+        profiled.__name__ = func.__name__
+        profiled.__doc__ = func.__doc__
+        return profiled
+
+    def instrument(self, cls, exclude=('logIt', 'run', 'serializable')):
+        """Wraps every public method of cls so its calls are recorded"""
+        for name, func in cls.__dict__.items():
+            if name.startswith('__') or name in exclude or not callable(func):
+                continue
+            setattr(cls, name, self.profile_method(func))
+
+    def write_trace(self, fn):
+        f = open(fn, 'w')
+        f.write(json.dumps({'traceEvents': self.events, 'displayTimeUnit': 'ms'}))
+        f.close()
+
+    def summary(self, limit=25):
+        """Returns text table of steps and commands ranked by total wall time"""
+        totals = {}
+        for event in self.events:
+            key = (event['cat'], event['name'])
+            total = totals.setdefault(key, [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += event['dur'] / 1000
+            total[2] += event['args']['cpu_ms']
+            total[3] += event['args']['children_ms']
+
+        ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+        lines = ['%-8s %-50s %6s %10s %10s %10s' % ('type', 'name', 'calls', 'wall ms', 'cpu ms', 'child ms')]
+        for (category, name), total in ranked[:limit]:
+            lines.append('%-8s %-50s %6d %10d %10d %10d' % ((category, name[:50]) + tuple(total)))
+        lines.append('Total wall time: %.1f s' % (time.time() - self.started))
+        return '\n'.join(lines)
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler which keeps its file open and leaves writes in the file
+    buffer. The buffer is flushed for records at or above flushLevel and
+    when the handler is closed (logging.shutdown runs at exit)."""
+
+    def __init__(self, filename, flushLevel=logging.ERROR, bufferSize=65536):
+        self.flushLevel = flushLevel
+        self.bufferSize = bufferSize
+        logging.FileHandler.__init__(self, filename, 'a', delay=True)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, self.bufferSize)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write('%s\n' % self.format(record))
+            if record.levelno >= self.flushLevel:
+                self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record):
+        message = record.getMessage()
+        if isinstance(message, str):
+            message = message.decode('utf-8', 'replace')
+        return json.dumps({'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+                           'level': record.levelname,
+                           'thread': record.threadName,
+                           'message': message})
+
+
+class RunningCommand(object):
+    """Command started by Setup.run_async(). Output is logged line by line
+    from reader threads while the command runs. With timeout the whole
+    process group of the command is terminated when it runs too long."""
+
+    killGracePeriod = 10
+    readerJoinTimeout = 5
+
+    def __init__(self, args, cwd=None, env=None, timeout=None, logIt=None, onFinish=None):
+        self.args = args
+        self.timeout = timeout
+        self.logIt = logIt or (lambda msg, errorLog=False: None)
+        self.onFinish = onFinish
+        self.returncode = None
+        self.duration = None
+        self.timedOut = False
+        self.exited = threading.Event()
+        self.outputTail = collections.deque(maxlen=50)
+        self.started = time.time()
+
+        # New session so the command and everything it spawns can be killed together
+        self.process = subprocess.Popen(args, stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        cwd=cwd, env=env, close_fds=True, preexec_fn=os.setsid)
+
+        self.readers = []
+        for stream, errorLog in [(self.process.stdout, False), (self.process.stderr, True)]:
+            reader = threading.Thread(target=self.read_output, args=(stream, errorLog))
+            reader.daemon = True
+            reader.start()
+            self.readers.append(reader)
+
+        self.timer = None
+        if timeout:
+            self.timer = threading.Timer(timeout, self.kill)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def read_output(self, stream, errorLog):
+        for line in iter(stream.readline, ''):
+            line = line.rstrip('\n')
+            self.outputTail.append(line)
+            self.logIt(line, errorLog)
+        stream.close()
+
+    def signal_group(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except OSError:
+            pass
+
+    def kill(self):
+        # Popen.poll() is not called here, reaping the process in this thread
+        # would hide its exit code from wait()
+        if self.exited.is_set():
+            return
+        self.timedOut = True
+        self.logIt("Command %s did not finish in %s seconds, terminating it" % (' '.join(self.args), self.timeout), True)
+        self.signal_group(signal.SIGTERM)
+        self.exited.wait(self.killGracePeriod)
+        if not self.exited.is_set():
+            self.signal_group(signal.SIGKILL)
+
+    def poll(self):
+        return self.process.poll()
+
+    def wait(self, readerJoinTimeout=None):
+        """Waits for the command and returns its exit code. Reader threads
+        are joined for a limited time since daemons started by the command
+        may keep its output open."""
+        if self.returncode != None:
+            return self.returncode
+
+        code = self.process.wait()
+        self.exited.set()
+        if self.timer:
+            self.timer.cancel()
+        for reader in self.readers:
+            reader.join(self.readerJoinTimeout if readerJoinTimeout == None else readerJoinTimeout)
+
+        self.duration = time.time() - self.started
+        self.returncode = code
+        if self.onFinish:
+            self.onFinish(self)
+        return code
 
 
 class Setup(object):
@@ -65,15 +299,43 @@ class Setup(object):
         self.downloadWars = None
         self.templateRenderingDict = {}
 
+        # Compiled templates, see compileTemplate()
+        self.templateCache = {}
+        self.templateEscapeRe = re.compile(r"%([^\(])")
+        self.templateTrailingEscapeRe = re.compile(r"%$")
+        self.templateRenderingThreads = multiprocessing.cpu_count() * 2
+        self.umask = os.umask(0)
+        os.umask(self.umask)
+
+        # copyTree() skips files with the same size and content hash,
+        # hashes are cached in this file between runs
+        self.copyHashCache = '%s/setup_copy_hashes.json' % self.install_dir
+        self.copyThreads = multiprocessing.cpu_count() * 2
+        self.treeSync = None
+
+        # Set to SetupProfiler instance by --profile
+        self.profiler = None
+
         # OS commands
         self.cmd_ln = '/bin/ln'
         self.cmd_chmod = '/bin/chmod'
         self.cmd_chown = '/bin/chown'
+
+        # Seconds a command may run before run() kills it, None waits forever
+        self.commandTimeout = None
+        self.commandResults = []
+
+        # Log ownership and permission changes of PermissionPlan instead of
+        # applying them
+        self.permissionsDryRun = False
         self.cmd_chgrp = '/bin/chgrp'
         self.cmd_mkdir = '/bin/mkdir'
         self.cmd_rpm = '/bin/rpm'
         self.cmd_dpkg = '/usr/bin/dpkg'
         self.opensslCommand = '/usr/bin/openssl'
+        # Generate keys, certificates and PKCS12 files with the cryptography
+        # library when it's installed instead of running openssl
+        self.useCryptographyBackend = True
 
         self.sysemProfile = "/etc/profile"
 
@@ -116,11 +378,56 @@ class Setup(object):
         self.distGluuFolder = '%s/gluu' % self.distFolder
         self.distTmpFolder = '%s/tmp' % self.distFolder
 
+        # Certificates made by generate_crypto, imported to the JRE truststore
+        self.generatedCerts = []
+        self.generatedCertsTrusted = False
+        self.trustGeneratedCerts = True
+
+        # Content addressed cache of downloaded files, can be shared by hosts
+        self.downloadCacheFolder = '%s/cache' % self.distFolder
+        self.downloadThreads = 4
+
         self.setup_properties_fn = '%s/setup.properties' % self.install_dir
         self.log = '%s/setup.log' % self.install_dir
         self.logError = '%s/setup_error.log' % self.install_dir
+        self.logJson = False
+        self.logJsonFn = '%s/setup.log.json' % self.install_dir
+        self.logger = None
+        # number of errors logged by setup itself, run_step() marks steps that
+        # logged errors as failed. Output and exit codes of commands are not
+        # counted, steps check the exit codes they depend on.
+        self.logErrorCount = 0
         self.savedProperties = '%s/setup.properties.last' % self.install_dir
 
+        # Completed install steps, their input fingerprints and the attributes
+        # they changed, used by --resume
+        self.stateFn = '%s/setup_state.json' % self.install_dir
+        self.resume = False
+        self.setupState = {'initial': None, 'steps': {}}
+        self.stateExcludedAttributes = ['commandResults', 'templateCache', 'logger', 'profiler', 'treeSync',
+                                        'keygen_daemon', 'keygenDaemonLock', 'keygenDaemonResponses', 'resume', 'setupState',
+                                        'logErrorCount', 'stateExcludedAttributes', 'stagingPaths', 'hostResources', 'stateFn']
+
+        # Fleet mode renders output and generates keys for several nodes, see
+        # build_fleet(). Steps done for the nodes are skipped when they apply
+        # their bundle, attributes detected on the node are not overwritten.
+        self.fleetPinnedSteps = ['calculate_aplications_memory', 'make_salt', 'make_oxauth_salt', 'install_gluu_base',
+                                 'encode_passwords', 'encode_test_passwords', 'prepare_base64_extension_scripts',
+                                 'render_templates', 'generate_crypto', 'generate_oxauth_openid_keys',
+                                 'generate_base64_configuration', 'render_configuration_template',
+                                 'render_service_templates', 'render_test_templates']
+        self.fleetHostAttributes = ['install_dir', 'os_type', 'os_initdaemon', 'apache_version', 'logJson', 'resume']
+        self.fleetThreads = multiprocessing.cpu_count() * 2
+        # Certificates a node can have of its own: password attribute, user,
+        # keystore attribute and keystore password attribute
+        self.fleetNodeCerts = {'httpd': ('httpdKeyPass', 'jetty', None, None),
+                               'openldap': ('openldapKeyPass', 'ldap', 'openldapJksFn', 'openldapJksPass'),
+                               'shibIDP': ('shibJksPass', 'jetty', 'shibJksFn', 'shibJksPass'),
+                               'asimba': ('asimbaJksPass', 'jetty', 'asimbaJksFn', 'asimbaJksPass')}
+        self.stagingPaths = {}
+        self.hostResources = None
+        self.profileTrace = '%s/setup_profile.json' % self.install_dir
+
         self.gluuOptFolder = '/opt/gluu'
         self.gluuOptBinFolder = '%s/bin' % self.gluuOptFolder
         self.gluuOptSystemFolder = '%s/system' % self.gluuOptFolder
@@ -154,27 +461,27 @@ class Setup(object):
         self.jetty_app_configuration = {
                 'oxauth' : {'name' : 'oxauth',
                             'jetty' : {'modules' : 'deploy,http,logging,jsp,servlets,ext,http-forwarded,websocket'},
-                            'memory' : {'ratio' : 0.3, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 4096},
+                            'memory' : {'ratio' : 0.3, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 4096, "threads_weight" : 1.0},
                             'installed' : False
             },
                 'identity' : {'name' : 'identity',
                               'jetty' : {'modules' : 'deploy,http,logging,jsp,ext,http-forwarded,websocket'},
-                              'memory' : {'ratio' : 0.2, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 2048},
+                              'memory' : {'ratio' : 0.2, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 2048, "threads_weight" : 0.5},
                               'installed' : False
             },
                 'idp' : {'name' : 'idp',
                          'jetty' : {'modules' : 'deploy,http,logging,jsp,http-forwarded'},
-                         'memory' : {'ratio' : 0.2, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 1024},
+                         'memory' : {'ratio' : 0.2, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 1024, "threads_weight" : 0.5},
                          'installed' : False
             },
                 'asimba' : {'name' : 'asimba',
                          'jetty' : {'modules' : 'deploy,http,logging,jsp,http-forwarded'},
-                         'memory' : {'ratio' : 0.1, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 1024},
+                         'memory' : {'ratio' : 0.1, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 1024, "threads_weight" : 0.25},
                          'installed' : False
             },
                 'oxauth-rp' : {'name' : 'oxauth-rp',
                          'jetty' : {'modules' : 'deploy,http,logging,jsp,http-forwarded,websocket'},
-                         'memory' : {'ratio' : 0.1, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 512},
+                         'memory' : {'ratio' : 0.1, "jvm_heap_ration" : 0.7, "max_allowed_mb" : 512, "threads_weight" : 0.25},
                          'installed' : False
             },
                 'passport' : {'name' : 'passport',
@@ -231,6 +538,20 @@ class Setup(object):
         self.encoded_ldap_pw = None
         self.encoded_shib_jks_pw = None
         self.application_max_ram = None    # in MB
+
+        # Sizing of applications, see calculate_aplications_memory()
+        self.osMemoryReserveMB = 512
+        self.slapdMemoryReserveMB = 1024
+        self.memcachedMemoryReserveMB = 64
+        self.httpdMemoryReserveMB = 128
+        self.minApplicationsMemoryMB = 1024
+        self.minMetaspaceMB = 128
+        self.maxMetaspaceMB = 512
+        self.jettyThreadsPerCpu = 50
+        self.jettyMinThreads = 10
+        self.jettyMaxThreads = 500
+        self.jettyHeapPerThreadMB = 4
+        self.heapPerLoginMB = 2
         self.encode_salt = None
 
         self.baseInum = None
@@ -267,6 +588,18 @@ class Setup(object):
         self.ldap_hostname = "localhost"
         self.ldap_port = '1389'
         self.ldaps_port = '1636'
+
+        # Used by start_services() to check when applications are ready and
+        # which services must be ready before they are started
+        self.applicationPorts = {'oxauth': 8081, 'identity': 8082, 'asimba': 8084,
+                                 'oxauth-rp': 8085, 'idp': 8086, 'passport': 8090}
+        self.applicationDependencies = {'oxauth': ['ldap', 'memcached'],
+                                        'identity': ['ldap', 'memcached', 'oxauth'],
+                                        'idp': ['ldap', 'oxauth'],
+                                        'asimba': ['ldap'],
+                                        'oxauth-rp': ['oxauth'],
+                                        'passport': ['oxauth']}
+        self.serviceStartTimeout = 300
         self.ldap_jmx_port = '1689'
         self.ldap_admin_port = '4444'
         self.ldapBaseFolder = '/opt/opendj'
@@ -276,8 +609,11 @@ class Setup(object):
         self.importLdifCommand = '%s/bin/import-ldif' % self.ldapBaseFolder
         self.ldapModifyCommand = '%s/bin/ldapmodify' % self.ldapBaseFolder
         self.loadLdifCommand = self.ldapModifyCommand
+        # testBind.py uses the stats of ldap_load_test.py, which imports slapd_standin.py
         self.gluuScriptFiles = ['%s/static/scripts/logmanager.sh' % self.install_dir,
-                                '%s/static/scripts/testBind.py' % self.install_dir]
+                                '%s/static/scripts/testBind.py' % self.install_dir,
+                                '%s/static/scripts/ldap_load_test.py' % self.install_dir,
+                                '%s/static/scripts/slapd_standin.py' % self.install_dir]
         self.redhat_services = ['memcached', 'httpd']
         self.debian_services = ['memcached', 'apache2', 'rsyslog']
 
@@ -298,6 +634,7 @@ class Setup(object):
         self.openldapJksPass = None
         self.openldapJksFn = '%s/openldap.jks' % self.certFolder
         self.openldapSlapdConf = '%s/slapd.conf' % self.outputFolder
+        self.openldapBulkLoadConf = '%s/slapd-bulkload.conf' % self.outputFolder
         self.openldapSymasConf = '%s/symas-openldap.conf' % self.outputFolder
         self.openldapRootSchemaFolder = "%s/schema" % self.gluuOptFolder
         self.openldapSchemaFolder = "%s/openldap" % self.openldapRootSchemaFolder
@@ -305,6 +642,20 @@ class Setup(object):
         self.openldapSyslogConf = "%s/static/openldap/openldap-syslog.conf" % self.install_dir
         self.openldapLogrotate = "%s/static/openldap/openldap_logrotate" % self.install_dir
         self.openldapSetupAccessLog = False
+        self.openldapDataFolder = '/opt/gluu/data'
+        # slapd.conf profile, see get_openldap_profiles()
+        self.openldapThreadsPerCpu = 4
+        self.openldapMinThreads = 16
+        self.openldapMaxThreads = 64
+        # stack of every slapd thread, limits threads on small hosts
+        self.openldapThreadStackMB = 8
+        self.openldapDbSizeFactor = 20
+        self.openldapMinDbSizeGB = 1
+        self.openldapCheckpointKB = 1024
+        self.openldapCheckpointMinutes = 5
+        self.openldapDbNoSync = False
+        self.openldapSortvals = ['member']
+        self.openldapBulkLoadQuick = True
         self.accessLogConfFile = "%s/static/openldap/accesslog.conf" % self.install_dir
         self.gluuAccessLogConf = "%s/static/openldap/o_gluu_accesslog.conf" % self.install_dir
         self.opendlapIndexDef = "%s/static/openldap/index.json" % self.install_dir
@@ -375,6 +726,15 @@ class Setup(object):
         self.default_key_algs = 'RS256 RS384 RS512 ES256 ES384 ES512'
         self.default_key_expiration = 365
 
+        # One JVM serves all OpenID key generation requests, see keygen_daemon.py
+        self.useKeyGeneratorDaemon = True
+        self.keygen_daemon_script = '%s/static/scripts/keygen_daemon.py' % self.install_dir
+        self.keygen_daemon = None
+        self.keygenDaemonLock = threading.Lock()
+        self.keygenDaemonResponses = None
+        # seconds to wait for each response before the daemon is killed
+        self.keygenDaemonTimeout = 300
+
         # oxTrust SCIM configuration
         self.scim_rs_client_id = None
         self.scim_rs_client_jwks = None
@@ -490,6 +850,9 @@ class Setup(object):
                 s = s + "%s\n%s\n%s\n\n" % (key, "-" * len(key), val)
             return s
 
+    def newPermissionPlan(self):
+        return PermissionPlan(self.permissionsDryRun, self.logIt)
+
     def set_ownership(self):
         self.logIt("Changing ownership")
         realCertFolder = os.path.realpath(self.certFolder)
@@ -497,50 +860,51 @@ class Setup(object):
         realOptPythonFolderFolder = os.path.realpath(self.gluuOptPythonFolder)
         realAsimbaJks = os.path.realpath(self.asimbaJksFn)
 
-        self.run([self.cmd_chown, '-R', 'root:gluu', realCertFolder])
-        self.run([self.cmd_chown, '-R', 'root:gluu', realConfigFolder])
-        self.run([self.cmd_chown, '-R', 'root:gluu', realOptPythonFolderFolder])
-        self.run([self.cmd_chown, '-R', 'root:gluu', self.oxBaseDataFolder])
+        plan = self.newPermissionPlan()
+        plan.add(realCertFolder, owner='root:gluu', recursive=True)
+        plan.add(realConfigFolder, owner='root:gluu', recursive=True)
+        plan.add(realOptPythonFolderFolder, owner='root:gluu', recursive=True)
+        plan.add(self.oxBaseDataFolder, owner='root:gluu', recursive=True)
 
         # Set right permissions
-        self.run([self.cmd_chmod, '-R', '440', realCertFolder])
-        self.run([self.cmd_chmod, 'a+X', realCertFolder])
-        
+        plan.add(realCertFolder, mode=0440, recursive=True)
+        plan.add(realCertFolder, mode='a+X')
+
         # Set write permission for Asimba's keystore (oxTrust can change it)
-        self.run([self.cmd_chmod, 'u+w', realAsimbaJks])
+        plan.add(realAsimbaJks, mode='u+w')
 
         if self.installOxAuth:
-            self.run([self.cmd_chown, '-R', 'jetty:jetty', self.oxauth_openid_jwks_fn])
-            self.run([self.cmd_chown, '-R', 'jetty:jetty', self.oxauth_openid_jks_fn])
+            plan.add(self.oxauth_openid_jwks_fn, owner='jetty:jetty', recursive=True)
+            plan.add(self.oxauth_openid_jks_fn, owner='jetty:jetty', recursive=True)
 
         if self.installSaml:
             realIdp3Folder = os.path.realpath(self.idp3Folder)
-            self.run([self.cmd_chown, '-R', 'jetty:jetty', realIdp3Folder])
+            plan.add(realIdp3Folder, owner='jetty:jetty', recursive=True)
+
+        plan.apply()
 
     def set_permissions(self):
         self.logIt("Changing permissions")
 
-        ### Below commands help us to set permissions readable if umask is set as 077
-        self.run(['find', "/opt", '-user', 'root', '-perm', '700', '-exec', 'chmod', "755", '{}',  ';'])
-        self.run(['find', "/opt", '-user', 'root', '-perm', '600', '-exec', 'chmod', "644", '{}',  ';'])
-        self.run(['find', "/opt", '-user', 'root', '-perm', '400', '-exec', 'chmod', "444", '{}',  ';'])
+        plan = self.newPermissionPlan()
 
-        self.run(['find', "%s" % self.gluuBaseFolder, '-perm', '700', '-exec', self.cmd_chmod, "755", '{}', ';'])
-        self.run(['find', "%s" % self.gluuBaseFolder, '-perm', '600', '-exec', self.cmd_chmod, "644", '{}', ';'])
+        ### Below rules help us to set permissions readable if umask is set as 077
+        plan.add("/opt", mode={0700: 0755, 0600: 0644, 0400: 0444}, recursive=True, user='root')
+        plan.add(self.gluuBaseFolder, mode={0700: 0755, 0600: 0644}, recursive=True)
+        plan.add(self.osDefault, mode={0700: 0755, 0600: 0644}, recursive=True)
 
-        self.run(['find', "%s" % self.osDefault, '-perm', '700', '-exec', self.cmd_chmod, "755", '{}', ';'])
-        self.run(['find', "%s" % self.osDefault, '-perm', '600', '-exec', self.cmd_chmod, "644", '{}', ';'])
-
-        self.run(['/bin/chmod', '-R', '644', self.etc_hosts])
+        plan.add(self.etc_hosts, mode=0644, recursive=True)
 
-        if self.os_type in ['debian', 'ubuntu']:
-            self.run(['/bin/chmod', '-f', '644', self.etc_hostname])
+        if self.os_type in ['debian', 'ubuntu'] and os.path.exists(self.etc_hostname):
+            plan.add(self.etc_hostname, mode=0644)
 
         if self.installSaml:
             realIdp3Folder = os.path.realpath(self.idp3Folder)
             realIdp3BinFolder = "%s/bin" % realIdp3Folder;
             if os.path.exists(realIdp3BinFolder):
-                self.run(['find', realIdp3BinFolder, '-name', '*.sh', '-exec', 'chmod', "755", '{}',  ';'])
+                plan.add(realIdp3BinFolder, mode=0755, recursive=True, pattern='*.sh')
+
+        plan.apply()
 
     def get_ip(self):
         testIP = None
@@ -735,24 +1099,23 @@ class Setup(object):
             self.logIt("Error copying %s to %s" % (inFile, destFolder), True)
             self.logIt(traceback.format_exc(), True)
 
-    def copyTree(self, src, dst, overwrite=False):
-        try:
-            if not os.path.exists(dst):
-                os.makedirs(dst)
+    def getTreeSync(self):
+        if not self.treeSync:
+            self.treeSync = TreeSync(self.copyHashCache, int(self.copyThreads), self.logIt)
+        return self.treeSync
 
-            for item in os.listdir(src):
-                s = os.path.join(src, item)
-                d = os.path.join(dst, item)
-                if os.path.isdir(s):
-                    self.copyTree(s, d, overwrite)
-                else:
-                    if overwrite and os.path.exists(d):
-                        self.removeFile(d)
+    def logCopyStats(self, src, dst, stats):
+        self.logIt("Copied %s to %s: %d files (%d bytes) copied, %d files (%d bytes) unchanged" % (
+                    src, dst, stats['files_copied'], stats['bytes_copied'],
+                    stats['files_skipped'], stats['bytes_skipped']))
+        if stats.get('files_failed'):
+            self.logIt("Failed to copy %d files from %s to %s" % (stats['files_failed'], src, dst), True)
 
-                    if not os.path.exists(d) or os.stat(s).st_mtime - os.stat(d).st_mtime > 1:
-                        shutil.copy2(s, d)
-
-            self.logIt("Copied tree %s to %s" % (src, dst))
+    def copyTree(self, src, dst, overwrite=False):
+        try:
+            stats = self.getTreeSync().syncTree(src, dst, overwrite)
+            self.logCopyStats(src, dst, stats)
+            return stats
         except:
             self.logIt("Error copying tree %s to %s" % (src, dst), True)
             self.logIt(traceback.format_exc(), True)
@@ -786,14 +1149,66 @@ class Setup(object):
 
     # = Utilities ====================================================================
 
+    def init_logger(self):
+        self.close_logger()
+
+        logger = logging.getLogger('gluu-setup')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        formatter = logging.Formatter('%(asctime)s %(message)s', '%X %x')
+        logHandler = BufferedFileHandler(self.log)
+        logHandler.setFormatter(formatter)
+        logger.addHandler(logHandler)
+
+        errorHandler = BufferedFileHandler(self.logError)
+        errorHandler.setLevel(logging.ERROR)
+        errorHandler.setFormatter(formatter)
+        logger.addHandler(errorHandler)
+
+        if self.logJson:
+            jsonHandler = BufferedFileHandler(self.logJsonFn)
+            jsonHandler.setFormatter(JsonLinesFormatter())
+            logger.addHandler(jsonHandler)
+
+        self.logger = logger
+
+    def close_logger(self):
+        if not self.logger:
+            return
+
+        for handler in self.logger.handlers[:]:
+            handler.close()
+            self.logger.removeHandler(handler)
+        self.logger = None
+
+    def remove_logs(self):
+        self.close_logger()
+        # logging reopens the files, so it waits until all are removed
+        removed = []
+        for fn in (self.log, self.logError, self.logJsonFn):
+            try:
+                os.remove(fn)
+                removed.append(fn)
+            except:
+                pass
+        for fn in removed:
+            self.logIt('Removed %s' % fn)
+
     def logIt(self, msg, errorLog=False):
         if errorLog:
-            f = open(self.logError, 'a')
-            f.write('%s %s\n' % (time.strftime('%X %x'), msg))
-            f.close()
-        f = open(self.log, 'a')
-        f.write('%s %s\n' % (time.strftime('%X %x'), msg))
-        f.close()
+            self.logErrorCount += 1
+        self.logCommand(msg, errorLog)
+
+    def logCommand(self, msg, errorLog=False):
+        """Logs output of commands, stderr lines go to the error log without
+        failing the install step"""
+        if not self.logger:
+            self.init_logger()
+        if errorLog:
+            self.logger.error(msg)
+        else:
+            self.logger.info(msg)
 
     def appendLine(self, line, fileName=False):
         try:
@@ -824,18 +1239,10 @@ class Setup(object):
         self.logIt('Loading Properties %s' % fn)
         p = Properties.Properties()
         try:
-            p.load(open(fn))
-            properties_list = p.keys()
-            for prop in properties_list:
-                try:
-                    self.__dict__[prop] = p[prop]
-                    if p[prop] == 'True':
-                        self.__dict__[prop] = True
-                    elif p[prop] == 'False':
-                        self.__dict__[prop] = False
-                except:
-                    self.logIt("Error loading property %s" % prop)
-                    self.logIt(traceback.format_exc(), True)
+            with open(fn) as f:
+                p.load(f)
+            # Only booleans are converted, other settings stay strings
+            self.__dict__.update(p.getTypedDict((bool,)))
         except:
             self.logIt("Error loading properties", True)
             self.logIt(traceback.format_exc(), True)
@@ -889,23 +1296,28 @@ class Setup(object):
 
         self.run([service_path, apache_service_name, 'start'])
 
-    def copy_output(self):
-        self.logIt("Copying rendered templates to final destination")
-
+    def get_output_pairs(self):
+        """Returns list of (rendered file, final destination) of the
+        templates copy_output() copies"""
+        pairs = []
         for dest_fn in self.ce_templates.keys():
             if self.ce_templates[dest_fn]:
                 fn = os.path.split(dest_fn)[-1]
-                output_fn = os.path.join(self.outputFolder, fn)
-                try:
-                    self.logIt("Copying %s to %s" % (output_fn, dest_fn))
-                    dest_dir = os.path.dirname(dest_fn)
-                    if not os.path.exists(dest_dir):
-                        self.logIt("Created destination folder %s" % dest_dir)
-                        os.makedirs(dest_dir)
-                    shutil.copyfile(output_fn, dest_fn)
-                except:
-                    self.logIt("Error writing %s to %s" % (output_fn, dest_fn), True)
-                    self.logIt(traceback.format_exc(), True)
+                pairs.append((os.path.join(self.outputFolder, fn), dest_fn))
+        return pairs
+
+    def copy_output(self):
+        self.logIt("Copying rendered templates to final destination")
+
+        pairs = self.get_output_pairs()
+        # system files like /etc/hosts may be bind mounts or symlinks, so
+        # they are rewritten in place and each file fails on its own
+        try:
+            stats = self.getTreeSync().syncFiles(pairs, inPlace=True, keepGoing=True)
+            self.logCopyStats(self.outputFolder, 'final destinations', stats)
+        except:
+            self.logIt("Error writing rendered templates from %s" % self.outputFolder, True)
+            self.logIt(traceback.format_exc(), True)
 
     def copy_scripts(self):
         self.logIt("Copying script files")
@@ -926,12 +1338,15 @@ class Setup(object):
 
     def copy_static(self):
         if self.installOxAuth:
-            self.copyFile("%s/static/auth/lib/duo_web.py" % self.install_dir, "%s/libs" % self.gluuOptPythonFolder)
-            self.copyFile("%s/static/auth/conf/duo_creds.json" % self.install_dir, "%s/" % self.certFolder)
-            self.copyFile("%s/static/auth/conf/gplus_client_secrets.json" % self.install_dir, "%s/" % self.certFolder)
-            self.copyFile("%s/static/auth/conf/super_gluu_creds.json" % self.install_dir, "%s/" % self.certFolder)
-            self.copyFile("%s/static/auth/conf/cert_creds.json" % self.install_dir, "%s/" % self.certFolder)
-            self.copyFile("%s/static/auth/conf/otp_configuration.json" % self.install_dir, "%s/" % self.certFolder)
+            pairs = [("%s/static/auth/lib/duo_web.py" % self.install_dir, "%s/libs/duo_web.py" % self.gluuOptPythonFolder)]
+            for fn in ['duo_creds.json', 'gplus_client_secrets.json', 'super_gluu_creds.json', 'cert_creds.json', 'otp_configuration.json']:
+                pairs.append(("%s/static/auth/conf/%s" % (self.install_dir, fn), "%s/%s" % (self.certFolder, fn)))
+            try:
+                stats = self.getTreeSync().syncFiles(pairs)
+                self.logCopyStats("%s/static/auth" % self.install_dir, self.certFolder, stats)
+            except:
+                self.logIt("Error copying static files", True)
+                self.logIt(traceback.format_exc(), True)
 
     def detect_os_type(self):
         # TODO: Change this to support more distros. For example according to
@@ -1108,11 +1523,13 @@ class Setup(object):
         jettyEnv['PATH'] = '%s/bin:' % self.jre_home + jettyEnv['PATH']
 
         self.run([self.cmd_java, '-jar', '%s/start.jar' % self.jetty_home, 'jetty.home=%s' % self.jetty_home, 'jetty.base=%s' % jettyServiceBase, '--add-to-start=%s' % jettyModules], None, jettyEnv)
-        self.run([self.cmd_chown, '-R', 'jetty:jetty', jettyServiceBase])
-
         jettyServiceConfiguration = '%s/jetty/%s' % (self.outputFolder, serviceName)
         self.copyFile(jettyServiceConfiguration, "/etc/default")
-        self.run([self.cmd_chown, 'root:root', "/etc/default/%s" % serviceName])
+
+        plan = self.newPermissionPlan()
+        plan.add(jettyServiceBase, owner='jetty:jetty', recursive=True)
+        plan.add("/etc/default/%s" % serviceName, owner='root:root')
+        plan.apply()
 
         if os.path.exists(jettyServiceConfiguration+"_web_resources.xml"):
             self.copyFile(jettyServiceConfiguration+"_web_resources.xml", self.jetty_base+"/"+serviceName+"/webapps")
@@ -1166,43 +1583,59 @@ class Setup(object):
         self.run([self.cmd_chown, '-R', 'root:root', '/opt/jython-%s' % self.jython_version])
         self.run([self.cmd_chown, '-h', 'root:root', self.jython_home])
 
+    def download_files(self, jobs):
+        """Downloads list of (description, url, destination, options) concurrently
+        through the download cache. Returns True if all downloads succeeded."""
+        if not jobs:
+            return True
+
+        downloader = Downloader(self.downloadCacheFolder, int(self.downloadThreads), logIt=self.logIt)
+        for description, url, dest, options in jobs:
+            print "Downloading %s..." % description
+
+        results = downloader.fetchAll([dict(options, url=url, dest=dest) for description, url, dest, options in jobs])
+
+        succeeded = True
+        for (description, url, dest, options), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                print "Failed to download %s, see %s for details" % (description, self.logError)
+                succeeded = False
+            elif not result[1]:
+                self.logIt("%s is up to date in download cache" % description)
+
+        return succeeded
+
     def downloadWarFiles(self):
+        jobs = []
         if self.downloadWars:
-            print "Downloading oxAuth war file..."
-            self.run(['/usr/bin/wget', self.oxauth_war, '--no-verbose', '--retry-connrefused', '--tries=10', '-O', '%s/oxauth.war' % self.distGluuFolder])
-            print "Downloading oxTrust war file..."
-            self.run(['/usr/bin/wget', self.oxtrust_war, '--no-verbose', '--retry-connrefused', '--tries=10', '-O', '%s/identity.war' % self.distGluuFolder])
-
-            print "Finished downloading latest war files"
+            jobs.append(("oxAuth war file", self.oxauth_war, '%s/oxauth.war' % self.distGluuFolder, {}))
+            jobs.append(("oxTrust war file", self.oxtrust_war, '%s/identity.war' % self.distGluuFolder, {}))
 
         if self.installAsimba:
             # Asimba is not part of CE package. We need to download it if needed
             distAsimbaPath = '%s/%s' % (self.distGluuFolder, "asimba.war")
             if not os.path.exists(distAsimbaPath):
-                print "Downloading Asimba war file..."
-                self.run(['/usr/bin/wget', self.asimba_war, '--no-verbose', '--retry-connrefused', '--tries=10', '-O', '%s/asimba.war' % self.distGluuFolder])
+                jobs.append(("Asimba war file", self.asimba_war, distAsimbaPath, {}))
 
         if self.installOxAuthRP:
             # oxAuth RP is not part of CE package. We need to download it if needed
             distOxAuthRpPath = '%s/%s' % (self.distGluuFolder, "oxauth-rp.war")
             if not os.path.exists(distOxAuthRpPath):
-                print "Downloading oxAuth RP war file..."
-                self.run(['/usr/bin/wget', self.oxauth_rp_war, '--no-verbose', '--retry-connrefused', '--tries=10', '-O', '%s/oxauth-rp.war' % self.distGluuFolder])
+                jobs.append(("oxAuth RP war file", self.oxauth_rp_war, distOxAuthRpPath, {}))
 
         if self.downloadWars and self.installSaml:
-            print "Downloading Shibboleth IDP v3 war file..."
-            self.run(['/usr/bin/wget', self.idp3_war, '--no-verbose', '-c', '--retry-connrefused', '--tries=10', '-O', '%s/idp.war' % self.distGluuFolder])
-            print "Downloading Shibboleth IDP v3 keygenerator..."
-            self.run(['/usr/bin/wget', self.idp3_cml_keygenerator, '--no-verbose', '-c', '--retry-connrefused', '--tries=10', '-O', self.distGluuFolder + '/idp3_cml_keygenerator.jar'])
-            print "Downloading Shibboleth IDP v3 binary distributive file..."
-            self.run(['/usr/bin/wget', self.idp3_dist_jar, '--no-verbose', '-c', '--retry-connrefused', '--tries=10', '-O', self.distGluuFolder + '/shibboleth-idp.jar'])
+            jobs.append(("Shibboleth IDP v3 war file", self.idp3_war, '%s/idp.war' % self.distGluuFolder, {}))
+            jobs.append(("Shibboleth IDP v3 keygenerator", self.idp3_cml_keygenerator, self.distGluuFolder + '/idp3_cml_keygenerator.jar', {}))
+            jobs.append(("Shibboleth IDP v3 binary distributive file", self.idp3_dist_jar, self.distGluuFolder + '/shibboleth-idp.jar', {}))
 
         jceArchive = 'jce_policy-8.zip'
         jceArchivePath = '%s/%s' % (self.distAppFolder, jceArchive)
         if self.installJce and not os.path.exists(jceArchivePath):
-            print "Downloading JCE 1.8 zip file..."
-            self.run(['/usr/bin/curl', self.java_1_8_jce_zip, '-s', '-j', '-k', '-L', '-H', 'Cookie:oraclelicense=accept-securebackup-cookie', '-o', jceArchivePath])
-            
+            jobs.append(("JCE 1.8 zip file", self.java_1_8_jce_zip, jceArchivePath,
+                         {'headers': {'Cookie': 'oraclelicense=accept-securebackup-cookie'}, 'verify': False}))
+
+        if self.download_files(jobs) and self.downloadWars:
+            print "Finished downloading latest war files"
 
     def encode_passwords(self):
         self.logIt("Encoding passwords")
@@ -1232,12 +1665,33 @@ class Setup(object):
             self.logIt("Error encoding test passwords", True)
             self.logIt(traceback.format_exc(), True)
 
-    def gen_cert(self, suffix, password, user='root', cn=None):
+    def gen_cert(self, suffix, password, user='root', cn=None, importToTrustStore=True):
         self.logIt('Generating Certificate for %s' % suffix)
         key_with_password = '%s/%s.key.orig' % (self.certFolder, suffix)
         key = '%s/%s.key' % (self.certFolder, suffix)
         csr = '%s/%s.csr' % (self.certFolder, suffix)
         public_certificate = '%s/%s.crt' % (self.certFolder, suffix)
+
+        certCn = cn
+        if certCn == None:
+            certCn = self.hostname
+
+        if self.useCryptographyBackend and x509:
+            self.gen_cert_in_process(password, certCn, key_with_password, key, csr, public_certificate)
+        else:
+            self.gen_cert_openssl(password, certCn, key_with_password, key, csr, public_certificate)
+
+        plan = self.newPermissionPlan()
+        plan.add(key_with_password, owner='%s:%s' % (user, user), mode=0700)
+        plan.add(key, owner='%s:%s' % (user, user), mode=0700)
+        plan.apply()
+
+        if importToTrustStore:
+            self.import_trusted_certs([("%s_%s" % (self.hostname, suffix), public_certificate)])
+
+        return "%s_%s" % (self.hostname, suffix), public_certificate
+
+    def gen_cert_openssl(self, password, certCn, key_with_password, key, csr, public_certificate):
         self.run([self.opensslCommand,
                   'genrsa',
                   '-des3',
@@ -1256,11 +1710,6 @@ class Setup(object):
                   '-out',
                   key
         ])
-
-        certCn = cn
-        if certCn == None:
-            certCn = self.hostname
-             
         self.run([self.opensslCommand,
                   'req',
                   '-new',
@@ -1283,104 +1732,403 @@ class Setup(object):
                   '-out',
                   public_certificate
         ])
-        self.run([self.cmd_chown, '%s:%s' % (user, user), key_with_password])
-        self.run([self.cmd_chmod, '700', key_with_password])
-        self.run([self.cmd_chown, '%s:%s' % (user, user), key])
-        self.run([self.cmd_chmod, '700', key])
 
-        self.run([self.cmd_keytool, "-import", "-trustcacerts", "-alias", "%s_%s" % (self.hostname, suffix), \
-                  "-file", public_certificate, "-keystore", self.defaultTrustStoreFN, \
-                  "-storepass", "changeit", "-noprompt"])
+    def gen_cert_in_process(self, password, certCn, key_with_password, key, csr, public_certificate):
+        """Same files as gen_cert_openssl, generated with the cryptography
+        library instead of four openssl processes"""
+        def text(value):
+            if isinstance(value, str):
+                return value.decode('utf-8')
+            return value
+
+        backend = default_backend()
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=backend)
+
+        self.writeFile(key_with_password, private_key.private_bytes(serialization.Encoding.PEM,
+                                                                    serialization.PrivateFormat.TraditionalOpenSSL,
+                                                                    serialization.BestAvailableEncryption(password)))
+        self.writeFile(key, private_key.private_bytes(serialization.Encoding.PEM,
+                                                      serialization.PrivateFormat.TraditionalOpenSSL,
+                                                      serialization.NoEncryption()))
+
+        subject = x509.Name([x509.NameAttribute(NameOID.COUNTRY_NAME, text(self.countryCode)),
+                             x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, text(self.state)),
+                             x509.NameAttribute(NameOID.LOCALITY_NAME, text(self.city)),
+                             x509.NameAttribute(NameOID.ORGANIZATION_NAME, text(self.orgName)),
+                             x509.NameAttribute(NameOID.COMMON_NAME, text(certCn)),
+                             x509.NameAttribute(NameOID.EMAIL_ADDRESS, text(self.admin_email))])
+
+        request = x509.CertificateSigningRequestBuilder().subject_name(subject).sign(private_key, hashes.SHA256(), backend)
+        self.writeFile(csr, request.public_bytes(serialization.Encoding.PEM))
+
+        now = datetime.datetime.utcnow()
+        certificate = x509.CertificateBuilder().subject_name(subject) \
+                        .issuer_name(subject) \
+                        .public_key(private_key.public_key()) \
+                        .serial_number(x509.random_serial_number()) \
+                        .not_valid_before(now) \
+                        .not_valid_after(now + datetime.timedelta(days=365)) \
+                        .sign(private_key, hashes.SHA256(), backend)
+        self.writeFile(public_certificate, certificate.public_bytes(serialization.Encoding.PEM))
+
+    def gen_certs(self, certs):
+        """Generates certificates for list of gen_cert argument tuples in
+        parallel and imports all of them to the default truststore at once"""
+        pool = ThreadPool(len(certs))
+        try:
+            trusted = pool.map(lambda cert: self.gen_cert(*cert, importToTrustStore=False), certs)
+        finally:
+            pool.close()
+            pool.join()
+
+        aliases = [alias for alias, certFn in trusted]
+        self.generatedCerts = [[alias, certFn] for alias, certFn in self.generatedCerts if alias not in aliases]
+        self.generatedCerts.extend([alias, certFn] for alias, certFn in trusted)
+        self.generatedCertsTrusted = False
+        if self.trustGeneratedCerts:
+            self.trust_generated_certs()
+
+    def trust_generated_certs(self):
+        """Imports certificates made by generate_crypto to the default
+        truststore, fleet nodes do it after their JRE is installed"""
+        if self.generatedCerts and not self.generatedCertsTrusted:
+            self.import_trusted_certs([(alias, certFn) for alias, certFn in self.generatedCerts])
+            self.generatedCertsTrusted = True
+
+    def import_trusted_certs(self, certs):
+        """Adds list of (alias, certificate file) to the default truststore"""
+        if self.useCryptographyBackend and x509:
+            try:
+                entries = []
+                for alias, certFn in certs:
+                    certificate = x509.load_pem_x509_certificate(open(certFn).read(), default_backend())
+                    entries.append((alias, certificate.public_bytes(serialization.Encoding.DER)))
+                self.add_jks_trusted_certs(self.defaultTrustStoreFN, self.defaultTrustStorePW, entries)
+                return
+            except:
+                self.logIt("Can't update %s in process, falling back to keytool" % self.defaultTrustStoreFN)
+                self.logIt(traceback.format_exc(), True)
+
+        for alias, certFn in certs:
+            self.run([self.cmd_keytool, "-import", "-trustcacerts", "-alias", alias, \
+                      "-file", certFn, "-keystore", self.defaultTrustStoreFN, \
+                      "-storepass", self.defaultTrustStorePW, "-noprompt"])
+
+    def jks_digest(self, jksPass, body):
+        """Returns the keyed SHA-1 digest JKS keystores end with"""
+        password = jksPass.decode('utf-8').encode('utf-16-be')
+        return hashlib.sha1(password + 'Mighty Aphrodite' + body).digest()
+
+    def add_jks_trusted_certs(self, jksFn, jksPass, entries):
+        """Adds DER encoded trusted certificates (alias, der) to JKS keystore.
+        Entries with the same alias are replaced. Raises ValueError if the
+        file isn't version 2 JKS keystore."""
+        f = open(jksFn, 'rb')
+        data = f.read()
+        f.close()
+
+        magic, version, count = struct.unpack('>III', data[:12])
+        if magic != 0xFEEDFEED or version != 2:
+            raise ValueError("%s is not JKS v2 keystore" % jksFn)
+        # a store rewritten with a wrong password would be rejected as
+        # tampered by keytool and the JVM
+        if self.jks_digest(jksPass, data[:-20]) != data[-20:]:
+            raise ValueError("Password of %s is incorrect or the keystore is corrupt" % jksFn)
+
+        def read_utf(pos):
+            length = struct.unpack('>H', data[pos:pos + 2])[0]
+            return data[pos + 2:pos + 2 + length], pos + 2 + length
+
+        def read_cert(pos):
+            certType, pos = read_utf(pos)
+            length = struct.unpack('>I', data[pos:pos + 4])[0]
+            return pos + 4 + length
+
+        aliases = dict((alias.lower(), der) for alias, der in entries)
+        kept = []
+        pos = 12
+        for i in range(count):
+            entryStart = pos
+            tag = struct.unpack('>I', data[pos:pos + 4])[0]
+            alias, pos = read_utf(pos + 4)
+            pos += 8  # timestamp
+            if tag == 1:
+                keyLength = struct.unpack('>I', data[pos:pos + 4])[0]
+                pos += 4 + keyLength
+                chainLength = struct.unpack('>I', data[pos:pos + 4])[0]
+                pos += 4
+                for j in range(chainLength):
+                    pos = read_cert(pos)
+            elif tag == 2:
+                pos = read_cert(pos)
+            else:
+                raise ValueError("Unknown JKS entry type %d in %s" % (tag, jksFn))
+
+            if alias in aliases:
+                self.logIt("Replacing %s in %s" % (alias, jksFn))
+            else:
+                kept.append(data[entryStart:pos])
+
+        timestamp = int(time.time() * 1000)
+        for alias, der in sorted(aliases.items()):
+            kept.append(struct.pack('>I', 2) \
+                        + struct.pack('>H', len(alias)) + alias \
+                        + struct.pack('>Q', timestamp) \
+                        + struct.pack('>H', 5) + 'X.509' \
+                        + struct.pack('>I', len(der)) + der)
+
+        body = struct.pack('>III', magic, version, len(kept)) + ''.join(kept)
+        digest = self.jks_digest(jksPass, body)
+
+        tmpFn = '%s.tmp' % jksFn
+        f = open(tmpFn, 'wb')
+        f.write(body + digest)
+        f.close()
+        shutil.copymode(jksFn, tmpFn)
+        os.rename(tmpFn, jksFn)
+        self.logIt("Imported %s into %s" % (", ".join(sorted(aliases)), jksFn))
 
     def generate_crypto(self):
         try:
             self.logIt('Generating certificates and keystores')
-            self.gen_cert('httpd', self.httpdKeyPass, 'jetty')
-            self.gen_cert('shibIDP', self.shibJksPass, 'jetty')
-            self.gen_cert('idp-encryption', self.shibJksPass, 'jetty')
-            self.gen_cert('idp-signing', self.shibJksPass, 'jetty')
-            self.gen_cert('asimba', self.asimbaJksPass, 'jetty')
-            self.gen_cert('openldap', self.openldapKeyPass, 'ldap', self.ldap_hostname)
+            self.gen_certs([('httpd', self.httpdKeyPass, 'jetty'),
+                            ('shibIDP', self.shibJksPass, 'jetty'),
+                            ('idp-encryption', self.shibJksPass, 'jetty'),
+                            ('idp-signing', self.shibJksPass, 'jetty'),
+                            ('asimba', self.asimbaJksPass, 'jetty'),
+                            ('openldap', self.openldapKeyPass, 'ldap', self.ldap_hostname)])
             # Shibboleth IDP and Asimba will be added soon...
-            self.gen_keystore('shibIDP',
-                              self.shibJksFn,
-                              self.shibJksPass,
-                              '%s/shibIDP.key' % self.certFolder,
-                              '%s/shibIDP.crt' % self.certFolder,
-                              'jetty')
-            self.gen_keystore('asimba',
-                              self.asimbaJksFn,
-                              self.asimbaJksPass,
-                              '%s/asimba.key' % self.certFolder,
-                              '%s/asimba.crt' % self.certFolder,
-                              'jetty')
-            self.gen_keystore('openldap',
-                              self.openldapJksFn,
-                              self.openldapJksPass,
-                              '%s/openldap.key' % self.certFolder,
-                              '%s/openldap.crt' % self.certFolder,
-                              'jetty')
-            self.run([self.cmd_chown, '-R', 'jetty:jetty', self.certFolder])
-            self.run([self.cmd_chmod, '-R', '500', self.certFolder])
+            self.gen_keystores([('shibIDP',
+                                 self.shibJksFn,
+                                 self.shibJksPass,
+                                 '%s/shibIDP.key' % self.certFolder,
+                                 '%s/shibIDP.crt' % self.certFolder,
+                                 'jetty'),
+                                ('asimba',
+                                 self.asimbaJksFn,
+                                 self.asimbaJksPass,
+                                 '%s/asimba.key' % self.certFolder,
+                                 '%s/asimba.crt' % self.certFolder,
+                                 'jetty'),
+                                ('openldap',
+                                 self.openldapJksFn,
+                                 self.openldapJksPass,
+                                 '%s/openldap.key' % self.certFolder,
+                                 '%s/openldap.crt' % self.certFolder,
+                                 'jetty')])
+            plan = self.newPermissionPlan()
+            plan.add(self.certFolder, owner='jetty:jetty', mode=0500, recursive=True)
             # oxTrust UI can add key to asimba's keystore
-            self.run([self.cmd_chmod, 'u+w', self.asimbaJksFn])
+            plan.add(self.asimbaJksFn, mode='u+w')
+            plan.apply()
         except:
             self.logIt("Error generating cyrpto")
             self.logIt(traceback.format_exc(), True)
 
+    def gen_keystores(self, keystores):
+        """Runs gen_keystore for list of argument tuples in parallel"""
+        pool = ThreadPool(len(keystores))
+        try:
+            pool.map(lambda keystore: self.gen_keystore(*keystore), keystores)
+        finally:
+            pool.close()
+            pool.join()
+
     def gen_keystore(self, suffix, keystoreFN, keystorePW, inKey, inCert, user='root'):
         self.logIt("Creating keystore %s" % suffix)
         # Convert key to pkcs12
         pkcs_fn = '%s/%s.pkcs12' % (self.certFolder, suffix)
-        self.run([self.opensslCommand,
-                  'pkcs12',
-                  '-export',
-                  '-inkey',
-                  inKey,
-                  '-in',
-                  inCert,
-                  '-out',
-                  pkcs_fn,
-                  '-name',
-                  self.hostname,
-                  '-passout',
-                  'pass:%s' % keystorePW
-        ])
+        if self.useCryptographyBackend and x509 and hasattr(pkcs12, 'serialize_key_and_certificates'):
+            backend = default_backend()
+            private_key = serialization.load_pem_private_key(open(inKey).read(), None, backend)
+            certificate = x509.load_pem_x509_certificate(open(inCert).read(), backend)
+            self.writeFile(pkcs_fn, pkcs12.serialize_key_and_certificates(self.hostname, private_key, certificate, None,
+                                                                          serialization.BestAvailableEncryption(keystorePW)))
+        elif self.run([self.opensslCommand,
+                       'pkcs12',
+                       '-export',
+                       '-inkey',
+                       inKey,
+                       '-in',
+                       inCert,
+                       '-out',
+                       pkcs_fn,
+                       '-name',
+                       self.hostname,
+                       '-passout',
+                       'pass:%s' % keystorePW
+                       ]) != 0:
+            self.logIt("Error converting %s to PKCS12" % inKey, True)
         # Import p12 to keystore
-        self.run([self.cmd_keytool,
-                  '-importkeystore',
-                  '-srckeystore',
-                  '%s/%s.pkcs12' % (self.certFolder, suffix),
-                  '-srcstorepass',
-                  keystorePW,
-                  '-srcstoretype',
-                  'PKCS12',
-                  '-destkeystore',
-                  keystoreFN,
-                  '-deststorepass',
-                  keystorePW,
-                  '-deststoretype',
-                  'JKS',
-                  '-keyalg',
-                  'RSA',
-                  '-noprompt'
-        ])
-        self.run([self.cmd_chown, '%s:%s' % (user, user), pkcs_fn])
-        self.run([self.cmd_chmod, '700', pkcs_fn])
-        self.run([self.cmd_chown, '%s:%s' % (user, user), keystoreFN])
-        self.run([self.cmd_chmod, '700', keystoreFN])
+        code = self.run([self.cmd_keytool,
+                         '-importkeystore',
+                         '-srckeystore',
+                         '%s/%s.pkcs12' % (self.certFolder, suffix),
+                         '-srcstorepass',
+                         keystorePW,
+                         '-srcstoretype',
+                         'PKCS12',
+                         '-destkeystore',
+                         keystoreFN,
+                         '-deststorepass',
+                         keystorePW,
+                         '-deststoretype',
+                         'JKS',
+                         '-keyalg',
+                         'RSA',
+                         '-noprompt'
+                        ])
+        # keytool reports imported entries on stderr, only its exit code tells failures
+        if code != 0:
+            self.logIt("Error creating keystore %s" % keystoreFN, True)
+        plan = self.newPermissionPlan()
+        plan.add(pkcs_fn, owner='%s:%s' % (user, user), mode=0700)
+        plan.add(keystoreFN, owner='%s:%s' % (user, user), mode=0700)
+        plan.apply()
+
+    def start_keygen_daemon(self):
+        """Starts one JVM running static/scripts/keygen_daemon.py with Jython,
+        it serves all OpenID key generation and export requests"""
+        jythonJar = '%s/jython.jar' % self.jython_home
+        if not self.useKeyGeneratorDaemon or not os.path.exists(jythonJar) or not os.path.exists(self.keygen_daemon_script):
+            return None
 
-    def gen_openid_jwks_jks_keys(self, jks_path, jks_pwd, jks_create = True, key_expiration = None, dn_name = None, key_algs = None):
-        self.logIt("Generating oxAuth OpenID Connect keys")
+        oxauth_lib_files = self.findFiles(self.oxauth_keys_utils_libs, self.jetty_user_home_lib)
+        args = [self.cmd_java,
+                "-Dlog4j.defaultInitOverride=true",
+                "-Dpython.home=%s" % self.jython_home,
+                "-cp",
+                ":".join(oxauth_lib_files + [jythonJar]),
+                "org.python.util.jython",
+                self.keygen_daemon_script]
+
+        self.logIt("Starting key generator daemon: %s" % " ".join(args))
+        try:
+            process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except:
+            self.logIt("Error starting key generator daemon", True)
+            self.logIt(traceback.format_exc(), True)
+            self.useKeyGeneratorDaemon = False
+            return None
+
+        self.attach_keygen_daemon(process)
+        atexit.register(self.stop_keygen_daemon)
+        return self.keygen_daemon
+
+    def attach_keygen_daemon(self, process):
+        """Uses process as key generator daemon. Its stdout lines are queued
+        by a reader thread, so waiting for a response can time out."""
+        self.keygen_daemon = process
+        self.keygenDaemonResponses = Queue.Queue()
+
+        def read_stdout(stream, responses):
+            for line in iter(stream.readline, ''):
+                responses.put(line)
+            responses.put('')
+
+        def log_stderr(stream):
+            for line in iter(stream.readline, ''):
+                self.logIt("Key generator daemon: %s" % line.rstrip(), True)
+
+        for target, args in ((read_stdout, (process.stdout, self.keygenDaemonResponses)),
+                             (log_stderr, (process.stderr,))):
+            reader = threading.Thread(target=target, args=args)
+            reader.daemon = True
+            reader.start()
+
+    def stop_keygen_daemon(self):
+        if not self.keygen_daemon:
+            return
+
+        self.logIt("Stopping key generator daemon")
+        try:
+            if self.keygen_daemon.poll() == None:
+                self.keygen_daemon.stdin.write('%s\n' % json.dumps({'action': 'quit'}))
+                self.keygen_daemon.stdin.close()
+                self.keygen_daemon.wait()
+        except:
+            self.logIt("Error stopping key generator daemon", True)
+            self.logIt(traceback.format_exc(), True)
+        self.keygen_daemon = None
+
+    def keygen_daemon_requests(self, requests):
+        """Sends requests to the key generator daemon and returns list of
+        responses. Response is None for requests which the daemon didn't
+        serve."""
+        with self.keygenDaemonLock:
+            if not self.keygen_daemon and self.useKeyGeneratorDaemon:
+                self.start_keygen_daemon()
+
+            if not self.keygen_daemon or self.keygen_daemon.poll() != None:
+                return [None] * len(requests)
+
+            responses = []
+            try:
+                for i, request in enumerate(requests):
+                    self.keygen_daemon.stdin.write('%s\n' % json.dumps(dict(request, id=i)))
+                self.keygen_daemon.stdin.flush()
+
+                for request in requests:
+                    try:
+                        line = self.keygenDaemonResponses.get(timeout=int(self.keygenDaemonTimeout))
+                    except Queue.Empty:
+                        self.logIt("Key generator daemon didn't respond in %s seconds" % self.keygenDaemonTimeout, True)
+                        break
+                    if not line:
+                        break
+                    responses.append(json.loads(line))
+            except:
+                self.logIt("Error communicating with key generator daemon", True)
+                self.logIt(traceback.format_exc(), True)
 
-        if dn_name == None:
-            dn_name = self.default_openid_jks_dn_name
+            if len(responses) < len(requests):
+                self.logIt("Key generator daemon stopped unexpectedly", True)
+                try:
+                    if self.keygen_daemon.poll() == None:
+                        self.keygen_daemon.kill()
+                        self.keygen_daemon.wait()
+                except:
+                    self.logIt(traceback.format_exc(), True)
+                self.useKeyGeneratorDaemon = False
+                self.keygen_daemon = None
+
+            return responses + [None] * (len(requests) - len(responses))
+
+    def gen_openid_jwks_jks_keys(self, jks_path, jks_pwd, jks_create = True, key_expiration = None, dn_name = None, key_algs = None):
+        return self.gen_openid_jwks_jks_keys_batch([(jks_path, jks_pwd, jks_create, key_expiration, dn_name, key_algs)])[0]
+
+    def gen_openid_jwks_jks_keys_batch(self, jobs):
+        """Generates keystores and JWKS for list of gen_openid_jwks_jks_keys
+        argument tuples. All jobs are sent to the key generator daemon at once,
+        jobs it can't serve are run with keytool/java commands."""
+        requests = []
+        for jks_path, jks_pwd, jks_create, key_expiration, dn_name, key_algs in [tuple(job) + (None,) * (6 - len(job)) for job in jobs]:
+            requests.append({'action': 'genkeys',
+                             'keystore': jks_path,
+                             'password': jks_pwd,
+                             'create': jks_create != False,
+                             'expiration': key_expiration or self.default_key_expiration,
+                             'dnname': dn_name or self.default_openid_jks_dn_name,
+                             'algorithms': key_algs or self.default_key_algs})
+
+        results = []
+        responses = self.keygen_daemon_requests(requests)
+        for request, response in zip(requests, responses):
+            self.logIt("Generating oxAuth OpenID Connect keys in %s" % request['keystore'])
+            if response and response['status'] == 'ok' and response['output'].strip():
+                if response['error']:
+                    self.logIt(response['error'], True)
+                results.append(response['output'].split(os.linesep))
+            else:
+                if response:
+                    self.logIt("Key generator daemon failed for %s: %s" % (request['keystore'], response['error']), True)
+                results.append(self.gen_openid_jwks_jks_keys_cmd(request['keystore'], request['password'], request['create'],
+                                                                 request['expiration'], request['dnname'], request['algorithms']))
 
-        if key_algs == None:
-            key_algs = self.default_key_algs
+        return results
 
-        if key_expiration == None:
-            key_expiration = self.default_key_expiration
+    def gen_openid_jwks_jks_keys_cmd(self, jks_path, jks_pwd, jks_create, key_expiration, dn_name, key_algs):
+        self.logIt("Generating oxAuth OpenID Connect keys with keytool and KeyGenerator commands")
 
 
         # We can remove this once KeyGenerator will do the same
@@ -1453,6 +2201,18 @@ class Setup(object):
     def export_openid_key(self, jks_path, jks_pwd, cert_alias, cert_path):
         self.logIt("Exporting oxAuth OpenID Connect keys")
 
+        response = self.keygen_daemon_requests([{'action': 'export',
+                                                 'keystore': jks_path,
+                                                 'password': jks_pwd,
+                                                 'alias': cert_alias,
+                                                 'exportfile': cert_path}])[0]
+        if response and response['status'] == 'ok':
+            if response['output']:
+                self.logIt(response['output'])
+            return
+        elif response:
+            self.logIt("Key generator daemon failed to export %s: %s" % (cert_alias, response['error']), True)
+
         oxauth_lib_files = self.findFiles(self.oxauth_keys_utils_libs, self.jetty_user_home_lib)
 
         cmd = " ".join([self.cmd_java,
@@ -1481,8 +2241,7 @@ class Setup(object):
             f = open(fn, 'w')
             f.write(jwks_text)
             f.close()
-            self.run([self.cmd_chown, 'jetty:jetty', fn])
-            self.run([self.cmd_chmod, '600', fn])
+            self.newPermissionPlan().add(fn, owner='jetty:jetty', mode=0600).apply()
             self.logIt("Wrote oxAuth OpenID Connect key to %s" % fn)
         except:
             self.logIt("Error writing command : %s" % fn, True)
@@ -1514,10 +2273,9 @@ class Setup(object):
 
         self.scim_rs_client_jks_pass_encoded = self.obscure(self.scim_rs_client_jks_pass)
 
-        self.scim_rs_client_jwks = self.gen_openid_jwks_jks_keys(self.scim_rs_client_jks_fn, self.scim_rs_client_jks_pass)
+        self.scim_rs_client_jwks, self.scim_rp_client_jwks = self.gen_openid_jwks_jks_keys_batch([(self.scim_rs_client_jks_fn, self.scim_rs_client_jks_pass),
+                                                                                                 (self.scim_rp_client_jks_fn, self.scim_rp_client_jks_pass)])
         self.templateRenderingDict['scim_rs_client_base64_jwks'] = self.generate_base64_string(self.scim_rs_client_jwks, 1)
-
-        self.scim_rp_client_jwks = self.gen_openid_jwks_jks_keys(self.scim_rp_client_jks_fn, self.scim_rp_client_jks_pass)
         self.templateRenderingDict['scim_rp_client_base64_jwks'] = self.generate_base64_string(self.scim_rp_client_jwks, 1)
 
     def generate_passport_configuration(self):
@@ -1525,10 +2283,9 @@ class Setup(object):
 
         self.passport_rs_client_jks_pass_encoded = self.obscure(self.passport_rs_client_jks_pass)
 
-        self.passport_rs_client_jwks = self.gen_openid_jwks_jks_keys(self.passport_rs_client_jks_fn, self.passport_rs_client_jks_pass)
+        self.passport_rs_client_jwks, self.passport_rp_client_jwks = self.gen_openid_jwks_jks_keys_batch([(self.passport_rs_client_jks_fn, self.passport_rs_client_jks_pass),
+                                                                                                         (self.passport_rp_client_jks_fn, self.passport_rp_client_jks_pass)])
         self.templateRenderingDict['passport_rs_client_base64_jwks'] = self.generate_base64_string(self.passport_rs_client_jwks, 1)
-
-        self.passport_rp_client_jwks = self.gen_openid_jwks_jks_keys(self.passport_rp_client_jks_fn, self.passport_rp_client_jks_pass)
         self.templateRenderingDict['passport_rp_client_base64_jwks'] = self.generate_base64_string(self.passport_rp_client_jwks, 1)
 
     def getPrompt(self, prompt, defaultValue=None):
@@ -1557,12 +2314,80 @@ class Setup(object):
     def getQuad(self):
         return str(uuid.uuid4())[:4].upper()
 
+    def fileChecksum(self, filePath, algorithm='sha256'):
+        fileHash = hashlib.new(algorithm)
+        with open(filePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), ''):
+                fileHash.update(chunk)
+        return fileHash.hexdigest()
+
+    def extractArchiveMembers(self, archivePath, filePatterns, membersFolder, outputFolder):
+        """Extracts files in membersFolder of zip archive matching filePatterns
+        to outputFolder. Only matching members are read, the rest of the
+        archive is not touched. Results are cached by archive checksum in a
+        stamp file in outputFolder. Returns list of extracted file paths."""
+        archiveChecksum = self.fileChecksum(archivePath)
+        stampFn = '%s/.%s.extracted' % (outputFolder, os.path.basename(archivePath))
+        stamp = {'checksum': archiveChecksum, 'patterns': sorted(filePatterns)}
+
+        if os.path.exists(stampFn):
+            try:
+                with open(stampFn) as f:
+                    cached = json.load(f)
+                cachedFiles = cached.pop('files')
+                if cached == stamp and all(os.path.exists(fn) for fn in cachedFiles):
+                    self.logIt("Files from %s are up to date in %s" % (archivePath, outputFolder))
+                    return cachedFiles
+            except:
+                self.logIt("Ignoring invalid extraction stamp %s" % stampFn, True)
+
+        self.createDirs(outputFolder)
+        membersFolder = membersFolder.strip('/') + '/'
+        extractedFiles = []
+        with zipfile.ZipFile(archivePath) as archive:
+            for member in archive.infolist():
+                if not member.filename.startswith(membersFolder):
+                    continue
+                fileName = member.filename[len(membersFolder):]
+                if not fileName or '/' in fileName:
+                    continue
+                if not any(fnmatch.fnmatch(fileName, filePattern) for filePattern in filePatterns):
+                    continue
+
+                outputFn = os.path.join(outputFolder, fileName)
+                self.logIt("Extracting %s to %s" % (member.filename, outputFn))
+                fd, tmpFn = tempfile.mkstemp(dir=outputFolder, prefix='.%s.' % fileName)
+                try:
+                    with archive.open(member) as src, os.fdopen(fd, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1024*1024)
+                    os.chmod(tmpFn, 0666 & ~self.umask)
+                    os.rename(tmpFn, outputFn)
+                except:
+                    if os.path.exists(tmpFn):
+                        os.remove(tmpFn)
+                    raise
+                extractedFiles.append(outputFn)
+
+        stamp['files'] = extractedFiles
+        with open(stampFn, 'w') as f:
+            json.dump(stamp, f)
+
+        return extractedFiles
+
     def prepare_openid_keys_generator(self):
         self.logIt("Preparing files needed to run OpenId keys generator")
-        # Unpack oxauth.war to get libs needed to run key generator
+        # Extract libs needed to run key generator from oxauth.war
         oxauthWar = 'oxauth.war'
         distOxAuthPath = '%s/%s' % (self.distGluuFolder, oxauthWar)
 
+        self.logIt("Extracting key generator libraries from %s to %s..." % (oxauthWar, self.jetty_user_home_lib))
+        try:
+            self.extractArchiveMembers(distOxAuthPath, self.oxauth_keys_utils_libs, 'WEB-INF/lib', self.jetty_user_home_lib)
+            return
+        except:
+            self.logIt("Error extracting libraries from %s, unpacking whole archive" % distOxAuthPath, True)
+            self.logIt(traceback.format_exc(), True)
+
         tmpOxAuthDir = '%s/tmp_oxauth' % self.distGluuFolder
 
         self.logIt("Unpacking %s..." % oxauthWar)
@@ -1599,7 +2424,7 @@ class Setup(object):
 
     def load_certificate_text(self, filePath):
         self.logIt("Load certificate %s" % filePath)
-        f = open(filePath)
+        f = open(self.stagedPath(filePath))
         certificate_text = f.read()
         f.close()
         certificate_text = certificate_text.replace('-----BEGIN CERTIFICATE-----', '').replace('-----END CERTIFICATE-----', '').strip()
@@ -2075,32 +2900,139 @@ class Setup(object):
         return file_paths
 
     def fomatWithDict(self, text, dictionary):
-        text = re.sub(r"%([^\(])", r"%%\1", text)
-        text = re.sub(r"%$", r"%%", text)  # There was a % at the end?
+        return self.escapeTemplateText(text) % dictionary
 
-        return text % dictionary
+    def escapeTemplateText(self, text):
+        # Escape every % which doesn't start a %(key)s placeholder
+        text = self.templateEscapeRe.sub(r"%%\1", text)
+        text = self.templateTrailingEscapeRe.sub(r"%%", text)  # There was a % at the end?
 
-    def renderTemplateInOut(self, filePath, templateFolder, outputFolder):
-        self.logIt("Rendering template %s" % filePath)
-        fn = os.path.split(filePath)[-1]
-        f = open(os.path.join(templateFolder, fn))
+        return text
+
+    def compileTemplate(self, templatePath, escape=True):
+        """Returns the template text prepared for %-formatting. Compiled
+        templates are cached until the template file is modified."""
+        mtime = os.stat(templatePath).st_mtime
+        cacheKey = (templatePath, escape)
+        cached = self.templateCache.get(cacheKey)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        f = open(templatePath)
         template_text = f.read()
         f.close()
-        newFn = open(os.path.join(outputFolder, fn), 'w+')
-        newFn.write(self.fomatWithDict(template_text, self.merge_dicts(self.__dict__, self.templateRenderingDict)))
-        newFn.close()
+        if escape:
+            template_text = self.escapeTemplateText(template_text)
+
+        self.templateCache[cacheKey] = (mtime, template_text)
+        return template_text
+
+    def get_rendering_context(self):
+        """Merged Setup attributes and templateRenderingDict. Build it once per
+        rendering phase and pass it to renderTemplateInOut."""
+        return self.merge_dicts(self.__dict__, self.templateRenderingDict)
+
+    def stagedPath(self, path):
+        """Returns path moved under its staging folder when rendering for a
+        fleet node, see build_fleet()"""
+        for realFolder, stagingFolder in self.stagingPaths.items():
+            if path == realFolder or path.startswith(realFolder + '/'):
+                return stagingFolder + path[len(realFolder):]
+        return path
+
+    def writeRenderedTemplate(self, outputPath, text):
+        """Writes text to a temporary file next to outputPath and renames it
+        into place, so readers never see a partially written file"""
+        outputPath = self.stagedPath(outputPath)
+        outputDir = os.path.dirname(outputPath) or '.'
+        fd, tmpPath = tempfile.mkstemp(prefix='.%s.' % os.path.basename(outputPath), dir=outputDir)
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write(text)
+            f.close()
+            # mkstemp creates files readable by owner only
+            os.chmod(tmpPath, 0666 & ~self.umask)
+            os.rename(tmpPath, outputPath)
+        except:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+    def renderTemplateInOut(self, filePath, templateFolder, outputFolder, context=None):
+        self.logIt("Rendering template %s" % filePath)
+        fn = os.path.split(filePath)[-1]
+        if context == None:
+            context = self.get_rendering_context()
+        template_text = self.compileTemplate(os.path.join(templateFolder, fn))
+        self.writeRenderedTemplate(os.path.join(outputFolder, fn), template_text % context)
+
+    def renderTemplate(self, filePath, context=None):
+        self.renderTemplateInOut(filePath, self.templateFolder, self.outputFolder, context)
+
+    def render_template_job(self, job, context):
+        templatePath, outputPath, escape = job
+        outputPath = self.stagedPath(outputPath)
+        started = time.time()
+        try:
+            template_text = self.compileTemplate(templatePath, escape)
+
+            outputDir = os.path.dirname(outputPath)
+            if not os.path.exists(outputDir):
+                try:
+                    os.makedirs(outputDir)
+                except OSError:
+                    # Created meanwhile by another rendering thread
+                    if not os.path.isdir(outputDir):
+                        raise
+
+            self.writeRenderedTemplate(outputPath, template_text % context)
+            self.logIt("Rendered template %s to %s in %.1f ms" % (templatePath, outputPath, (time.time() - started) * 1000))
+            return True
+        except:
+            self.logIt("Error writing template %s" % templatePath, True)
+            self.logIt(traceback.format_exc(), True)
+            return False
+
+    def render_template_jobs(self, jobs, context=None):
+        """Renders (templatePath, outputPath, escape) jobs concurrently with
+        one shared rendering context"""
+        if not jobs:
+            return
 
-    def renderTemplate(self, filePath):
-        self.renderTemplateInOut(filePath, self.templateFolder, self.outputFolder)
+        if context == None:
+            context = self.get_rendering_context()
+
+        threads = max(1, min(int(self.templateRenderingThreads), len(jobs)))
+        started = time.time()
+        pool = ThreadPool(threads)
+        try:
+            results = pool.map(lambda job: self.render_template_job(job, context), jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.logIt("Rendered %d of %d templates in %.2f s using %d threads" % (results.count(True), len(jobs), time.time() - started, threads))
+
+    def get_ce_template_jobs(self):
+        jobs = []
+        for fullPath in self.ce_templates.keys():
+            fn = os.path.split(fullPath)[-1]
+            jobs.append((os.path.join(self.templateFolder, fn), os.path.join(self.outputFolder, fn), True))
+        return jobs
+
+    def get_templates_folder_jobs(self, templatesFolder):
+        jobs = []
+        for templateBase, templateDirectories, templateFiles in os.walk(templatesFolder):
+            for templateFile in templateFiles:
+                fullPath = '%s/%s' % (templateBase, templateFile)
+                # Remove ./template/ and everything left of it from fullPath
+                fn = re.match(r'(^.+/templates/)(.*$)', fullPath).groups()[1]
+                jobs.append((os.path.join(self.templateFolder, fn), os.path.join(self.outputFolder, fn), False))
+        return jobs
 
     def render_templates(self):
         self.logIt("Rendering templates")
-        for fullPath in self.ce_templates.keys():
-            try:
-                self.renderTemplate(fullPath)
-            except:
-                self.logIt("Error writing template %s" % fullPath, True)
-                self.logIt(traceback.format_exc(), True)
+        self.render_template_jobs(self.get_ce_template_jobs())
 
     def render_custom_templates(self, fullPath):
         output_dir = fullPath + '.output'
@@ -2115,8 +3047,10 @@ class Setup(object):
             self.logIt(traceback.format_exc(), True)
 
         try:
+            jobs = []
             for filename in self.get_filepaths(fullPath):
-                self.renderTemplateInOut(filename, fullPath, output_dir)
+                jobs.append((os.path.join(fullPath, filename), os.path.join(output_dir, filename), True))
+            self.render_template_jobs(jobs)
         except:
             self.logIt("Error writing template %s" % fullPath, True)
             self.logIt(traceback.format_exc(), True)
@@ -2131,32 +3065,15 @@ class Setup(object):
             self.logIt("Error writing template %s" % fullPath, True)
             self.logIt(traceback.format_exc(), True)
 
-    def render_templates_folder(self, templatesFolder):
-        self.logIt("Rendering templates folder: %s" % templatesFolder)
+    def render_templates_folders(self, templatesFolders):
+        jobs = []
+        for templatesFolder in templatesFolders:
+            self.logIt("Rendering templates folder: %s" % templatesFolder)
+            jobs.extend(self.get_templates_folder_jobs(templatesFolder))
+        self.render_template_jobs(jobs)
 
-        for templateBase, templateDirectories, templateFiles in os.walk(templatesFolder):
-            for templateFile in templateFiles:
-                fullPath = '%s/%s' % (templateBase, templateFile)
-                try:
-                    self.logIt("Rendering test template %s" % fullPath)
-                    # Remove ./template/ and everything left of it from fullPath
-                    fn = re.match(r'(^.+/templates/)(.*$)', fullPath).groups()[1]
-                    f = open(os.path.join(self.templateFolder, fn))
-                    template_text = f.read()
-                    f.close()
-
-                    fullOutputFile = os.path.join(self.outputFolder, fn)
-                    # Create full path to the output file
-                    fullOutputDir = os.path.dirname(fullOutputFile)
-                    if not os.path.exists(fullOutputDir):
-                        os.makedirs(fullOutputDir)
-
-                    newFn = open(fullOutputFile, 'w+')
-                    newFn.write(template_text % self.merge_dicts(self.__dict__, self.templateRenderingDict))
-                    newFn.close()
-                except:
-                    self.logIt("Error writing template %s" % fullPath, True)
-                    self.logIt(traceback.format_exc(), True)
+    def render_templates_folder(self, templatesFolder):
+        self.render_templates_folders([templatesFolder])
 
     def render_test_templates(self):
         self.logIt("Rendering test templates")
@@ -2176,6 +3093,11 @@ class Setup(object):
         nodeTepmplatesFolder = '%s/node/' % self.templateFolder
         self.render_templates_folder(nodeTepmplatesFolder)
 
+    def render_service_templates(self):
+        self.logIt("Rendering jetty and node templates")
+
+        self.render_templates_folders(['%s/jetty/' % self.templateFolder, '%s/node/' % self.templateFolder])
+
     def prepare_base64_extension_scripts(self):
         try:
             if not os.path.exists(self.extensionFolder):
@@ -2212,7 +3134,7 @@ class Setup(object):
         self.logIt('Loading file %s' % fn)
         plain_file_b64encoded_text = None
         try:
-            plain_file = open(fn)
+            plain_file = open(self.stagedPath(fn))
             plain_file_text = plain_file.read()
             plain_file_b64encoded_text = plain_file_text.encode('base64').strip()
             plain_file.close()
@@ -2242,23 +3164,375 @@ class Setup(object):
         self.templateRenderingDict['oxasimba_config_base64'] = self.generate_base64_ldap_file(self.oxasimba_config_json)
 
     # args = command + args, i.e. ['ls', '-ltr']
-    def run(self, args, cwd=None, env=None, useWait=False):
+    def run_async(self, args, cwd=None, env=None, timeout=None):
+        """Starts command and returns its RunningCommand without waiting"""
         self.logIt('Running: %s' % ' '.join(args))
+        profileToken = None
+        if self.profiler:
+            profileToken = self.profiler.begin(os.path.basename(args[0]), 'command', {'cmd': ' '.join(args)})
+
+        def finished(command):
+            if profileToken:
+                self.profiler.end(profileToken)
+            self.commandResults.append({'cmd': ' '.join(command.args),
+                                        'code': command.returncode,
+                                        'duration': command.duration,
+                                        'timed_out': command.timedOut})
+            self.logCommand('Run: %s with result code: %d in %.2f s' % (' '.join(command.args), command.returncode, command.duration),
+                            command.returncode != 0)
+
+        timeout = timeout or self.commandTimeout
         try:
-            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
-            if useWait:
-                code = p.wait()
-                self.logIt('Run: %s with result code: %d' % (' '.join(args), code) )
-            else:
-                output, err = p.communicate()
-                if output:
-                    self.logIt(output)
-                if err:
-                    self.logIt(err, True)
+            return RunningCommand(args, cwd, env, float(timeout) if timeout else None, self.logCommand, finished)
+        except:
+            if profileToken:
+                self.profiler.end(profileToken)
+            raise
+
+    def run(self, args, cwd=None, env=None, useWait=False, timeout=None):
+        """Runs command, logging its output while it runs. Returns exit code
+        or None if the command could not be started. With useWait the
+        output of processes the command leaves running is not waited for."""
+        try:
+            command = self.run_async(args, cwd, env, timeout)
+            return command.wait(0.5 if useWait else None)
         except:
             self.logIt("Error running command : %s" % " ".join(args), True)
             self.logIt(traceback.format_exc(), True)
 
+    def write_profile(self):
+        if not self.profiler:
+            return
+
+        try:
+            self.profiler.write_trace(self.profileTrace)
+            summary = self.profiler.summary()
+            self.logIt("Setup profile, trace written to %s\n%s" % (self.profileTrace, summary))
+            print "\nSetup profile (trace written to %s):\n%s\n" % (self.profileTrace, summary)
+        except:
+            self.logIt("Error writing setup profile", True)
+            self.logIt(traceback.format_exc(), True)
+
+    def serializable(self, value):
+        """Returns value if it can be stored in JSON state file, else raises
+        TypeError"""
+        if value == None or isinstance(value, (bool, int, long, float, basestring)):
+            return value
+        if isinstance(value, (list, tuple)):
+            return [self.serializable(item) for item in value]
+        if isinstance(value, dict):
+            if not all(isinstance(key, basestring) for key in value):
+                raise TypeError("Non string keys")
+            return dict((key, self.serializable(item)) for key, item in value.iteritems())
+        raise TypeError("Can't serialize %s" % type(value))
+
+    def get_state_snapshot(self):
+        snapshot = {}
+        for key, value in self.__dict__.items():
+            if key in self.stateExcludedAttributes:
+                continue
+            try:
+                snapshot[key] = self.serializable(value)
+            except TypeError:
+                pass
+        return snapshot
+
+    def fingerprint_paths(self, paths, fingerprint):
+        """Adds path, size and mtime of files in paths to fingerprint hash"""
+        for path in paths:
+            if not os.path.exists(path):
+                fingerprint.update('missing:%s\n' % path)
+                continue
+            for root, dirs, files in os.walk(path) if os.path.isdir(path) else [(os.path.dirname(path), [], [os.path.basename(path)])]:
+                dirs.sort()
+                for fn in sorted(files):
+                    filePath = os.path.join(root, fn)
+                    try:
+                        st = os.stat(filePath)
+                        fingerprint.update('%s:%d:%d\n' % (filePath, st.st_size, int(st.st_mtime)))
+                    except OSError:
+                        fingerprint.update('missing:%s\n' % filePath)
+
+    def get_step_fingerprint(self, name, snapshot, inputs=()):
+        fingerprint = hashlib.sha256(name)
+        fingerprint.update(json.dumps(snapshot, sort_keys=True))
+        self.fingerprint_paths(inputs, fingerprint)
+        return fingerprint.hexdigest()
+
+    def load_setup_state(self):
+        if not os.path.exists(self.stateFn):
+            self.logIt("No setup state in %s, running all steps" % self.stateFn)
+            return False
+        try:
+            with open(self.stateFn) as f:
+                self.setupState = json.load(f)
+            return True
+        except:
+            self.logIt("Error loading setup state %s, running all steps" % self.stateFn, True)
+            self.logIt(traceback.format_exc(), True)
+            self.setupState = {'initial': None, 'steps': {}}
+            return False
+
+    def save_setup_state(self):
+        # State holds passwords like setup.properties.last, only root can read it
+        try:
+            fd, tmpFn = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.stateFn)), prefix='.setup_state.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.setupState, f, indent=1, sort_keys=True)
+            os.rename(tmpFn, self.stateFn)
+        except:
+            self.logIt("Error saving setup state %s" % self.stateFn, True)
+            self.logIt(traceback.format_exc(), True)
+
+    def save_initial_state(self):
+        """Records properties after check_properties, --resume restores them
+        so generated passwords and inums stay the same"""
+        self.setupState['initial'] = self.get_state_snapshot()
+        self.save_setup_state()
+
+    def restore_initial_state(self):
+        if not self.setupState.get('initial'):
+            return False
+        self.logIt("Restoring properties of previous install from %s" % self.stateFn)
+        self.__dict__.update(self.setupState['initial'])
+        return True
+
+    def run_step(self, step, inputs=()):
+        """Runs install step, a Setup method. With resume the step is skipped
+        if it completed before with the same fingerprint of Setup attributes
+        and input files, the attributes it changed are restored instead."""
+        name = step.__name__
+        before = self.get_state_snapshot()
+        fingerprint = self.get_step_fingerprint(name, before, inputs)
+        previous = self.setupState['steps'].get(name)
+
+        if previous and previous.get('pinned'):
+            self.logIt("Skipping step %s, done when the fleet bundle was built" % name)
+            return False
+
+        if self.resume and previous and previous['status'] == 'done' and previous['fingerprint'] == fingerprint:
+            self.logIt("Skipping step %s, completed at %s with unchanged inputs" % (name, previous['time']))
+            self.__dict__.update(previous['changes'])
+            self.templateRenderingDict.update(previous['rendering'])
+            return False
+
+        self.logIt("Running step %s" % name)
+        renderingBefore = before.get('templateRenderingDict', {})
+        started = time.time()
+        self.setupState['steps'][name] = {'status': 'running', 'fingerprint': fingerprint,
+                                          'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        errorCount = self.logErrorCount
+        try:
+            step()
+        except:
+            self.setupState['steps'][name]['status'] = 'failed'
+            self.save_setup_state()
+            raise
+
+        # most steps log their errors and go on, they have to run again too
+        errors = self.logErrorCount - errorCount
+        if errors:
+            self.logIt("Step %s logged %d errors, it runs again on resume" % (name, errors), True)
+            self.setupState['steps'][name].update({'status': 'failed', 'errors': errors,
+                                                   'duration': round(time.time() - started, 3)})
+            self.save_setup_state()
+            return True
+
+        after = self.get_state_snapshot()
+        rendering = after.pop('templateRenderingDict', {})
+        self.setupState['steps'][name].update({
+            'status': 'done',
+            'duration': round(time.time() - started, 3),
+            'changes': dict((key, value) for key, value in after.iteritems() if before.get(key, self) != value),
+            'rendering': dict((key, value) for key, value in rendering.iteritems() if renderingBefore.get(key, self) != value)})
+        self.save_setup_state()
+        return True
+
+    def redirect_paths(self, value, oldFolder, newFolder):
+        """Returns value with paths under oldFolder moved to newFolder, lists
+        and dicts are processed recursively"""
+        if isinstance(value, basestring):
+            if value == oldFolder or value.startswith(oldFolder + '/'):
+                return newFolder + value[len(oldFolder):]
+            return value
+        if isinstance(value, list):
+            return [self.redirect_paths(item, oldFolder, newFolder) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.redirect_paths(item, oldFolder, newFolder) for item in value)
+        if isinstance(value, dict):
+            return dict((key, self.redirect_paths(item, oldFolder, newFolder)) for key, item in value.iteritems())
+        return value
+
+    def redirect_attributes(self, oldFolder, newFolder):
+        """Moves every path attribute under oldFolder to newFolder, used to
+        generate keys of fleet nodes into their bundle folders"""
+        for key, value in self.__dict__.items():
+            if key not in self.stateExcludedAttributes:
+                self.__dict__[key] = self.redirect_paths(value, oldFolder, newFolder)
+
+    def load_cluster_spec(self, fn):
+        """Loads cluster spec for build_fleet():
+
+            {"bundleFolder": "fleet",
+             "nodes": [{"name": "oxauth1", "ip": "10.0.0.11", "hostname": "oxauth1.example.org",
+                        "memory_mb": 8192, "cpus": 4, "certs": ["httpd"],
+                        "properties": {"installOxTrust": false}}]}
+
+        Every node needs a unique name. properties override setup properties
+        for the node, certs lists certificates generated for the node with
+        its hostname instead of sharing the cluster ones."""
+        spec = self.load_json(fn)
+        if not spec or not spec.get('nodes'):
+            raise ValueError("Cluster spec %s has no nodes" % fn)
+        names = [node.get('name') for node in spec['nodes']]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError("Nodes in cluster spec %s need unique names" % fn)
+        for node in spec['nodes']:
+            unknown = [suffix for suffix in node.get('certs', ['httpd']) if suffix not in self.fleetNodeCerts]
+            if unknown:
+                raise ValueError("Can't generate %s certificates for node %s" % (', '.join(unknown), node['name']))
+        return spec
+
+    def build_fleet(self, spec):
+        """Generates secrets and keys shared by the cluster once, then per node
+        certificates, rendered output folder and LDIF concurrently. Writes a
+        bundle for every node and returns list of bundle paths."""
+        started = time.time()
+        bundleFolder = os.path.abspath(spec.get('bundleFolder') or '%s/fleet' % self.install_dir)
+        sharedCerts = os.path.join(bundleFolder, 'shared', 'certs')
+        if not os.path.exists(sharedCerts):
+            os.makedirs(sharedCerts, 0700)
+
+        # Ownership and truststores are set up by the nodes
+        self.permissionsDryRun = True
+        self.trustGeneratedCerts = False
+
+        self.logIt("Generating secrets and keys shared by cluster nodes in %s" % sharedCerts)
+        realCertFolder = self.certFolder
+        self.redirect_attributes(realCertFolder, sharedCerts)
+        try:
+            for step in [self.make_salt, self.make_oxauth_salt, self.install_gluu_base, self.encode_passwords,
+                         self.encode_test_passwords, self.prepare_base64_extension_scripts,
+                         self.generate_crypto, self.generate_oxauth_openid_keys]:
+                step()
+        finally:
+            self.redirect_attributes(sharedCerts, realCertFolder)
+
+        nodes = spec['nodes']
+        pool = ThreadPool(max(1, min(int(self.fleetThreads), len(nodes))))
+        try:
+            bundles = pool.map(lambda node: self.build_fleet_node(node, bundleFolder, sharedCerts, realCertFolder), nodes)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.logIt("Built %d fleet bundles in %.1f s" % (len(bundles), time.time() - started))
+        return bundles
+
+    def build_fleet_node(self, node, bundleFolder, sharedCerts, realCertFolder):
+        name = node['name']
+        nodeFolder = os.path.join(bundleFolder, name)
+        nodeCerts = os.path.join(nodeFolder, 'certs')
+        nodeOutput = os.path.join(nodeFolder, 'output')
+        self.logIt("Building fleet bundle for node %s" % name)
+        self.removeDirs(nodeFolder)
+
+        nodeSetup = copy.copy(self)
+        nodeSetup.__dict__.update(copy.deepcopy(self.get_state_snapshot()))
+        nodeSetup.__dict__.update(node.get('properties', {}))
+        if node.get('ip'):
+            nodeSetup.ip = node['ip']
+        if node.get('memory_mb') or node.get('cpus'):
+            nodeSetup.hostResources = (node.get('memory_mb'), node.get('memory_mb'), int(node.get('cpus') or 1))
+        nodeSetup.stagingPaths = {}
+
+        # Node certificates replace the shared ones in its copy of the cert folder
+        self.getTreeSync().syncTree(sharedCerts, nodeCerts)
+        nodeSetup.redirect_attributes(realCertFolder, nodeCerts)
+        try:
+            certs = node.get('certs', ['httpd'])
+            if certs:
+                cn = node.get('hostname') or nodeSetup.hostname
+                nodeSetup.gen_certs([(suffix, getattr(nodeSetup, self.fleetNodeCerts[suffix][0]), self.fleetNodeCerts[suffix][1], cn)
+                                     for suffix in certs])
+                keystores = [(suffix,
+                              getattr(nodeSetup, self.fleetNodeCerts[suffix][2]),
+                              getattr(nodeSetup, self.fleetNodeCerts[suffix][3]),
+                              '%s/%s.key' % (nodeSetup.certFolder, suffix),
+                              '%s/%s.crt' % (nodeSetup.certFolder, suffix),
+                              'jetty') for suffix in certs if self.fleetNodeCerts[suffix][2]]
+                if keystores:
+                    nodeSetup.gen_keystores(keystores)
+        finally:
+            nodeSetup.redirect_attributes(nodeCerts, realCertFolder)
+
+        # Rendered files go to the node's bundle folder, paths in them are
+        # the ones the node uses
+        for root, dirs, files in os.walk(nodeSetup.outputFolder):
+            self.createDirs(os.path.join(nodeOutput, os.path.relpath(root, nodeSetup.outputFolder)))
+        self.createDirs(nodeOutput)
+        nodeSetup.stagingPaths = {nodeSetup.outputFolder: nodeOutput, realCertFolder: nodeCerts}
+        try:
+            for step in [nodeSetup.calculate_aplications_memory, nodeSetup.render_templates,
+                         nodeSetup.generate_base64_configuration, nodeSetup.render_configuration_template,
+                         nodeSetup.render_service_templates, nodeSetup.render_test_templates]:
+                step()
+        finally:
+            nodeSetup.stagingPaths = {}
+
+        nodeSetup.permissionsDryRun = False
+        nodeSetup.trustGeneratedCerts = True
+        initial = nodeSetup.get_state_snapshot()
+        for key in self.fleetHostAttributes:
+            initial.pop(key, None)
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        state = {'initial': initial,
+                 'steps': dict((step, {'status': 'done', 'pinned': True, 'fingerprint': 'fleet', 'time': now})
+                               for step in self.fleetPinnedSteps)}
+
+        stateFn = os.path.join(nodeFolder, 'setup_state.json')
+        with os.fdopen(os.open(stateFn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+
+        bundleFn = os.path.join(bundleFolder, '%s.tar.gz' % name)
+        with os.fdopen(os.open(bundleFn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'wb') as f:
+            bundle = tarfile.open(fileobj=f, mode='w:gz')
+            try:
+                bundle.add(stateFn, 'setup_state.json')
+                bundle.add(nodeCerts, 'certs')
+                bundle.add(nodeOutput, 'output')
+            finally:
+                bundle.close()
+
+        self.logIt("Wrote fleet bundle %s" % bundleFn)
+        return bundleFn
+
+    def apply_bundle(self, bundleFn):
+        """Unpacks fleet bundle built by build_fleet(). Certificates go to
+        certFolder, rendered files to outputFolder and the install state makes
+        the install skip steps done for the node."""
+        self.logIt("Applying fleet bundle %s" % bundleFn)
+        tmpDir = tempfile.mkdtemp(prefix='gluu-bundle-')
+        try:
+            bundle = tarfile.open(bundleFn)
+            try:
+                for member in bundle.getmembers():
+                    if member.name.startswith('/') or '..' in member.name.split('/') or not (member.isfile() or member.isdir()):
+                        raise ValueError("Unexpected member %s in bundle %s" % (member.name, bundleFn))
+                bundle.extractall(tmpDir)
+            finally:
+                bundle.close()
+
+            self.createDirs(self.certFolder)
+            self.copyTree(os.path.join(tmpDir, 'certs'), self.certFolder, True)
+            self.copyTree(os.path.join(tmpDir, 'output'), self.outputFolder, True)
+            shutil.copyfile(os.path.join(tmpDir, 'setup_state.json'), self.stateFn)
+            os.chmod(self.stateFn, 0600)
+        finally:
+            self.removeDirs(tmpDir)
+
+        self.resume = True
+
     def save_properties(self):
         self.logIt('Saving properties to %s' % self.savedProperties)
 
@@ -2380,47 +3654,74 @@ class Setup(object):
            service_path = '/usr/sbin/service'
            apache_service_name = 'apache2'
 
-        # Apache HTTPD
-        if self.os_type in ['centos', 'redhat', 'fedora'] and self.os_initdaemon == 'systemd':
-           self.run([service_path, 'enable', apache_service_name])
-           self.run([service_path, 'start', apache_service_name])
-        else:
-           self.run([service_path, apache_service_name, 'start'])
+        systemd = self.os_type in ['centos', 'redhat', 'fedora'] and self.os_initdaemon == 'systemd'
+        orchestrator = ServiceOrchestrator(self.logIt)
+        timeout = int(self.serviceStartTimeout)
+
+        # Apache HTTPD, nothing listens on 443 without it
+        if self.installHttpd:
+            def start_apache():
+                if systemd:
+                   self.run([service_path, 'enable', apache_service_name])
+                   self.run([service_path, 'start', apache_service_name])
+                else:
+                   self.run([service_path, apache_service_name, 'start'], None, None, True)
+
+            orchestrator.add('apache', start_apache, probe=tcp_probe('localhost', 443), timeout=timeout)
 
         # Memcached
-        if self.os_type in ['centos', 'redhat', 'fedora'] and self.os_initdaemon == 'systemd':
-           self.run([service_path, 'start', 'memcached.service'])
-        else:
-           self.run([service_path, 'memcached', 'start'])
+        def start_memcached():
+            if systemd:
+               self.run([service_path, 'start', 'memcached.service'])
+            else:
+               self.run([service_path, 'memcached', 'start'], None, None, True)
+
+        orchestrator.add('memcached', start_memcached, probe=tcp_probe('localhost', 11211), timeout=timeout)
 
         # Openldap
         if self.installLdap:
-            # FIXME Tested on ubuntu only
-            if self.os_type in ['centos', 'redhat', 'fedora'] and self.os_initdaemon == 'systemd':
-               self.run([service_path, 'restart', 'rsyslog.service'])
-               self.run([service_path, 'start', 'solserver.service'])
-            else:
-	           # Below two lines are specifically for Ubuntu 14.04
-               if self.os_type == 'ubuntu':
-                   self.copyFile(self.rsyslogUbuntuInitFile, "/etc/init.d")
-                   self.removeFile("/etc/init/rsyslog.conf")
-                   rsyslogFn = os.path.split(self.rsyslogUbuntuInitFile)[-1]
-                   self.run([self.cmd_chmod, "755", "/etc/init.d/%s" % rsyslogFn])
-
-               self.run([service_path, 'rsyslog', 'restart'])
-               self.run([service_path, 'solserver', 'start'])
+            def start_ldap():
+                # FIXME Tested on ubuntu only
+                if systemd:
+                   self.run([service_path, 'restart', 'rsyslog.service'])
+                   self.run([service_path, 'start', 'solserver.service'])
+                else:
+                   # Below two lines are specifically for Ubuntu 14.04
+                   if self.os_type == 'ubuntu':
+                       self.copyFile(self.rsyslogUbuntuInitFile, "/etc/init.d")
+                       self.removeFile("/etc/init/rsyslog.conf")
+                       rsyslogFn = os.path.split(self.rsyslogUbuntuInitFile)[-1]
+                       self.run([self.cmd_chmod, "755", "/etc/init.d/%s" % rsyslogFn])
+
+                   self.run([service_path, 'rsyslog', 'restart'], None, None, True)
+                   self.run([service_path, 'solserver', 'start'], None, None, True)
+
+            orchestrator.add('ldap', start_ldap, probe=tcp_probe('localhost', self.ldaps_port), timeout=timeout)
+
+        # Jetty and node services, started once the services they require are ready
+        def service_starter(applicationName):
+            def start():
+                if systemd:
+                   self.run([service_path, 'start', applicationName], None, None, True)
+                else:
+                   self.run([service_path, applicationName, 'start'], None, None, True)
+            return start
 
-        # Jetty services
         try:
-            # Iterate through all components and start installed
             for applicationName, applicationConfiguration in self.jetty_app_configuration.iteritems():
                 if applicationConfiguration['installed']:
-                    if self.os_type in ['centos', 'redhat', 'fedora'] and self.os_initdaemon == 'systemd':
-                       self.run([service_path, 'start', applicationName], None, None, True)
-                    else:
-                       self.run([service_path, applicationName, 'start'], None, None, True)
+                    probe = None
+                    if applicationName in self.applicationPorts:
+                        probe = http_probe('http://localhost:%s/' % self.applicationPorts[applicationName])
+                    orchestrator.add(applicationName, service_starter(applicationName),
+                                     self.applicationDependencies.get(applicationName, []), probe, timeout)
+
+            timings = orchestrator.start()
+            self.logIt("Service start timings:\n%s" % "\n".join(
+                        "%-12s %-10s waited %6.1f s, started in %6.1f s" % (name, 'ready' if ok else 'NOT READY', waited, took)
+                        for name, ok, waited, took in timings))
         except:
-            self.logIt("Error starting Jetty services")
+            self.logIt("Error starting services", True)
             self.logIt(traceback.format_exc(), True)
 
     def update_hostname(self):
@@ -2497,11 +3798,24 @@ class Setup(object):
         # 1.1 convert the indexes
         self.templateRenderingDict['openldap_indexes'] = self.get_openldap_indexes()
 
+        # 1.2 size slapd for this host and the data imported, slapadd uses
+        # the bulk load profile
+        bulkLoadProfile, productionProfile = self.get_openldap_profiles(self.ldif_files)
+        self.log_openldap_profile('bulk load', bulkLoadProfile)
+        self.log_openldap_profile('production', productionProfile)
+        self.templateRenderingDict.update(self.get_openldap_profile_context(productionProfile))
+
         self.renderTemplate(self.openldapSlapdConf)
         self.renderTemplate(self.openldapSymasConf)
 
+        context = self.get_rendering_context()
+        context.update(self.get_openldap_profile_context(bulkLoadProfile))
+        slapdTemplate = self.compileTemplate(os.path.join(self.templateFolder, os.path.basename(self.openldapSlapdConf)))
+        self.writeRenderedTemplate(self.openldapBulkLoadConf, slapdTemplate % context)
+
         # 2. Copy the conf files to
         self.copyFile(self.openldapSlapdConf, self.openldapConfFolder)
+        self.copyFile(self.openldapBulkLoadConf, self.openldapConfFolder)
         self.copyFile(self.openldapSymasConf, self.openldapConfFolder)
 
         # 3. Copy the schema files into place
@@ -2532,13 +3846,117 @@ class Setup(object):
     def import_ldif_openldap(self):
         self.logIt("Importing LDIF files into OpenLDAP")
         cmd = os.path.join(self.openldapBinFolder, 'slapadd')
-        config = os.path.join(self.openldapConfFolder, 'slapd.conf')
+        config = os.path.join(self.openldapConfFolder, os.path.basename(self.openldapBulkLoadConf))
+        if os.path.exists(config):
+            self.logIt("Importing with bulk load profile %s" % config)
+            if self.openldapBulkLoadQuick:
+                cmd += ' -q'
+        else:
+            config = os.path.join(self.openldapConfFolder, 'slapd.conf')
         realInstallDir = os.path.realpath(self.install_dir)
         for ldif in self.ldif_files:
-            if 'site.ldif' in ldif:
-                self.run(['/bin/su', 'ldap', '-c', "cd " + realInstallDir + "; " + " ".join([cmd, '-b', 'o=site', '-f', config, '-l', ldif])])
-            else:
-                self.run(['/bin/su', 'ldap', '-c', "cd " + realInstallDir + "; " + " ".join([cmd, '-b', 'o=gluu', '-f', config, '-l', ldif])])
+            suffix = 'o=site' if 'site.ldif' in ldif else 'o=gluu'
+            if self.run(['/bin/su', 'ldap', '-c', "cd " + realInstallDir + "; " + " ".join([cmd, '-b', suffix, '-f', config, '-l', ldif])]) != 0:
+                self.logIt("Error importing %s into %s" % (ldif, suffix), True)
+        # bulk load profile doesn't sync databases to disk
+        self.run(['sync'])
+
+    def get_ldif_statistics(self, ldifFiles):
+        """Returns (number of entries, bytes) of LDIF files"""
+        entries = size = 0
+        for ldif in ldifFiles:
+            if not os.path.exists(ldif):
+                continue
+            size += os.path.getsize(ldif)
+            with open(ldif) as f:
+                for line in f:
+                    if line.startswith('dn:'):
+                        entries += 1
+        return entries, size
+
+    def get_free_disk_space(self, path):
+        """Returns bytes available on the file system of path or of its
+        closest existing parent, None if it can't be determined"""
+        while path and not os.path.exists(path):
+            path = os.path.dirname(path)
+        try:
+            st = os.statvfs(path or '/')
+        except OSError:
+            return None
+        return st.f_bavail * st.f_frsize
+
+    def get_openldap_profiles(self, ldifFiles):
+        """Returns (bulk load, production) slapd.conf profiles sized from cpus
+        and memory of the host, number of indices and the LDIF imported. The
+        bulk load profile is used by slapadd and doesn't sync databases to
+        disk."""
+        totalMem, _, cpus = self.get_host_resources()
+        entries, ldifBytes = self.get_ldif_statistics(ldifFiles)
+        indexCount = len([line for line in self.get_openldap_indexes().splitlines() if line.strip()])
+
+        # mdb maps the database, maxsize only limits its growth and is not
+        # allocated. Entries and their indices take a multiple of the LDIF
+        # size, tokens and sessions make the main database grow further.
+        gb = 1024 ** 3
+        minSize = int(self.openldapMinDbSizeGB) * gb
+        mainSize = max(minSize, -(-ldifBytes * int(self.openldapDbSizeFactor) // gb) * gb)
+        freeSpace = self.get_free_disk_space(self.openldapDataFolder)
+        if freeSpace:
+            mainSize = max(minSize, min(mainSize, freeSpace // gb * gb))
+
+        listenerThreads = 1
+        while listenerThreads * 16 <= cpus and listenerThreads < 16:
+            listenerThreads *= 2
+
+        # thread stacks have to fit in the memory reserved for slapd, small
+        # hosts get fewer threads but never less than one per cpu
+        threads = min(max(cpus * int(self.openldapThreadsPerCpu), int(self.openldapMinThreads)),
+                      int(self.openldapMaxThreads))
+        if totalMem:
+            slapdMem = self.get_memory_reserves(totalMem).get('slapd', totalMem // 4)
+            threads = max(min(threads, cpus), min(threads, slapdMem // int(self.openldapThreadStackMB)))
+
+        production = {'entries': entries,
+                      'ldif_bytes': ldifBytes,
+                      'threads': threads,
+                      'listener_threads': listenerThreads,
+                      'tool_threads': max(1, min(cpus, indexCount)),
+                      'main_maxsize': mainSize,
+                      'site_maxsize': minSize,
+                      'dbnosync': bool(self.openldapDbNoSync),
+                      'checkpoint': (int(self.openldapCheckpointKB), int(self.openldapCheckpointMinutes)),
+                      'sortvals': list(self.openldapSortvals)}
+        bulkLoad = dict(production, dbnosync=True, checkpoint=None)
+        return bulkLoad, production
+
+    def get_openldap_profile_context(self, profile):
+        """Returns rendering context of slapd.conf for profile"""
+        tuning = ['threads\t%d' % profile['threads'],
+                  'listener-threads\t%d' % profile['listener_threads'],
+                  'tool-threads\t%d' % profile['tool_threads']]
+        if profile['sortvals']:
+            tuning.append('sortvals\t%s' % ' '.join(profile['sortvals']))
+
+        sync = []
+        if profile['dbnosync']:
+            sync += ['# Allow to not write data to disk after each operation', 'dbnosync']
+        if profile['checkpoint']:
+            sync += ['# Write data to disk after kbytes were written or minutes passed',
+                     'checkpoint\t%d %d' % profile['checkpoint']]
+
+        return {'openldap_global_tuning': '\n'.join(tuning),
+                'openldap_db_sync': '\n'.join(sync),
+                'openldap_main_db_maxsize': profile['main_maxsize'],
+                'openldap_site_db_maxsize': profile['site_maxsize']}
+
+    def log_openldap_profile(self, name, profile):
+        self.logIt("OpenLDAP %s profile for %d entries (%d bytes of LDIF): threads %d, listener-threads %d, "
+                   "tool-threads %d, maxsize %d/%d MB, %s, checkpoint %s, sortvals %s" % (
+                   name, profile['entries'], profile['ldif_bytes'], profile['threads'], profile['listener_threads'],
+                   profile['tool_threads'], profile['main_maxsize'] / 1024 ** 2, profile['site_maxsize'] / 1024 ** 2,
+                   'dbnosync' if profile['dbnosync'] else 'sync',
+                   '%d %d' % profile['checkpoint'] if profile['checkpoint'] else 'off',
+                   ' '.join(profile['sortvals']) or 'none'))
 
     def import_custom_ldif_openldap(self, fullPath):
         output_dir = fullPath + '.output'
@@ -2569,6 +3987,62 @@ class Setup(object):
         installObject.configure_openldap()
         installObject.import_ldif_openldap()
 
+    def get_host_resources(self):
+        """Returns (total memory MB, available memory MB, cpu count) of this
+        host, memory is None when /proc/meminfo can't be read"""
+        if self.hostResources:
+            return self.hostResources
+
+        totalMem = availableMem = None
+        try:
+            meminfo = {}
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    meminfo[key] = int(value.split()[0])
+            totalMem = meminfo['MemTotal'] / 1024
+            availableMem = meminfo.get('MemAvailable', meminfo['MemTotal']) / 1024
+        except:
+            self.logIt("Can't read host memory from /proc/meminfo", True)
+            self.logIt(traceback.format_exc(), True)
+
+        try:
+            cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            cpus = 1
+
+        return totalMem, availableMem, cpus
+
+    def get_memory_reserves(self, totalMem):
+        """Returns dict of memory in MB reserved for services sharing the
+        host with the applications"""
+        reserves = {'os': max(int(self.osMemoryReserveMB), int(totalMem * 0.05))}
+        if self.installLdap:
+            # mdb maps the databases to memory, hot pages are kept in page cache
+            reserves['slapd'] = min(int(self.slapdMemoryReserveMB), int(totalMem * 0.25))
+        reserves['memcached'] = int(self.memcachedMemoryReserveMB)
+        if self.installHttpd:
+            reserves['httpd'] = int(self.httpdMemoryReserveMB)
+        return reserves
+
+    def get_gc_options(self, heapMem, cpus):
+        if cpus < 2:
+            return '-XX:+UseSerialGC'
+        gcThreads = min(cpus, 8)
+        if heapMem >= 2048:
+            return '-XX:+UseG1GC -XX:MaxGCPauseMillis=200 -XX:ParallelGCThreads=%d' % gcThreads
+        return '-XX:+UseParallelGC -XX:ParallelGCThreads=%d' % gcThreads
+
+    def get_jetty_threads(self, applicationConfiguration, heapMem, cpus):
+        """Returns (min threads, max threads) of jetty thread pool. Max threads
+        grows with cpus and is limited by the heap each request needs."""
+        weight = applicationConfiguration['memory'].get('threads_weight', 1.0)
+        maxThreads = int(cpus * int(self.jettyThreadsPerCpu) * weight)
+        maxThreads = min(maxThreads, heapMem / int(self.jettyHeapPerThreadMB), int(self.jettyMaxThreads))
+        maxThreads = max(maxThreads, int(self.jettyMinThreads) * 2)
+        minThreads = min(max(int(self.jettyMinThreads), cpus * 2), maxThreads)
+        return minThreads, maxThreads
+
     def calculate_aplications_memory(self):
         self.logIt("Calculating memory setting for applications")
 
@@ -2591,6 +4065,19 @@ class Setup(object):
         if self.installPassport:
             installedComponents.append(self.jetty_app_configuration['passport'])
 
+        # Applications get what the user allowed, but not more than the host
+        # has after reserving memory for services sharing it
+        applicationsMemory = int(self.application_max_ram)
+        totalMem, availableMem, cpus = self.get_host_resources()
+        reserves = {}
+        if totalMem:
+            reserves = self.get_memory_reserves(totalMem)
+            hostApplicationsMemory = totalMem - sum(reserves.values())
+            if hostApplicationsMemory < applicationsMemory:
+                self.logIt("Applications max ram %d MB is more than %d MB left on this host, using %d MB" % (
+                            applicationsMemory, hostApplicationsMemory, max(hostApplicationsMemory, int(self.minApplicationsMemoryMB))), True)
+                applicationsMemory = max(hostApplicationsMemory, int(self.minApplicationsMemoryMB))
+
         usedRatio = 0.001
         for installedComponent in installedComponents:
             usedRatio += installedComponent['memory']['ratio']
@@ -2599,7 +4086,7 @@ class Setup(object):
 
         for installedComponent in installedComponents:
             allowedRatio = installedComponent['memory']['ratio'] * ratioMultiplier
-            allowedMemory = int(round(allowedRatio * int(self.application_max_ram)))
+            allowedMemory = int(round(allowedRatio * applicationsMemory))
 
             if allowedMemory > installedComponent['memory']['max_allowed_mb']:
                 allowedMemory = installedComponent['memory']['max_allowed_mb']
@@ -2607,6 +4094,7 @@ class Setup(object):
             allowedApplicationsMemory[installedComponent['name']] = allowedMemory
 
         # Iterate through all components into order to prepare all keys
+        sizing = []
         for applicationName, applicationConfiguration in self.jetty_app_configuration.iteritems():
             if applicationName in allowedApplicationsMemory:
                 applicationMemory = allowedApplicationsMemory.get(applicationName)
@@ -2619,16 +4107,45 @@ class Setup(object):
             if 'jvm_heap_ration' in applicationConfiguration['memory']:
                 jvmHeapRation = applicationConfiguration['memory']['jvm_heap_ration']
 
-                minHeapMem = 256
-                maxHeapMem = int(applicationMemory * jvmHeapRation)
-                if maxHeapMem < minHeapMem:
-                    minHeapMem = maxHeapMem
+                # Metaspace holds classes, it doesn't grow with the heap
+                maxMetaMem = min(max(int(applicationMemory * (1 - jvmHeapRation)), int(self.minMetaspaceMB)), int(self.maxMetaspaceMB))
+                maxHeapMem = max(applicationMemory - maxMetaMem, 64)
+                minHeapMem = min(max(256, maxHeapMem / 4), maxHeapMem)
+                minThreads, maxThreads = self.get_jetty_threads(applicationConfiguration, maxHeapMem, cpus)
 
                 self.templateRenderingDict["%s_max_heap_mem" % applicationName] = maxHeapMem
                 self.templateRenderingDict["%s_min_heap_mem" % applicationName] = minHeapMem
+                self.templateRenderingDict["%s_max_meta_mem" % applicationName] = maxMetaMem
+                self.templateRenderingDict["%s_gc_options" % applicationName] = self.get_gc_options(maxHeapMem, cpus)
+                self.templateRenderingDict["%s_min_threads" % applicationName] = minThreads
+                self.templateRenderingDict["%s_max_threads" % applicationName] = maxThreads
+
+                if applicationName in allowedApplicationsMemory:
+                    sizing.append((applicationName, applicationMemory, maxHeapMem, maxMetaMem, minThreads, maxThreads,
+                                   self.templateRenderingDict["%s_gc_options" % applicationName].split()[0]))
+            elif applicationName in allowedApplicationsMemory:
+                sizing.append((applicationName, applicationMemory, applicationMemory, 0, 0, 0, 'node'))
+
+        self.capacity_report(totalMem, availableMem, cpus, reserves, applicationsMemory, sizing)
+
+    def capacity_report(self, totalMem, availableMem, cpus, reserves, applicationsMemory, sizing):
+        lines = ['Host: %s MB memory (%s MB available), %d cpus' % (totalMem or 'unknown', availableMem or 'unknown', cpus),
+                 'Reserved: %s' % (', '.join('%s %d MB' % item for item in sorted(reserves.items())) or 'nothing'),
+                 'Applications: %d MB' % applicationsMemory,
+                 '%-10s %8s %8s %8s %8s %8s  %s' % ('app', 'mem MB', 'heap MB', 'meta MB', 'min thr', 'max thr', 'gc')]
+        for item in sizing:
+            lines.append('%-10s %8d %8d %8d %8d %8d  %s' % item)
+
+        for applicationName, applicationMemory, heapMem, metaMem, minThreads, maxThreads, gc in sizing:
+            if applicationName == 'oxauth':
+                # Every login in flight holds a request thread and its session state
+                logins = min(maxThreads, heapMem / int(self.heapPerLoginMB))
+                lines.append('Expected max concurrent logins: %d' % logins)
+
+        report = '\n'.join(lines)
+        self.logIt("Capacity report\n%s" % report)
+        print "\nCapacity report:\n%s\n" % report
 
-                self.templateRenderingDict["%s_max_meta_mem" % applicationName] = applicationMemory - self.templateRenderingDict["%s_max_heap_mem" % applicationName]
-                
 
     def merge_dicts(self, *dict_args):
         result = {}
@@ -2673,10 +4190,15 @@ def print_help():
     print "    --allow_pre_released_applications"
     print "    --allow_deprecated_applications"
     print "    --import-ldif=custom-ldif-dir Render ldif templates from custom-ldif-dir and import them in LDAP"
+    print "    --log-json  Also write setup.log.json with one JSON log record per line"
+    print "    --profile   Record step and command timings to setup_profile.json (Chrome trace format)"
+    print "    --resume    Skip install steps completed by previous run whose inputs did not change (setup_state.json)"
+    print "    --fleet=cluster.json  Build install bundles for the cluster nodes in cluster.json and exit"
+    print "    --bundle=node.tar.gz  Install this node from its fleet bundle"
 
 def getOpts(argv, setupOptions):
     try:
-        opts, args = getopt.getopt(argv, "adp:f:hNnsuwre", ['allow_pre_released_applications', 'allow_deprecated_applications', 'import-ldif='])
+        opts, args = getopt.getopt(argv, "adp:f:hNnsuwre", ['allow_pre_released_applications', 'allow_deprecated_applications', 'import-ldif=', 'profile', 'log-json', 'resume', 'fleet=', 'bundle='])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -2727,6 +4249,18 @@ def getOpts(argv, setupOptions):
             else:
                 print 'The custom LDIF import directory %s does not exist. Exiting...' % (arg)
                 sys.exit(2)
+        elif opt == '--profile':
+            setupOptions['profile'] = True
+        elif opt == '--log-json':
+            setupOptions['logJson'] = True
+        elif opt == '--resume':
+            setupOptions['resume'] = True
+        elif opt in ('--fleet', '--bundle'):
+            if os.path.isfile(arg):
+                setupOptions[opt[2:]] = arg
+            else:
+                print 'File %s does not exist. Exiting...' % arg
+                sys.exit(2)
     return setupOptions
 
 if __name__ == '__main__':
@@ -2746,7 +4280,12 @@ if __name__ == '__main__':
         'installPassport': False,
         'allowPreReleasedApplications': False,
         'allowDeprecatedApplications': False,
-        'installJce': False
+        'installJce': False,
+        'profile': False,
+        'logJson': False,
+        'resume': False,
+        'fleet': None,
+        'bundle': None
     }
     if len(sys.argv) > 1:
         setupOptions = getOpts(sys.argv[1:], setupOptions)
@@ -2766,6 +4305,12 @@ if __name__ == '__main__':
     installObject.allowPreReleasedApplications = setupOptions['allowPreReleasedApplications']
     installObject.allowDeprecatedApplications = setupOptions['allowDeprecatedApplications']
     installObject.installJce = setupOptions['installJce']
+    installObject.logJson = setupOptions['logJson']
+    installObject.resume = setupOptions['resume']
+
+    if setupOptions['profile']:
+        installObject.profiler = SetupProfiler()
+        installObject.profiler.instrument(Setup)
 
     # Get the OS type
     installObject.os_type = installObject.detect_os_type()
@@ -2781,32 +4326,55 @@ if __name__ == '__main__':
 
     print "\nInstalling Gluu Server...\n\nFor more info see:\n  %s  \n  %s\n" % (installObject.log, installObject.logError)
     print "\n** All clear text passwords contained in %s.\n" % installObject.savedProperties
-    try:
-        os.remove(installObject.log)
-        installObject.logIt('Removed %s' % installObject.log)
-    except:
-        pass
-    try:
-        os.remove(installObject.logError)
-        installObject.logIt('Removed %s' % installObject.logError)
-    except:
-        pass
+    if not installObject.resume:
+        installObject.remove_logs()
 
     installObject.logIt("Installing Gluu Server", True)
 
+    if setupOptions['bundle']:
+        installObject.apply_bundle(setupOptions['bundle'])
+
+    restoredProperties = False
+    if installObject.resume and installObject.load_setup_state():
+        print "Resuming installation, completed steps with unchanged inputs are skipped\n"
+        restoredProperties = installObject.restore_initial_state()
+
     if setupOptions['setup_properties']:
         installObject.logIt('%s Properties found!\n' % setupOptions['setup_properties'])
         installObject.load_properties(setupOptions['setup_properties'])
     elif os.path.isfile(installObject.setup_properties_fn):
         installObject.logIt('%s Properties found!\n' % installObject.setup_properties_fn)
         installObject.load_properties(installObject.setup_properties_fn)
-    else:
+    elif not restoredProperties:
         installObject.logIt("%s Properties not found. Interactive setup commencing..." % installObject.setup_properties_fn)
         installObject.promptForProperties()
 
+    fleetSpec = None
+    if setupOptions['fleet']:
+        try:
+            fleetSpec = installObject.load_cluster_spec(setupOptions['fleet'])
+        except ValueError, e:
+            print "%s. Exiting..." % e
+            sys.exit(2)
+        if not installObject.ip:
+            installObject.ip = fleetSpec['nodes'][0].get('ip')
+
     # Validate Properties
     installObject.check_properties()
 
+    if fleetSpec:
+        try:
+            bundles = installObject.build_fleet(fleetSpec)
+        except:
+            installObject.logIt("Error building fleet bundles", True)
+            installObject.logIt(traceback.format_exc(), True)
+            print "\nBuilding fleet bundles failed, see %s\n" % installObject.logError
+            sys.exit(1)
+        installObject.stop_keygen_daemon()
+        installObject.write_profile()
+        print "\nFleet bundles, install each node with setup.py -n --bundle=<bundle>:\n  %s\n" % "\n  ".join(bundles)
+        sys.exit(0)
+
 ### Ganesh Working Here...
     if 'importLDIFDir' in setupOptions.keys():
         if os.path.isdir(installObject.openldapBaseFolder):
@@ -2822,47 +4390,73 @@ if __name__ == '__main__':
     if not setupOptions['noPrompt']:
         proceed = raw_input('Proceed with these values [Y|n] ').lower().strip()
     if (setupOptions['noPrompt'] or not len(proceed) or (len(proceed) and (proceed[0] == 'y'))):
-        try:
-            installObject.configureSystem()
-            installObject.downloadWarFiles()
-            installObject.calculate_aplications_memory()
-            installObject.installJRE()
-            installObject.installJetty()
-            installObject.installJython()
-            installObject.installNode()
-            installObject.make_salt()
-            installObject.make_oxauth_salt()
-            installObject.copy_scripts()
-            installObject.install_gluu_base()
-            installObject.encode_passwords()
-            installObject.encode_test_passwords()
-            installObject.prepare_base64_extension_scripts()
-            installObject.render_templates()
-            installObject.generate_crypto()
-            installObject.generate_oxauth_openid_keys()
-            installObject.generate_base64_configuration()
-            installObject.render_configuration_template()
-            installObject.update_hostname()
-            installObject.set_ulimits()
-            installObject.copy_output()
-            installObject.setup_init_scripts()
-            installObject.render_jetty_templates()
-            installObject.render_node_templates()
-            installObject.install_gluu_components()
-            installObject.render_test_templates()
-            installObject.copy_static()
-            installObject.set_ownership()
-            installObject.set_permissions()
-            installObject.start_services()
-            installObject.change_rc_links()
-            installObject.save_properties()
-            if 'importLDIFDir' in setupOptions.keys():
+        installObject.save_initial_state()
+
+        # Install steps with files whose changes make --resume run them again
+        steps = [(installObject.configureSystem, []),
+                 (installObject.downloadWarFiles, []),
+                 (installObject.calculate_aplications_memory, []),
+                 (installObject.installJRE, [installObject.distAppFolder]),
+                 (installObject.installJetty, [installObject.distAppFolder]),
+                 (installObject.installJython, [installObject.distAppFolder]),
+                 (installObject.installNode, [installObject.distAppFolder]),
+                 (installObject.make_salt, []),
+                 (installObject.make_oxauth_salt, []),
+                 (installObject.copy_scripts, [installObject.templateFolder]),
+                 (installObject.install_gluu_base, [installObject.distGluuFolder, installObject.templateFolder]),
+                 (installObject.encode_passwords, []),
+                 (installObject.encode_test_passwords, []),
+                 (installObject.prepare_base64_extension_scripts, []),
+                 (installObject.render_templates, [installObject.templateFolder]),
+                 (installObject.generate_crypto, []),
+                 (installObject.trust_generated_certs, []),
+                 (installObject.generate_oxauth_openid_keys, []),
+                 (installObject.generate_base64_configuration, []),
+                 (installObject.render_configuration_template, [installObject.templateFolder]),
+                 (installObject.update_hostname, []),
+                 (installObject.set_ulimits, []),
+                 # later steps render more files into outputFolder
+                 (installObject.copy_output, [fn for fn, dest_fn in installObject.get_output_pairs()]),
+                 (installObject.setup_init_scripts, []),
+                 (installObject.render_service_templates, [installObject.templateFolder]),
+                 (installObject.install_gluu_components, [installObject.distGluuFolder, installObject.templateFolder]),
+                 (installObject.render_test_templates, [installObject.templateFolder]),
+                 (installObject.copy_static, []),
+                 (installObject.set_ownership, []),
+                 (installObject.set_permissions, []),
+                 (installObject.start_services, []),
+                 (installObject.change_rc_links, []),
+                 (installObject.save_properties, [])]
+
+        failedStep = None
+        for step, inputs in steps:
+            try:
+                installObject.run_step(step, inputs)
+            except:
+                failedStep = step.__name__
+                installObject.logIt("***** Error caught in main loop, step %s *****" % failedStep, True)
+                installObject.logIt(traceback.format_exc(), True)
+                break
+            # steps which logged errors are recorded as failed by run_step
+            if installObject.setupState['steps'][step.__name__]['status'] == 'failed':
+                failedStep = step.__name__
+                break
+
+        if not failedStep and 'importLDIFDir' in setupOptions.keys():
+            try:
                 installObject.render_custom_templates(setupOptions['importLDIFDir'])
                 installObject.import_custom_ldif_openldap(setupOptions['importLDIFDir'])
-
-        except:
-            installObject.logIt("***** Error caught in main loop *****", True)
-            installObject.logIt(traceback.format_exc(), True)
+            except:
+                failedStep = 'import_custom_ldif_openldap'
+                installObject.logIt("***** Error caught in main loop *****", True)
+                installObject.logIt(traceback.format_exc(), True)
+
+        installObject.stop_keygen_daemon()
+        installObject.write_profile()
+        if failedStep:
+            print "\n\n Gluu Server installation failed in step %s, see %s" % (failedStep, installObject.logError)
+            print " Fix the problem and run setup.py --resume to continue the installation\n\n"
+            sys.exit(1)
         print "\n\n Gluu Server installation successful! Point your browser to https://%s\n\n" % installObject.hostname
     else:
         installObject.save_properties()
@@ -23,76 +23,49 @@
 # This program is used to generate the documentation for the Gluu Server schema found on
 # http://www.gluu.org/docs/reference/ldap/schema
 
+import os
 import sys
-import string
-from ldif import LDIFParser, LDIFWriter
+import argparse
 
-class SchemaParser(LDIFParser):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'schema'))
 
-    def __init__(self, input):
-        LDIFParser.__init__(self, input)
-        self.objectclasses = {}
-        self.attributes = {}
+from model import SchemaModel, RENDERERS
 
-    def __repr__(self):
-        s = ''
-        oc_list = self.objectclasses.keys()
-        oc_list.sort()
-        for name in oc_list:
-            desc = self.objectclasses[name][0]
-            attrs = self.objectclasses[name][1]
-            s = s + "### Objectclass %s\n" % name
-            s  = s + " * __Description__ %s\n" % desc
-            for attr in attrs:
-                attrDesc = ''
-                if self.attributes.has_key(attr):
-                    attrDesc = self.attributes[attr]
-                s = s + " * __%s__ %s\n" % (attr, attrDesc)
-            s = s + "\n"
-        return s
 
-    def handle(self, dn, entry):
-        attributeTypes = entry['attributeTypes']
-        objectclasses = entry['objectclasses']
+def render_schema_page(docs):
+    """Returns markdown in the layout of the published schema page, a
+    section per object class with its MAY attributes"""
+    s = u''
+    for obc in docs:
+        s += u"### Objectclass %s\n" % obc['names'][0]
+        s += u" * __Description__ %s\n" % (obc['desc'] or u'')
+        for attr in obc['attributes']:
+            s += u" * __%s__ %s\n" % (attr['name'], attr['desc'] or u'')
+        s += u"\n"
+    return s
 
-        for attr in attributeTypes:
-            desc = self.getDESC(attr)
-            name_list = self.getName(attr)
-            for name in name_list:
-                self.attributes[name] = desc
+# markdown keeps the published layout, the other formats come from the model
+SCRIPT_RENDERERS = dict(RENDERERS, markdown=render_schema_page)
 
-        for oc in objectclasses:
-            name = self.getName(oc)[0]  # Assumes OC has one name
-            desc = self.getDESC(oc)
-            if not desc:
-                desc = ''
-            mays = self.getMays(oc)
-            self.objectclasses[name] = (desc, mays)
 
-    def getMays(self, oc):
-        mays = oc.split('MAY')[1].split('(')[1].split(')')[0].split('$')
-        return map(string.strip, mays)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates the documentation of the Gluu Server schema")
+    parser.add_argument('schema', nargs='*', default=['./static/opendj/deprecated/101-ox.ldif'],
+                        help="LDIF, .schema or JSON schema files")
+    parser.add_argument('-f', '--format', default='markdown', choices=sorted(SCRIPT_RENDERERS))
+    parser.add_argument('-o', '--output', help="file the documentation is written to, default stdout")
+    args = parser.parse_args(argv)
 
-    def getDESC(self, s):
-        desc = None
-        try:
-            desc = s.split('DESC')[1].split("'")[1]
-        except:
-            pass
-        return desc
+    schema = SchemaModel.from_files(args.schema)
+    # documented by object class name, like the published schema page
+    docs = sorted([obc for obc in schema.docs() if obc['names']], key=lambda obc: obc['names'][0])
+    text = SCRIPT_RENDERERS[args.format](docs).encode('utf-8')
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print text
 
-    def getName(self,s):
-        name_list = None
-        try:
-            name_string = s.split('NAME')[1].split("'")[1].strip()
-            name_list = name_string.split(" ")
-        except:
-            pass
-        return name_list
 
 if __name__ == '__main__':
-    input_ldif = './static/opendj/101-ox.ldif'
-    output_md = "./ldap-schema-table.md"
-    parser = SchemaParser(open(input_ldif, 'rb'))
-    parser.parse()
-    print parser
+    main()
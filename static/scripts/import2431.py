@@ -26,6 +26,25 @@ from distutils.dir_util import copy_tree
 from ldif import LDIFParser, LDIFWriter
 from jsonmerge import merge
 
+# TreeSync.py from the setup folder skips unchanged files and copies in
+# parallel, distutils copy_tree is used when it's not available
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+try:
+    from TreeSync import TreeSync
+except ImportError:
+    TreeSync = None
+
+try:
+    from PermissionPlan import PermissionPlan
+except ImportError:
+    PermissionPlan = None
+
+try:
+    from ldif_validator import LDIFValidator, schema_files
+except ImportError:
+    LDIFValidator = None
+
 # configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)-8s %(name)s %(message)s',
@@ -85,6 +104,7 @@ class Migration(object):
             self.service = "/sbin/service"
 
         self.slapdConf = "/opt/symas/etc/openldap/slapd.conf"
+        self.slapdBulkLoadConf = "/opt/symas/etc/openldap/slapd-bulkload.conf"
         self.slapcat = "/opt/symas/bin/slapcat"
         self.slapadd = "/opt/symas/bin/slapadd"
         self.keytool = "/opt/jre/bin/keytool"
@@ -234,6 +254,20 @@ class Migration(object):
             logging.error(start_msg)
             sys.exit(1)
 
+    def copyTrees(self, folder_map):
+        if not TreeSync:
+            for pair in folder_map:
+                copy_tree(pair[0], pair[1])
+            return
+
+        syncer = TreeSync()
+        for pair in folder_map:
+            stats = syncer.syncTree(pair[0], pair[1])
+            logging.debug("Copied %s to %s: %d files (%d bytes) copied, "
+                          "%d files (%d bytes) unchanged", pair[0], pair[1],
+                          stats['files_copied'], stats['bytes_copied'],
+                          stats['files_skipped'], stats['bytes_skipped'])
+
     def copyCustomFiles(self):
         logging.info("Copying the custom pages and assets of webapps.")
         folder_map = [(os.path.join(self.backupDir, 'opt'), '/opt')]
@@ -249,8 +283,7 @@ class Migration(object):
                 (custom+'oxtrust/libs', self.jettyDir+'identity/lib/ext'),
             ]
 
-        for pair in folder_map:
-            copy_tree(pair[0], pair[1])
+        self.copyTrees(folder_map)
 
     def stopWebapps(self):
         logging.info("Stopping Webapps oxAuth and Identity.")
@@ -504,6 +537,23 @@ class Migration(object):
                         line = self.convertTimeStamp(line)
                     outfile.write(line)
 
+    def validateData(self, ldifFiles):
+        """Writes the entries slapadd would reject because of the schema to
+        .rejects files next to the LDIF files"""
+        if not LDIFValidator:
+            return
+        try:
+            validator = LDIFValidator(schema_files(self.slapdConf))
+            for ldifFn in ldifFiles:
+                stats = validator.validate(ldifFn)
+                if stats['rejected']:
+                    logging.warning("%d of %d entries of %s violate the schema and "
+                                    "won't be imported, see %s", stats['rejected'],
+                                    stats['entries'], ldifFn, stats['rejects'])
+        except:
+            logging.warning("Could not validate the LDIF files against the schema")
+            logging.debug(traceback.format_exc())
+
     def importDataIntoOpenldap(self):
         count = len(os.listdir('/opt/gluu/data/main_db/')) - 1
         backupfile = self.ldapDataFile + ".bkp_{0:02d}".format(count)
@@ -521,12 +571,21 @@ class Migration(object):
         except IOError:
             logging.debug(traceback.format_exc())
 
+        self.validateData([self.o_gluu, self.o_site])
+
+        # setup.py installs a bulk load profile which doesn't sync databases
+        # to disk while importing
+        slapdConf = self.slapdConf
+        if os.path.exists(self.slapdBulkLoadConf):
+            slapdConf = self.slapdBulkLoadConf
         output = self.getOutput([self.slapadd, '-c', '-b', 'o=gluu', '-f',
-                                self.slapdConf, '-l', self.o_gluu])
+                                slapdConf, '-l', self.o_gluu])
         logging.debug(output)
         output = self.getOutput([self.slapadd, '-c', '-b', 'o=site', '-f',
-                                self.slapdConf, '-l', self.o_site])
+                                slapdConf, '-l', self.o_site])
         logging.debug(output)
+        if slapdConf == self.slapdBulkLoadConf:
+            self.getOutput(['sync'])
 
     def importDataIntoOpenDJ(self):
         command = [self.ldif_import, '-n', 'userRoot',
@@ -609,19 +668,28 @@ class Migration(object):
         idp_dir = os.path.join(self.backupDir, 'opt', 'idp')
         if os.path.isdir(idp_dir):
             logging.info('Copying Shibboleth IDP files...')
+            folder_map = []
             if os.path.isdir(os.path.join(idp_dir, 'metadata')):
-                copy_tree(
+                folder_map.append((
                     os.path.join(self.backupDir, 'opt', 'idp', 'metadata'),
-                    '/opt/shibboleth-idp/metadata')
+                    '/opt/shibboleth-idp/metadata'))
             if os.path.isdir(os.path.join(idp_dir, 'ssl')):
-                copy_tree(
+                folder_map.append((
                     os.path.join(self.backupDir, 'opt', 'idp', 'ssl'),
-                    '/opt/shibboleth-idp/ssl')
+                    '/opt/shibboleth-idp/ssl'))
+            self.copyTrees(folder_map)
 
     def fixPermissions(self):
         logging.info('Fixing permissions for files.')
-        self.getOutput(['chown', 'ldap:ldap', self.ldapDataFile])
-        self.getOutput(['chown', 'ldap:ldap', self.ldapSiteFile])
+        if not PermissionPlan:
+            self.getOutput(['chown', 'ldap:ldap', self.ldapDataFile])
+            self.getOutput(['chown', 'ldap:ldap', self.ldapSiteFile])
+            return
+
+        plan = PermissionPlan(logIt=lambda msg, errorLog=False: logging.error(msg) if errorLog else logging.debug(msg))
+        plan.add(self.ldapDataFile, owner='ldap:ldap')
+        plan.add(self.ldapSiteFile, owner='ldap:ldap')
+        plan.apply()
 
     def getProp(self, prop):
         with open(os.path.join(self.backupDir, 'setup.properties'), 'r') as f:
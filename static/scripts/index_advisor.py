@@ -0,0 +1,592 @@
+#!/usr/bin/python
+"""Proposes OpenLDAP indexes for the searches an installation really runs.
+
+Search filters are read from the cn=accesslog database (an LDIF written by
+slapcat -b cn=accesslog; searches are logged only when logops in
+accesslog.conf includes reads or search) and/or from a slapd log written
+with loglevel stats. Attribute cardinality is computed from an LDIF dump of
+the data (slapcat -b o=gluu).
+
+Every search is costed as the number of entries slapd has to examine with
+the current indexes. Indexes are then added greedily, the one saving most
+examined entries, less the index keys it makes every write update, first.
+
+Usage: python index_advisor.py -l o_gluu.ldif -a accesslog.ldif -s slapd.log
+                               -i static/openldap/index.json -o index.json
+"""
+
+import re
+import sys
+import json
+import base64
+import argparse
+import collections
+
+# share of entries having an attribute which a substring assertion matches
+SUBSTRING_SELECTIVITY = 0.05
+
+# share of entries having an attribute which an inequality matches
+ORDERING_SELECTIVITY = 0.5
+
+# attributes whose value counts are kept, so equality on them is costed exactly
+EXACT_COUNT_ATTRIBUTES = ['objectclass']
+
+SCOPES = {'0': 'base', '1': 'one', '2': 'sub', '3': 'subord',
+          'base': 'base', 'one': 'one', 'sub': 'sub', 'subord': 'subord', 'children': 'subord'}
+
+INDEX_ORDER = ['eq', 'pres', 'approx', 'sub', 'subinitial', 'subany', 'subfinal']
+
+stats_search_re = re.compile(r'SRCH base="(?P<base>[^"]*)" scope=(?P<scope>\d) deref=\d+ filter="(?P<filter>.*)"$')
+stats_mod_re = re.compile(r'\bMOD attr=(?P<attrs>.*)$')
+not_indexed_re = re.compile(r'_candidates: \((?P<attr>[^)]+)\) not indexed')
+hex_escape_re = re.compile(r'\\([0-9a-fA-F]{2})')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def unescape(value):
+    return hex_escape_re.sub(lambda m: chr(int(m.group(1), 16)), value)
+
+
+def parse_filter(text):
+    """Parses RFC 4515 search filter to a tree of ('and', [...]),
+    ('or', [...]), ('not', tree) and ('item', attribute, match, value) tuples.
+    match is one of eq, approx, ge, le, pres, subinitial, subfinal, subany and
+    ext."""
+    text = text.strip()
+    if not text.startswith('('):
+        text = '(%s)' % text
+    tree, pos = _parse(text, 0)
+    if pos != len(text):
+        raise FilterError("Unexpected text after filter: %s" % text[pos:])
+    return tree
+
+
+def _parse(text, pos):
+    if pos >= len(text) or text[pos] != '(':
+        raise FilterError("Expected ( at %d in %s" % (pos, text))
+    pos += 1
+    if pos >= len(text):
+        raise FilterError("Unterminated filter %s" % text)
+
+    if text[pos] in '&|':
+        kind = 'and' if text[pos] == '&' else 'or'
+        pos += 1
+        children = []
+        while pos < len(text) and text[pos] == '(':
+            child, pos = _parse(text, pos)
+            children.append(child)
+        tree = (kind, children)
+    elif text[pos] == '!':
+        child, pos = _parse(text, pos + 1)
+        tree = ('not', child)
+    else:
+        end = pos
+        depth = 0
+        while end < len(text) and (text[end] != ')' or depth):
+            if text[end] == '(':
+                depth += 1
+            elif text[end] == ')':
+                depth -= 1
+            end += 1
+        tree = _parse_item(text[pos:end])
+        pos = end
+
+    if pos >= len(text) or text[pos] != ')':
+        raise FilterError("Expected ) at %d in %s" % (pos, text))
+    return tree, pos + 1
+
+
+def _parse_item(item):
+    eq = item.find('=')
+    if eq < 1:
+        raise FilterError("Invalid filter item %s" % item)
+    op = item[eq - 1]
+    attribute = item[:eq - 1] if op in '~<>:' else item[:eq]
+    value = item[eq + 1:]
+    attribute = attribute.split(';')[0].strip()
+
+    if op == ':':
+        return ('item', attribute.split(':')[0], 'ext', unescape(value))
+    if op == '~':
+        return ('item', attribute, 'approx', unescape(value))
+    if op == '>':
+        return ('item', attribute, 'ge', unescape(value))
+    if op == '<':
+        return ('item', attribute, 'le', unescape(value))
+    if value == '*':
+        return ('item', attribute, 'pres', None)
+    if '*' in value:
+        parts = value.split('*')
+        if parts[0]:
+            match = 'subinitial'
+        elif parts[-1]:
+            match = 'subfinal'
+        else:
+            match = 'subany'
+        return ('item', attribute, match, unescape(''.join(parts)))
+    return ('item', attribute, 'eq', unescape(value))
+
+
+def filter_items(tree):
+    if tree[0] == 'item':
+        yield tree
+    elif tree[0] == 'not':
+        for item in filter_items(tree[1]):
+            yield item
+    else:
+        for child in tree[1]:
+            for item in filter_items(child):
+                yield item
+
+
+def filter_shape(tree):
+    """Returns filter text with assertion values masked, except for the
+    attributes which are costed per value"""
+    if tree[0] == 'item':
+        attribute, match, value = tree[1].lower(), tree[2], tree[3]
+        if attribute not in EXACT_COUNT_ATTRIBUTES or match != 'eq':
+            value = '?'
+        return '(%s %s %s)' % (attribute, match, value and value.lower())
+    if tree[0] == 'not':
+        return '(!%s)' % filter_shape(tree[1])
+    return '(%s%s)' % ('&' if tree[0] == 'and' else '|', ''.join(sorted(filter_shape(child) for child in tree[1])))
+
+
+def index_for(match):
+    """Returns OpenLDAP index type which serves match, None if there is none"""
+    if match in ('ge', 'le'):
+        return 'eq'
+    if match == 'ext':
+        return None
+    return match
+
+
+def read_ldif(lines):
+    """Yields (dn, [(attribute, value), ...]) for entries of LDIF lines,
+    without keeping more than one entry in memory"""
+    dn = None
+    attrs = []
+    current = None
+
+    def flush(current):
+        if current:
+            attribute, _, value = current.partition(':')
+            if value.startswith(':'):
+                try:
+                    value = base64.b64decode(value[1:].strip())
+                except TypeError:
+                    value = value[1:].strip()
+            elif value.startswith('<'):
+                value = value[1:].strip()
+            else:
+                value = value.lstrip(' ')
+            return attribute.split(';')[0], value
+        return None
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith(' '):
+            if current is not None:
+                current += line[1:]
+            continue
+        pair = flush(current)
+        current = None
+        if pair:
+            if pair[0].lower() == 'dn':
+                dn = pair[1]
+            elif dn is not None:
+                attrs.append(pair)
+        if not line.strip():
+            if dn is not None:
+                yield dn, attrs
+            dn = None
+            attrs = []
+        elif not line.startswith('#') and not line.startswith('version:'):
+            current = line
+
+    pair = flush(current)
+    if pair:
+        if pair[0].lower() == 'dn':
+            dn = pair[1]
+        elif dn is not None:
+            attrs.append(pair)
+    if dn is not None:
+        yield dn, attrs
+
+
+def normalize_dn(dn):
+    return ','.join(rdn.strip() for rdn in dn.lower().split(','))
+
+
+class AttributeStats(object):
+
+    def __init__(self):
+        self.present = 0
+        self.hashes = set()
+        self.length = 0
+        self.values = None
+
+    @property
+    def distinct(self):
+        return len(self.hashes)
+
+    @property
+    def averageLength(self):
+        return float(self.length) / self.present if self.present else 0.0
+
+
+class DirectoryStats(object):
+    """ Entry, attribute and value counts of an LDIF dump """
+
+    def __init__(self):
+        self.entries = 0
+        self.attributes = collections.defaultdict(AttributeStats)
+        self.subtrees = collections.Counter()
+
+    def addEntry(self, dn, attrs):
+        self.entries += 1
+        rdns = normalize_dn(dn).split(',')
+        for i in range(1, len(rdns)):
+            self.subtrees[','.join(rdns[i:])] += 1
+
+        seen = set()
+        for attribute, value in attrs:
+            name = attribute.lower()
+            stats = self.attributes[name]
+            if name not in seen:
+                seen.add(name)
+                stats.present += 1
+            stats.hashes.add(hash(value.lower()))
+            stats.length += len(value)
+            if name in EXACT_COUNT_ATTRIBUTES:
+                if stats.values is None:
+                    stats.values = collections.Counter()
+                stats.values[value.lower()] += 1
+
+    def readLdif(self, lines):
+        for dn, attrs in read_ldif(lines):
+            self.addEntry(dn, attrs)
+        return self
+
+    def scopeSize(self, base, scope):
+        """Returns number of entries a search of base and scope examines
+        without indexes"""
+        if scope == 'base':
+            return 1
+        if not base:
+            return self.entries
+        return self.subtrees.get(normalize_dn(base), self.entries if scope == 'sub' else 0)
+
+
+class Workload(object):
+    """ Search shapes and attribute writes seen in the logs """
+
+    def __init__(self):
+        self.searches = collections.Counter()
+        self.trees = {}
+        self.writes = collections.Counter()
+        self.notIndexed = collections.Counter()
+        self.names = {}
+        self.errors = 0
+
+    def addName(self, attribute):
+        self.names.setdefault(attribute.lower(), attribute)
+
+    def addSearch(self, filterText, base='', scope='sub', count=1):
+        try:
+            tree = parse_filter(filterText)
+        except FilterError:
+            self.errors += count
+            return
+        scope = SCOPES.get(str(scope).lower(), 'sub')
+        base = normalize_dn(base) if scope != 'base' else ''
+        key = (filter_shape(tree), base, scope)
+        self.searches[key] += count
+        if key not in self.trees:
+            self.trees[key] = tree
+            for item in filter_items(tree):
+                self.addName(item[1])
+
+    def addWrite(self, attribute, count=1):
+        self.addName(attribute)
+        self.writes[attribute.lower()] += count
+
+    def readAccessLog(self, lines):
+        """Reads cn=accesslog entries written by slapcat"""
+        for dn, attrs in read_ldif(lines):
+            entry = collections.defaultdict(list)
+            for attribute, value in attrs:
+                entry[attribute.lower()].append(value)
+            reqType = (entry.get('reqtype') or [''])[0].lower()
+            if reqType == 'search' and entry.get('reqfilter'):
+                self.addSearch(entry['reqfilter'][0], (entry.get('reqdn') or [''])[0],
+                               (entry.get('reqscope') or ['sub'])[0])
+            elif reqType in ('add', 'modify'):
+                for mod in entry.get('reqmod', []):
+                    attribute = mod.split(':', 1)[0].strip()
+                    if attribute:
+                        self.addWrite(attribute)
+        return self
+
+    def readStatsLog(self, lines):
+        """Reads slapd log written with loglevel stats"""
+        for line in lines:
+            line = line.rstrip('\r\n')
+            match = stats_search_re.search(line)
+            if match:
+                self.addSearch(match.group('filter'), match.group('base'), match.group('scope'))
+                continue
+            match = stats_mod_re.search(line)
+            if match:
+                for attribute in match.group('attrs').split():
+                    self.addWrite(attribute)
+                continue
+            match = not_indexed_re.search(line)
+            if match:
+                self.addName(match.group('attr'))
+                self.notIndexed[match.group('attr').lower()] += 1
+        return self
+
+
+def load_indexes(doc):
+    """Returns dict of lower case attribute name to set of index types of
+    index.json document"""
+    indexes = collections.defaultdict(set)
+    for entry in doc.get('indexes', []):
+        indexes[entry['attribute'].lower()].update(t.strip() for t in entry['index'].split(',') if t.strip())
+    return indexes
+
+
+def covers(types, index):
+    if index in types:
+        return True
+    return index in ('subinitial', 'subany', 'subfinal') and 'sub' in types
+
+
+def merge_index_types(types):
+    types = set(types)
+    if set(['subinitial', 'subany', 'subfinal']) <= types or 'sub' in types:
+        types -= set(['subinitial', 'subany', 'subfinal'])
+        types.add('sub')
+    return ','.join(sorted(types, key=lambda t: INDEX_ORDER.index(t) if t in INDEX_ORDER else len(INDEX_ORDER)))
+
+
+class IndexAdvisor(object):
+    """ Costs the workload against indexes and proposes new ones """
+
+    def __init__(self, workload, stats, indexes, writePenalty=10.0):
+        self.workload = workload
+        self.stats = stats
+        self.indexes = indexes
+        self.writePenalty = writePenalty
+
+    def estimate(self, tree, indexes, scopeSize):
+        """Returns estimated number of entries examined for filter tree, None
+        when the filter can't be narrowed with indexes"""
+        kind = tree[0]
+        if kind == 'item':
+            attribute, match, value = tree[1].lower(), tree[2], tree[3]
+            index = index_for(match)
+            if not index or not covers(indexes.get(attribute, ()), index):
+                return None
+            stats = self.stats.attributes.get(attribute) or AttributeStats()
+            if match == 'eq' and stats.values is not None:
+                count = stats.values.get((value or '').lower(), 0)
+            elif match in ('eq', 'approx'):
+                count = float(stats.present) / stats.distinct if stats.distinct else 0
+            elif match == 'pres':
+                count = stats.present
+            elif match in ('ge', 'le'):
+                count = stats.present * ORDERING_SELECTIVITY
+            else:
+                count = stats.present * SUBSTRING_SELECTIVITY
+            return min(count, scopeSize)
+        if kind == 'not':
+            return None
+        estimates = [self.estimate(child, indexes, scopeSize) for child in tree[1]]
+        if kind == 'and':
+            narrowed = [estimate for estimate in estimates if estimate is not None]
+            return min(narrowed) if narrowed else None
+        if None in estimates:
+            return None
+        return min(sum(estimates), scopeSize)
+
+    def searchCost(self, key, indexes):
+        filterShape, base, scope = key
+        scopeSize = self.stats.scopeSize(base, scope)
+        estimate = self.estimate(self.workload.trees[key], indexes, scopeSize)
+        return scopeSize if estimate is None else max(estimate, 1)
+
+    def totalCost(self, indexes):
+        return sum(count * self.searchCost(key, indexes) for key, count in self.workload.searches.iteritems())
+
+    def keysPerValue(self, attribute, index):
+        """Returns index keys written for one value of attribute"""
+        if index in ('subany', 'sub'):
+            # index_substr_any_len 4 and index_substr_any_step 2 are the defaults
+            anyKeys = max(1, int(self.stats.attributes[attribute].averageLength - 4) / 2 + 1)
+            return anyKeys + 2 if index == 'sub' else anyKeys
+        return 1
+
+    def candidates(self, indexes):
+        candidates = collections.defaultdict(list)
+        for key, tree in self.workload.trees.iteritems():
+            for item in filter_items(tree):
+                index = index_for(item[2])
+                attribute = item[1].lower()
+                if index and not covers(indexes.get(attribute, ()), index):
+                    if key not in candidates[(attribute, index)]:
+                        candidates[(attribute, index)].append(key)
+        return candidates
+
+    def advise(self, minSaving=0.01):
+        """Returns list of dicts describing proposed indexes in the order they
+        were picked. An index is proposed when it saves at least minSaving of
+        the total workload cost and more than its write cost."""
+        indexes = collections.defaultdict(set)
+        for attribute, types in self.indexes.iteritems():
+            indexes[attribute] = set(types)
+
+        costs = dict((key, self.searchCost(key, indexes)) for key in self.workload.searches)
+        startCost = sum(count * costs[key] for key, count in self.workload.searches.iteritems())
+        recommendations = []
+
+        while True:
+            best = None
+            for (attribute, index), keys in self.candidates(indexes).iteritems():
+                trial = collections.defaultdict(set, indexes)
+                trial[attribute] = indexes[attribute] | set([index])
+                saved = 0
+                for key in keys:
+                    saved += self.workload.searches[key] * (costs[key] - self.searchCost(key, trial))
+                writeKeys = self.workload.writes[attribute] * self.keysPerValue(attribute, index)
+                score = saved - self.writePenalty * writeKeys
+                if saved > 0 and saved >= minSaving * startCost and score > 0 and (not best or score > best['score']):
+                    best = {'attribute': attribute, 'index': index, 'score': score, 'saved': saved,
+                            'searches': sum(self.workload.searches[key] for key in keys),
+                            'write_keys': writeKeys,
+                            'stored_keys': self.stats.attributes[attribute].present * self.keysPerValue(attribute, index)}
+            if not best:
+                break
+
+            indexes[best['attribute']] = indexes[best['attribute']] | set([best['index']])
+            costs = dict((key, self.searchCost(key, indexes)) for key in self.workload.searches)
+            best['name'] = self.workload.names.get(best['attribute'], best['attribute'])
+            recommendations.append(best)
+
+        return recommendations
+
+    def unused(self):
+        """Returns attributes indexed in index.json which no logged search uses"""
+        used = set(item[1].lower() for tree in self.workload.trees.itervalues() for item in filter_items(tree))
+        return sorted(attribute for attribute in self.indexes if attribute not in used and attribute != 'objectclass')
+
+
+def updated_index_doc(doc, recommendations, prune=()):
+    """Returns copy of index.json document with recommendations merged and
+    attributes in prune removed"""
+    doc = dict(doc)
+    entries = []
+    positions = {}
+    for entry in doc.get('indexes', []):
+        if entry['attribute'].lower() in prune:
+            continue
+        positions[entry['attribute'].lower()] = len(entries)
+        entries.append(dict(entry))
+
+    for recommendation in recommendations:
+        attribute = recommendation['attribute']
+        if attribute in positions:
+            entry = entries[positions[attribute]]
+            entry['index'] = merge_index_types(entry['index'].split(',') + [recommendation['index']])
+        else:
+            positions[attribute] = len(entries)
+            entries.append({'attribute': recommendation['name'], 'index': recommendation['index']})
+
+    doc['indexes'] = entries
+    return doc
+
+
+def report(advisor, recommendations, out=sys.stdout):
+    workload = advisor.workload
+    total = sum(workload.searches.values())
+    out.write("Searches: %d in %d shapes, %d unparsable filters\n" % (total, len(workload.searches), workload.errors))
+    out.write("Entries in LDIF: %d\n" % advisor.stats.entries)
+    out.write("Entries examined with current indexes: %d\n" % advisor.totalCost(advisor.indexes))
+
+    if workload.notIndexed:
+        out.write("\nslapd reported not indexed:\n")
+        for attribute, count in workload.notIndexed.most_common():
+            out.write("  %-30s %d\n" % (workload.names.get(attribute, attribute), count))
+
+    out.write("\nProposed indexes:\n")
+    if not recommendations:
+        out.write("  none\n")
+    for recommendation in recommendations:
+        out.write("  %-30s %-10s searches %d, entries examined saved %d, keys written %d, keys stored %d\n" % (
+                  recommendation['name'], recommendation['index'], recommendation['searches'],
+                  recommendation['saved'], recommendation['write_keys'], recommendation['stored_keys']))
+
+    unused = advisor.unused()
+    if unused:
+        out.write("\nIndexed attributes no logged search uses:\n  %s\n" % ', '.join(
+                  workload.names.get(attribute, attribute) for attribute in unused))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Proposes OpenLDAP indexes for the logged search workload")
+    parser.add_argument('-l', '--ldif', action='append', default=[], required=True,
+                        help="LDIF dump of the data, used for attribute cardinality")
+    parser.add_argument('-a', '--accesslog', action='append', default=[],
+                        help="LDIF of the cn=accesslog database")
+    parser.add_argument('-s', '--stats-log', action='append', default=[],
+                        help="slapd log written with loglevel stats")
+    parser.add_argument('-i', '--index', default='/install/community-edition-setup/static/openldap/index.json',
+                        help="current index.json")
+    parser.add_argument('-o', '--output', help="file to write updated index.json to")
+    parser.add_argument('--min-saving', type=float, default=0.01,
+                        help="share of examined entries an index has to save, default 0.01")
+    parser.add_argument('--write-penalty', type=float, default=10.0,
+                        help="examined entries one index key write is worth, default 10")
+    parser.add_argument('--prune', action='store_true',
+                        help="remove indexes which no logged search uses from the output")
+    args = parser.parse_args(argv)
+
+    if not args.accesslog and not args.stats_log:
+        parser.error("Give at least one accesslog LDIF or stats log")
+
+    stats = DirectoryStats()
+    for fn in args.ldif:
+        with open(fn) as f:
+            stats.readLdif(f)
+
+    workload = Workload()
+    for fn in args.accesslog:
+        with open(fn) as f:
+            workload.readAccessLog(f)
+    for fn in args.stats_log:
+        with open(fn) as f:
+            workload.readStatsLog(f)
+
+    with open(args.index) as f:
+        doc = json.load(f)
+    for entry in doc.get('indexes', []):
+        workload.addName(entry['attribute'])
+
+    advisor = IndexAdvisor(workload, stats, load_indexes(doc), args.write_penalty)
+    recommendations = advisor.advise(args.min_saving)
+    report(advisor, recommendations)
+
+    if args.output:
+        prune = advisor.unused() if args.prune else ()
+        with open(args.output, 'w') as f:
+            json.dump(updated_index_doc(doc, recommendations, prune), f, indent=4, separators=(',', ': '))
+            f.write('\n')
+        print "\nWrote %s" % args.output
+
+
+if __name__ == '__main__':
+    main()
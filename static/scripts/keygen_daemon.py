@@ -0,0 +1,121 @@
+"""Jython script which serves oxAuth OpenID key generation requests for
+setup.py from a single JVM.
+
+Run with the oxAuth key utility libraries on the classpath:
+
+    java -cp <oxauth libs>:/opt/jython/jython.jar org.python.util.jython keygen_daemon.py
+
+Every line read from stdin is a JSON request and every request gets one
+JSON response line on stdout:
+
+    {"id": 1, "action": "genkeys", "keystore": "/etc/certs/scim-rs.jks",
+     "password": "secret", "algorithms": "RS256 RS512", "dnname": "CN=oxAuth",
+     "expiration": 365, "create": true}
+    {"id": 2, "action": "export", "keystore": "/etc/certs/passport-rp.jks",
+     "password": "secret", "alias": "<kid>", "exportfile": "/etc/certs/passport-rp.pem"}
+    {"id": 3, "action": "quit"}
+
+Responses contain "status" ("ok" or "error"), "output" with everything
+the utility printed to stdout and "error" with what it printed to stderr.
+"""
+
+import sys
+import json
+import jarray
+
+from java.io import ByteArrayOutputStream, FileOutputStream, PrintStream
+from java.lang import SecurityException, SecurityManager, String, System, Throwable
+from java.security import KeyStore
+
+from org.xdi.oxauth.util import KeyExporter, KeyGenerator
+
+
+class NoExitSecurityManager(SecurityManager):
+    """Turns System.exit() of the utilities into an exception"""
+
+    def checkExit(self, status):
+        raise SecurityException("exit %d" % status)
+
+    def checkPermission(self, *args):
+        pass
+
+
+def create_keystore(path, password):
+    keystore = KeyStore.getInstance("JKS")
+    keystore.load(None, None)
+    out = FileOutputStream(path)
+    try:
+        keystore.store(out, String(password).toCharArray())
+    finally:
+        out.close()
+
+
+def call_main(utility, args):
+    """Calls utility.main(args) and returns what it printed"""
+    out = ByteArrayOutputStream()
+    err = ByteArrayOutputStream()
+    System.setOut(PrintStream(out, True))
+    System.setErr(PrintStream(err, True))
+    try:
+        try:
+            utility.main(jarray.array(args, String))
+            status = 'ok'
+        except SecurityException, e:
+            status = 'ok' if str(e.getMessage()) == 'exit 0' else 'error'
+    finally:
+        System.setOut(stdout)
+        System.setErr(stderr)
+
+    return status, out.toString(), err.toString()
+
+
+def handle(request):
+    action = request.get('action')
+    if action == 'genkeys':
+        if request.get('create', True):
+            create_keystore(request['keystore'], request['password'])
+        return call_main(KeyGenerator, ['-keystore', request['keystore'],
+                                        '-keypasswd', request['password'],
+                                        '-algorithms', request['algorithms'],
+                                        '-dnname', request['dnname'],
+                                        '-expiration', str(request['expiration'])])
+    elif action == 'export':
+        return call_main(KeyExporter, ['-keystore', request['keystore'],
+                                       '-keypasswd', request['password'],
+                                       '-alias', request['alias'],
+                                       '-exportfile', request['exportfile']])
+
+    return 'error', '', 'Unknown action %s' % action
+
+
+def serve(requests, responses):
+    """Answers every JSON request line read from requests with a JSON line
+    printed to the responses PrintStream until quit or end of input"""
+    while True:
+        line = requests.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+
+        response = {'output': '', 'error': ''}
+        try:
+            request = json.loads(line)
+            response['id'] = request.get('id')
+            if request.get('action') == 'quit':
+                break
+            response['status'], response['output'], response['error'] = handle(request)
+        except (Exception, Throwable), e:
+            response['status'] = 'error'
+            response['error'] = str(e)
+
+        responses.println(json.dumps(response))
+        responses.flush()
+
+
+stdout = System.out
+stderr = System.err
+
+if __name__ == '__main__':
+    System.setSecurityManager(NoExitSecurityManager())
+    serve(sys.stdin, stdout)
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+"""Load test for the Gluu LDAP server with an oxAuth and oxTrust like mix of
+operations: client lookups by inum, user lookups and binds by uid, token
+writes and lookups and session updates, run by a pool of workers with their
+own connections. Reports ops/sec and p50/p95/p99 latency per operation.
+
+Usage: python ldap_load_test.py -H ldaps://localhost:1636 -w <directory manager password>
+                                [-u users.txt] [-c 16] [-t 60]
+                                [-m client_lookup=35,token_lookup=20,user_bind=15,token_add=15,session_modify=15]
+
+users.txt has uid:password lines, user_bind is left out of the mix without
+it. --slapd runs the test against a stand-in slapd started from the given
+slapd.conf and loaded with the --ldif files instead of the server at -H.
+Entries the test writes are removed at the end.
+"""
+
+import sys
+import math
+import time
+import uuid
+import random
+import bisect
+import argparse
+import threading
+import collections
+
+try:
+    import ldap
+    import ldap.filter
+    import ldap.modlist
+except ImportError:
+    ldap = None
+
+from slapd_standin import SlapdStandIn
+
+OPERATIONS = ['client_lookup', 'token_lookup', 'user_bind', 'token_add', 'session_modify']
+DEFAULT_MIX = 'client_lookup=35,token_lookup=20,user_bind=15,token_add=15,session_modify=15'
+
+
+def parse_mix(text):
+    """Returns dict of operation weights of text like 'client_lookup=3,token_add=1'"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation %s, use one of %s" % (name, ', '.join(OPERATIONS)))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """Returns p-th percentile of sorted values, nearest rank"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))
+    return values[rank]
+
+
+def read_users(lines):
+    users = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line and not line.startswith('#'):
+            uid, _, password = line.partition(':')
+            users.append((uid, password))
+    return users
+
+
+class LatencyStats(object):
+    """ Latencies and errors per operation """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def add(self, name, seconds, ok=True):
+        if ok:
+            self.latencies[name].append(seconds)
+        else:
+            self.errors[name] += 1
+
+    def merge(self, other):
+        for name, values in other.latencies.iteritems():
+            self.latencies[name].extend(values)
+        self.errors.update(other.errors)
+
+    def report(self, duration):
+        """Returns list of (operation, ops, ops/sec, p50 ms, p95 ms, p99 ms,
+        errors), the total is the last row"""
+        rows = []
+        allValues = []
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[name])
+            allValues.extend(values)
+            rows.append(self.row(name, values, self.errors[name], duration))
+        rows.append(self.row('total', sorted(allValues), sum(self.errors.values()), duration))
+        return rows
+
+    def row(self, name, values, errors, duration):
+        return (name, len(values), len(values) / duration if duration else 0.0,
+                percentile(values, 50) * 1000, percentile(values, 95) * 1000, percentile(values, 99) * 1000, errors)
+
+
+class OxAuthWorkload(object):
+    """ Directory data the operations work on """
+
+    def __init__(self, url, bindDN, bindPW, users=(), maxClients=1000):
+        self.url = url
+        self.bindDN = bindDN
+        self.bindPW = bindPW
+        self.users = list(users)
+        self.maxClients = maxClients
+        self.orgDN = None
+        self.clients = []
+        self.tokens = []
+        self.written = []
+        self.lock = threading.Lock()
+
+    def connect(self, bindDN=None, bindPW=None):
+        conn = ldap.initialize(self.url)
+        conn.protocol_version = ldap.VERSION3
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.simple_bind_s(bindDN or self.bindDN, bindPW if bindDN else self.bindPW)
+        return conn
+
+    def discover(self, conn):
+        """Finds organization and clients the operations use"""
+        result = conn.search_s('o=gluu', ldap.SCOPE_ONELEVEL, '(objectClass=gluuOrganization)', ['o'])
+        if not result:
+            raise RuntimeError("No gluuOrganization under o=gluu at %s" % self.url)
+        self.orgDN = result[0][0]
+
+        msgid = conn.search_ext('ou=clients,%s' % self.orgDN, ldap.SCOPE_ONELEVEL, '(objectClass=oxAuthClient)',
+                                ['inum'], sizelimit=self.maxClients)
+        try:
+            for dn, entry in conn.result(msgid)[1]:
+                self.clients.extend(entry.get('inum', []))
+        except ldap.SIZELIMIT_EXCEEDED:
+            pass
+
+        for container in ['token', 'session']:
+            dn = 'ou=%s,%s' % (container, self.orgDN)
+            try:
+                conn.add_s(dn, [('objectClass', ['top', 'organizationalUnit']), ('ou', [container])])
+                self.remember(dn)
+            except ldap.ALREADY_EXISTS:
+                pass
+
+    def remember(self, dn, token=None):
+        with self.lock:
+            self.written.append(dn)
+            if token:
+                self.tokens.append(token)
+
+    def randomToken(self):
+        with self.lock:
+            return random.choice(self.tokens) if self.tokens else None
+
+    def cleanup(self, conn):
+        for dn in reversed(self.written):
+            try:
+                conn.delete_s(dn)
+            except ldap.NO_SUCH_OBJECT:
+                pass
+        self.written = []
+
+
+class Worker(threading.Thread):
+    """ Runs operations of the mix on its own connections """
+
+    def __init__(self, workload, mix, deadline, budget):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.workload = workload
+        self.names = sorted(mix)
+        self.cumulative = []
+        total = 0.0
+        for name in self.names:
+            total += mix[name]
+            self.cumulative.append(total)
+        self.deadline = deadline
+        self.budget = budget
+        self.stats = LatencyStats()
+        self.sessionDN = None
+
+    def pick(self):
+        return self.names[bisect.bisect_right(self.cumulative, random.random() * self.cumulative[-1])]
+
+    def run(self):
+        sessionId = str(uuid.uuid4())
+        self.sessionDN = 'oxAuthSessionId=%s,ou=session,%s' % (sessionId, self.workload.orgDN)
+        try:
+            self.conn = self.workload.connect()
+            self.conn.add_s(self.sessionDN, [('objectClass', ['top', 'oxAuthSessionId']),
+                                             ('oxAuthSessionId', [sessionId]),
+                                             ('oxLastAccessTime', [time.strftime('%Y%m%d%H%M%S.000Z', time.gmtime())])])
+        except ldap.LDAPError, e:
+            sys.stderr.write("Worker can't start: %s\n" % e)
+            self.stats.add('connect', 0, False)
+            return
+        self.workload.remember(self.sessionDN)
+
+        try:
+            while time.time() < self.deadline and self.budget.take():
+                name = self.pick()
+                started = time.time()
+                try:
+                    getattr(self, name)()
+                    self.stats.add(name, time.time() - started)
+                except ldap.LDAPError:
+                    self.stats.add(name, time.time() - started, False)
+        finally:
+            self.conn.unbind_s()
+
+    def client_lookup(self):
+        inum = random.choice(self.workload.clients) if self.workload.clients else str(uuid.uuid4())
+        self.conn.search_s('ou=clients,%s' % self.workload.orgDN, ldap.SCOPE_SUBTREE,
+                           '(&(objectClass=oxAuthClient)(inum=%s))' % inum)
+
+    def user_bind(self):
+        uid, password = random.choice(self.workload.users)
+        result = self.conn.search_s('ou=people,%s' % self.workload.orgDN, ldap.SCOPE_SUBTREE,
+                                    '(&(objectClass=gluuPerson)(uid=%s))' % ldap.filter.escape_filter_chars(uid),
+                                    ['uid'])
+        if not result:
+            raise ldap.NO_SUCH_OBJECT({'desc': 'uid %s not found' % uid})
+        self.workload.connect(result[0][0], password).unbind_s()
+
+    def token_add(self):
+        code = str(uuid.uuid4())
+        now = time.time()
+        dn = 'uniqueIdentifier=%s,ou=token,%s' % (code, self.workload.orgDN)
+        entry = {'objectClass': ['top', 'oxAuthToken'],
+                 'uniqueIdentifier': [code],
+                 'oxAuthTokenCode': [code],
+                 'oxAuthTokenType': ['bearer'],
+                 'oxAuthGrantType': ['authorization_code'],
+                 'oxAuthCreation': [time.strftime('%Y%m%d%H%M%S.000Z', time.gmtime(now))],
+                 'oxAuthExpiration': [time.strftime('%Y%m%d%H%M%S.000Z', time.gmtime(now + 3600))]}
+        if self.workload.clients:
+            entry['oxAuthClientId'] = [random.choice(self.workload.clients)]
+        self.conn.add_s(dn, ldap.modlist.addModlist(entry))
+        self.workload.remember(dn, code)
+
+    def token_lookup(self):
+        code = self.workload.randomToken()
+        if not code:
+            return self.token_add()
+        self.conn.search_s('ou=token,%s' % self.workload.orgDN, ldap.SCOPE_SUBTREE,
+                           '(&(objectClass=oxAuthToken)(oxAuthTokenCode=%s))' % code)
+
+    def session_modify(self):
+        self.conn.modify_s(self.sessionDN, [(ldap.MOD_REPLACE, 'oxLastAccessTime',
+                                             [time.strftime('%Y%m%d%H%M%S.000Z', time.gmtime())])])
+
+
+class Budget(object):
+    """ Shared number of operations the workers may still run """
+
+    def __init__(self, total=None):
+        self.left = total
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.left is None:
+            return True
+        with self.lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def run_load(workload, mix, concurrency, duration, operations=None):
+    """Runs the mix with concurrency workers for duration seconds or until
+    operations were run. Returns (LatencyStats, seconds)."""
+    conn = workload.connect()
+    try:
+        workload.discover(conn)
+        if 'user_bind' in mix and not workload.users:
+            del mix['user_bind']
+        budget = Budget(operations)
+        started = time.time()
+        workers = [Worker(workload, mix, started + duration, budget) for i in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - started
+
+        stats = LatencyStats()
+        for worker in workers:
+            stats.merge(worker.stats)
+        return stats, elapsed
+    finally:
+        workload.cleanup(conn)
+        conn.unbind_s()
+
+
+def print_report(stats, elapsed, out=sys.stdout):
+    out.write("%-16s %10s %10s %9s %9s %9s %8s\n" % ('operation', 'ops', 'ops/sec', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for row in stats.report(elapsed):
+        out.write("%-16s %10d %10.1f %9.2f %9.2f %9.2f %8d\n" % row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LDAP load test with an oxAuth like operation mix")
+    parser.add_argument('-H', '--url', default='ldaps://localhost:1636', help="LDAP server URL")
+    parser.add_argument('-D', '--bind-dn', default='cn=directory manager,o=gluu')
+    parser.add_argument('-w', '--bind-pw', required=True)
+    parser.add_argument('-u', '--users', help="file with uid:password lines for user_bind, - for stdin")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="number of workers")
+    parser.add_argument('-t', '--duration', type=float, default=60, help="seconds to run")
+    parser.add_argument('-n', '--operations', type=int, help="stop after this many operations")
+    parser.add_argument('-m', '--mix', default=DEFAULT_MIX, help="operation weights, default %s" % DEFAULT_MIX)
+    parser.add_argument('--max-clients', type=int, default=1000, help="clients to pick lookups from")
+    parser.add_argument('--slapd', help="run against a stand-in slapd started from this slapd.conf")
+    parser.add_argument('--ldif', action='append', default=[], help="LDIF loaded into the stand-in slapd")
+    args = parser.parse_args(argv)
+
+    if not ldap:
+        parser.error("python-ldap is required")
+
+    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError, e:
+        parser.error(str(e))
+
+    users = []
+    if args.users:
+        users = read_users(sys.stdin if args.users == '-' else open(args.users))
+
+    standIn = None
+    url = args.url
+    if args.slapd:
+        standIn = SlapdStandIn(args.slapd, args.ldif).start()
+        url = standIn.url
+    try:
+        workload = OxAuthWorkload(url, args.bind_dn, args.bind_pw, users, args.max_clients)
+        stats, elapsed = run_load(workload, mix, args.concurrency, args.duration, args.operations)
+    finally:
+        if standIn:
+            standIn.stop()
+
+    print "%d workers against %s for %.1f s" % (args.concurrency, url, elapsed)
+    print_report(stats, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+"""Checks LDIF entries against the LDAP schema before they are imported.
+
+The schema files included by slapd.conf, or those given with -s, are loaded
+once through schema/schema_parser.py on top of the schema built into slapd. For every combination of objectClass
+values seen in the data the superclass closure and the MUST and allowed
+attributes are computed once and reused for all entries with the same
+objectClasses. The LDIF is read as a stream and checked on all cores, the
+entries violating the schema are written with their problems as comments to
+a rejects file, so they can be fixed before slapadd skips them.
+
+Usage: python ldif_validator.py o_gluu.ldif [o_site.ldif ...]
+                                [-f /opt/symas/etc/openldap/slapd.conf] [-s custom.schema ...]
+                                [-r o_gluu.ldif.rejects] [-j 4]
+"""
+
+import os
+import re
+import sys
+import base64
+import argparse
+import multiprocessing
+
+schema_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'schema')
+sys.path.insert(0, schema_dir)
+
+from model import SchemaModel
+
+include_re = re.compile(r'^include\s+"?([^"\s]+\.schema)"?\s*$', re.M)
+
+# maintained by slapd and its overlays, not declared by object classes
+OPERATIONAL_ATTRIBUTES = set(name.lower() for name in [
+    'createTimestamp', 'creatorsName', 'modifyTimestamp', 'modifiersName',
+    'entryUUID', 'entryCSN', 'entryDN', 'contextCSN', 'structuralObjectClass',
+    'hasSubordinates', 'subschemaSubentry', 'numSubordinates', 'memberOf',
+    'pwdChangedTime', 'pwdAccountLockedTime', 'pwdFailureTime', 'pwdHistory',
+    'pwdGraceUseTime', 'pwdReset', 'pwdPolicySubentry', 'ds-pwp-account-disabled',
+    'ds-sync-hist', 'ds-sync-state', 'ds-sync-generation-id',
+])
+
+# built into slapd, core.schema has them commented out
+SYSTEM_SCHEMA = {
+    'oidMacros': {},
+    'attributeTypes': [
+        {'oid': '2.5.4.0', 'names': ['objectClass']},
+        {'oid': '2.5.4.1', 'names': ['aliasedObjectName', 'aliasedEntryName'], 'single_value': True},
+        {'oid': '2.16.840.1.113730.3.1.34', 'names': ['ref']},
+        {'oid': '2.5.21.1', 'names': ['dITStructureRules']},
+        {'oid': '2.5.21.2', 'names': ['dITContentRules']},
+        {'oid': '2.5.21.4', 'names': ['matchingRules']},
+        {'oid': '2.5.21.5', 'names': ['attributeTypes']},
+        {'oid': '2.5.21.6', 'names': ['objectClasses']},
+        {'oid': '2.5.21.7', 'names': ['nameForms']},
+        {'oid': '2.5.21.8', 'names': ['matchingRuleUse']},
+        {'oid': '1.3.6.1.4.1.1466.101.120.16', 'names': ['ldapSyntaxes']},
+    ],
+    'objectClasses': [
+        {'oid': '2.5.6.0', 'names': ['top'], 'kind': 'ABSTRACT', 'must': ['objectClass']},
+        {'oid': '2.5.6.1', 'names': ['alias'], 'kind': 'STRUCTURAL', 'sup': ['top'],
+         'must': ['aliasedObjectName']},
+        {'oid': '2.16.840.1.113730.3.2.6', 'names': ['referral'], 'kind': 'STRUCTURAL', 'sup': ['top'],
+         'must': ['ref']},
+        {'oid': '1.3.6.1.4.1.1466.101.120.111', 'names': ['extensibleObject'], 'kind': 'AUXILIARY',
+         'sup': ['top']},
+        {'oid': '2.5.20.1', 'names': ['subschema'], 'kind': 'AUXILIARY',
+         'may': ['dITStructureRules', 'nameForms', 'dITContentRules', 'objectClasses', 'attributeTypes',
+                 'matchingRules', 'matchingRuleUse']},
+        {'oid': '1.3.6.1.4.1.4203.666.3.4', 'names': ['glue'], 'kind': 'STRUCTURAL', 'sup': ['top']},
+    ],
+}
+
+
+def schema_files(slapdConf):
+    """Returns the schema files included by slapdConf"""
+    with open(slapdConf) as f:
+        return include_re.findall(f.read())
+
+
+def read_records(fileobj):
+    """Yields (line number, text) of every record of an LDIF file"""
+    lines = []
+    start = 1
+    for lineNo, line in enumerate(fileobj, 1):
+        if line.strip():
+            if not lines:
+                start = lineNo
+            lines.append(line)
+        elif lines:
+            yield start, ''.join(lines)
+            lines = []
+    if lines:
+        yield start, ''.join(lines)
+
+
+def parse_entry(text):
+    """Returns (dn, dict of lower case attribute name to list of values) of
+    an LDIF record, or None when it is a change record or has no dn. Only
+    the objectClass values are decoded."""
+    unfolded = []
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        if line.startswith(' ') and unfolded:
+            unfolded[-1] += line[1:]
+        else:
+            unfolded.append(line)
+
+    dn = None
+    entry = {}
+    for line in unfolded:
+        name, _, value = line.partition(':')
+        name = name.split(';')[0].lower()
+        if name == 'version' and dn is None:
+            continue
+        if name == 'changetype':
+            return None
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip()) if name in ('dn', 'objectclass') else value
+        else:
+            value = value.strip()
+        if name == 'dn':
+            dn = value
+        else:
+            entry.setdefault(name, []).append(value)
+    if dn is None:
+        return None
+    return dn, entry
+
+
+class SchemaRules(object):
+    """ Schema checks of entries, memoized per set of objectClasses """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.closures = {}
+        self.rules = {}
+        self.attributeKeys = {}
+
+    def attributeKey(self, name):
+        """Returns the lower case primary name of attribute name or alias"""
+        key = self.attributeKeys.get(name)
+        if key is None:
+            attr = self.schema.attribute(name)
+            key = attr['names'][0].lower() if attr and attr.get('names') else name.lower()
+            self.attributeKeys[name] = key
+        return key
+
+    def superclasses(self, name):
+        """Returns set of lower case names of object class name and all its
+        superclasses, None when the object class is unknown"""
+        key = name.lower()
+        if key not in self.closures:
+            obc = self.schema.objectclass(key)
+            if obc is None:
+                self.closures[key] = None
+                return None
+            # guards against SUP loops
+            self.closures[key] = set()
+            closure = set([(obc.get('names') or [obc['oid']])[0].lower()])
+            for sup in obc.get('sup', []):
+                closure |= self.superclasses(sup) or set()
+            self.closures[key] = closure
+        return self.closures[key]
+
+    def objectclassRules(self, objectclasses):
+        """Returns dict of must and allowed attribute keys, unknown object
+        classes and whether a structural and extensibleObject class is
+        among objectclasses"""
+        key = frozenset(name.lower() for name in objectclasses)
+        rules = self.rules.get(key)
+        if rules is None:
+            classes = set()
+            unknown = []
+            for name in sorted(key):
+                closure = self.superclasses(name)
+                if closure is None:
+                    unknown.append(name)
+                else:
+                    classes |= closure
+            must = set()
+            allowed = set()
+            structural = False
+            for name in classes:
+                obc = self.schema.objectclass(name)
+                must.update(self.attributeKey(attr) for attr in obc.get('must', []))
+                allowed.update(self.attributeKey(attr) for attr in obc.get('may', []))
+                structural = structural or obc.get('kind', 'STRUCTURAL') == 'STRUCTURAL'
+            rules = self.rules[key] = {
+                'must': must,
+                'allowed': allowed | must,
+                'unknown': unknown,
+                'structural': structural,
+                'extensible': 'extensibleobject' in classes,
+            }
+        return rules
+
+    def check(self, entry):
+        """Returns list of schema violations of entry parsed by parse_entry"""
+        objectclasses = entry.get('objectclass')
+        if not objectclasses:
+            return ['no objectClass']
+        rules = self.objectclassRules(objectclasses)
+        problems = ['unknown objectClass %s' % name for name in rules['unknown']]
+        if not rules['unknown'] and not rules['structural']:
+            problems.append('no structural objectClass')
+
+        present = set()
+        for name in sorted(entry):
+            key = self.attributeKey(name)
+            present.add(key)
+            if key in OPERATIONAL_ATTRIBUTES:
+                continue
+            if self.schema.attribute(name) is None:
+                problems.append('undefined attribute type %s' % name)
+            elif not rules['extensible'] and not rules['unknown'] and key not in rules['allowed']:
+                problems.append('attribute %s not allowed' % name)
+        for key in sorted(rules['must'] - present):
+            problems.append('missing required attribute %s' % key)
+        return problems
+
+
+_rules = None
+
+
+def _init_worker(schemaData):
+    global _rules
+    _rules = SchemaRules(SchemaModel(schemaData))
+
+
+def _check_record(record):
+    lineNo, text = record
+    parsed = parse_entry(text)
+    if parsed is None:
+        return lineNo, None, None
+    problems = _rules.check(parsed[1])
+    return lineNo, text if problems else None, problems
+
+
+class LDIFValidator(object):
+    """ Validates LDIF files against a schema on a pool of processes """
+
+    def __init__(self, schemaFiles, processes=None, cacheDir=None):
+        # the schema files can replace the system definitions
+        self.schema = SchemaModel(SYSTEM_SCHEMA)
+        self.schema.add(SchemaModel.from_files(schemaFiles, cacheDir or os.path.join(schema_dir, '.cache')).to_dict())
+        self.processes = processes or multiprocessing.cpu_count()
+
+    def validate(self, ldifFn, rejectsFn=None, chunksize=256):
+        """Checks all entries of ldifFn and writes the rejected ones to
+        rejectsFn, default ldifFn.rejects. Returns dict of entries and
+        rejected counts and the rejects file."""
+        rejectsFn = rejectsFn or ldifFn + '.rejects'
+        stats = {'entries': 0, 'rejected': 0, 'rejects': rejectsFn}
+        pool = None
+        if self.processes > 1:
+            pool = multiprocessing.Pool(self.processes, _init_worker, (self.schema.to_dict(),))
+            mapper = lambda records: pool.imap(_check_record, records, chunksize)
+        else:
+            _init_worker(self.schema.to_dict())
+            mapper = lambda records: (_check_record(record) for record in records)
+        try:
+            with open(ldifFn) as ldif, open(rejectsFn, 'w') as rejects:
+                for lineNo, text, problems in mapper(read_records(ldif)):
+                    if problems is None:
+                        continue
+                    stats['entries'] += 1
+                    if not problems:
+                        continue
+                    stats['rejected'] += 1
+                    rejects.write('# line %d: %s\n' % (lineNo, '; '.join(problems)))
+                    rejects.write(text.rstrip('\n') + '\n\n')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks LDIF files against the LDAP schema")
+    parser.add_argument('ldif', nargs='+', help="LDIF files to check")
+    parser.add_argument('-f', '--slapd-conf', default='/opt/symas/etc/openldap/slapd.conf',
+                        help="slapd.conf whose included schema files are used")
+    parser.add_argument('-s', '--schema', action='append',
+                        help="schema file to use instead of those of slapd.conf, may be repeated")
+    parser.add_argument('-r', '--rejects', help="rejects file when one LDIF file is checked, default <ldif>.rejects")
+    parser.add_argument('-j', '--processes', type=int, help="number of processes, default number of cpus")
+    args = parser.parse_args(argv)
+
+    if args.rejects and len(args.ldif) > 1:
+        parser.error("--rejects can be used with one LDIF file only")
+
+    validator = LDIFValidator(args.schema or schema_files(args.slapd_conf), args.processes)
+    rejected = 0
+    for ldifFn in args.ldif:
+        stats = validator.validate(ldifFn, args.rejects)
+        rejected += stats['rejected']
+        print "%s: %d entries, %d rejected%s" % (ldifFn, stats['entries'], stats['rejected'],
+                                                  ', see ' + stats['rejects'] if stats['rejected'] else '')
+    return 1 if rejected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
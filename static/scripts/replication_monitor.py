@@ -0,0 +1,294 @@
+#!/usr/bin/python
+"""Monitors OpenLDAP replication set up with replication_tool.py.
+
+Every interval the contextCSN of the suffix and the cn=monitor operation
+counters of all masters and slaves are read in parallel. For every provider
+and consumer pair the lag is reported in seconds, from the CSN timestamps
+per server id, and in changes, counted as entries whose entryCSN on the
+provider is newer than the consumer's contextCSN. The report is printed
+and written as Prometheus text to a file node_exporter's textfile
+collector can read.
+
+Usage: python replication_monitor.py -c output/replication.json -w <password>
+                                     [-i 15] [-n 0] [-p /var/lib/node_exporter/gluu_ldap.prom]
+       python replication_monitor.py -s ldap://m1:1636,ldap://s1:1636 --providers ldap://m1:1636 -w <password>
+"""
+
+import os
+import sys
+import json
+import time
+import calendar
+import argparse
+import tempfile
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import ldap
+except ImportError:
+    ldap = None
+
+# python-ldap scope values, kept here so the module loads without python-ldap
+SCOPE_BASE = 0
+SCOPE_SUBTREE = 2
+
+MONITOR_OPERATIONS = ['Bind', 'Search', 'Compare', 'Modify', 'Modrdn', 'Add', 'Delete']
+WRITE_OPERATIONS = ['Modify', 'Modrdn', 'Add', 'Delete']
+
+
+def parse_csn(csn):
+    """Returns (timestamp, count, server id, modification number) of CSN
+    like 20170101120000.123456Z#000000#001#000000"""
+    stamp, count, sid, mod = csn.split('#')
+    seconds, _, fraction = stamp.rstrip('Z').partition('.')
+    timestamp = calendar.timegm(time.strptime(seconds, '%Y%m%d%H%M%S')) + float('0.' + (fraction or '0'))
+    return timestamp, int(count, 16), sid, int(mod, 16)
+
+
+def csns_by_sid(csns):
+    """Returns dict of server id to its newest CSN"""
+    newest = {}
+    for csn in csns:
+        sid = parse_csn(csn)[2]
+        if sid not in newest or csn > newest[sid]:
+            newest[sid] = csn
+    return newest
+
+
+def lag(providerCSNs, consumerCSNs):
+    """Returns (seconds, oldest consumer CSN) the consumer is behind the
+    provider, comparing the changes of every server id the provider has.
+    seconds is infinite when the consumer has no changes of a server id and
+    the CSN is None when it is not behind."""
+    provider = csns_by_sid(providerCSNs)
+    consumer = csns_by_sid(consumerCSNs)
+    seconds = 0.0
+    behind = None
+    for sid, csn in provider.iteritems():
+        consumerCSN = consumer.get(sid)
+        if consumerCSN is None:
+            return float('inf'), None
+        if consumerCSN < csn:
+            seconds = max(seconds, parse_csn(csn)[0] - parse_csn(consumerCSN)[0])
+            if behind is None or consumerCSN < behind:
+                behind = consumerCSN
+    return seconds, behind
+
+
+def rates(previous, current, seconds):
+    """Returns dict of operation to operations per second between two
+    counter samples"""
+    if not previous or not seconds:
+        return {}
+    return dict((name, max(0, current[name] - previous[name]) / seconds)
+                for name in current if name in previous)
+
+
+def prometheus_text(report):
+    """Returns report of ReplicationMonitor.poll() in Prometheus text format"""
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            labelText = ','.join('%s="%s"' % (key, str(labels[key]).replace('"', '\\"')) for key in sorted(labels))
+            lines.append('%s{%s} %s' % (name, labelText, '+Inf' if value == float('inf') else repr(float(value))))
+
+    servers = report['servers']
+    metric('gluu_ldap_up', 'gauge', 'Whether the server answered the last poll',
+           [({'server': name}, 1 if state['up'] else 0) for name, state in sorted(servers.iteritems())])
+    metric('gluu_ldap_context_csn_timestamp_seconds', 'gauge', 'Time of the newest change per server id',
+           [({'server': name, 'sid': sid}, parse_csn(csn)[0])
+            for name, state in sorted(servers.iteritems()) for sid, csn in sorted(csns_by_sid(state['csns']).iteritems())])
+    metric('gluu_ldap_operations_completed_total', 'counter', 'Operations completed since slapd started',
+           [({'server': name, 'operation': op.lower()}, count)
+            for name, state in sorted(servers.iteritems()) for op, count in sorted(state['operations'].iteritems())])
+    metric('gluu_ldap_operations_per_second', 'gauge', 'Operations completed per second since the previous poll',
+           [({'server': name, 'operation': op.lower()}, rate)
+            for name, state in sorted(servers.iteritems()) for op, rate in sorted(state['rates'].iteritems())])
+    metric('gluu_ldap_replication_lag_seconds', 'gauge', 'Seconds the consumer is behind the provider',
+           [({'provider': pair['provider'], 'consumer': pair['consumer']}, pair['seconds']) for pair in report['pairs']])
+    metric('gluu_ldap_replication_lag_changes', 'gauge', 'Entries changed on the provider the consumer does not have',
+           [({'provider': pair['provider'], 'consumer': pair['consumer']}, pair['changes'])
+            for pair in report['pairs'] if pair['changes'] is not None])
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(fn, text):
+    fd, tmpFn = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)), prefix='.%s.' % os.path.basename(fn))
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.chmod(tmpFn, 0644)
+    os.rename(tmpFn, fn)
+
+
+class ReplicationMonitor(object):
+    """ Polls contextCSN and operation counters of replicated servers """
+
+    def __init__(self, servers, providers, connect, suffix='o=gluu', maxChanges=10000):
+        """servers is list of server URLs, providers those of them other
+        servers replicate from and connect a function returning a bound
+        python-ldap like connection for a URL"""
+        self.servers = list(servers)
+        self.providers = list(providers)
+        self.connect = connect
+        self.suffix = suffix
+        self.maxChanges = maxChanges
+        self.connections = {}
+        self.previous = {}
+        self.previousTime = None
+
+    def connection(self, server):
+        if server not in self.connections:
+            self.connections[server] = self.connect(server)
+        return self.connections[server]
+
+    def readServer(self, server):
+        state = {'up': False, 'csns': [], 'operations': {}, 'rates': {}, 'error': None, 'monitor_error': None}
+        try:
+            conn = self.connection(server)
+            result = conn.search_s(self.suffix, SCOPE_BASE, '(objectClass=*)', ['contextCSN'])
+            if result:
+                state['csns'] = result[0][1].get('contextCSN', [])
+            state['up'] = True
+        except Exception, e:
+            state['error'] = str(e)
+            self.connections.pop(server, None)
+            return server, state
+
+        # the monitor backend may be missing or not readable by the bind DN,
+        # replication lag is still reported without the counters
+        try:
+            for dn, entry in conn.search_s('cn=Operations,cn=Monitor', SCOPE_SUBTREE,
+                                           '(objectClass=*)', ['monitorOpCompleted']):
+                name = dn.split(',')[0].split('=')[1]
+                if name in MONITOR_OPERATIONS and entry.get('monitorOpCompleted'):
+                    state['operations'][name] = int(entry['monitorOpCompleted'][0])
+        except Exception, e:
+            state['operations'] = {}
+            state['monitor_error'] = str(e)
+        return server, state
+
+    def countChanges(self, provider, consumerCSN):
+        """Returns number of entries changed on provider after consumerCSN,
+        at most maxChanges"""
+        try:
+            conn = self.connection(provider)
+            msgid = conn.search_ext(self.suffix, SCOPE_SUBTREE, '(entryCSN>=%s)' % consumerCSN, ['1.1'],
+                                    sizelimit=self.maxChanges)
+            entries = conn.result(msgid)[1]
+        except Exception, e:
+            if ldap and isinstance(e, ldap.SIZELIMIT_EXCEEDED):
+                return self.maxChanges
+            return None
+        # the entry with consumerCSN itself is already replicated
+        return max(0, len(entries) - 1)
+
+    def poll(self):
+        """Reads all servers in parallel and returns report dict with
+        servers, their state and lag of every provider and consumer pair"""
+        now = time.time()
+        pool = ThreadPool(max(1, len(self.servers)))
+        try:
+            servers = dict(pool.map(self.readServer, self.servers))
+        finally:
+            pool.close()
+            pool.join()
+
+        elapsed = now - self.previousTime if self.previousTime else None
+        for name, state in servers.iteritems():
+            state['rates'] = rates(self.previous.get(name), state['operations'], elapsed)
+            if state['monitor_error']:
+                self.previous.pop(name, None)
+            elif state['up']:
+                self.previous[name] = state['operations']
+        self.previousTime = now
+
+        pairs = []
+        for provider in self.providers:
+            for consumer in self.servers:
+                if consumer == provider or not servers[provider]['up'] or not servers[consumer]['up']:
+                    continue
+                seconds, behind = lag(servers[provider]['csns'], servers[consumer]['csns'])
+                changes = 0
+                if behind:
+                    changes = self.countChanges(provider, behind)
+                elif seconds == float('inf'):
+                    changes = None
+                pairs.append({'provider': provider, 'consumer': consumer, 'seconds': seconds, 'changes': changes})
+
+        return {'time': now, 'servers': servers, 'pairs': pairs}
+
+
+def print_report(report, out=sys.stdout):
+    out.write("%s\n" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['time'])))
+    for name, state in sorted(report['servers'].iteritems()):
+        if not state['up']:
+            out.write("  %-30s DOWN %s\n" % (name, state['error']))
+            continue
+        if state['monitor_error']:
+            out.write("  %-30s no monitor counters: %s\n" % (name, state['monitor_error']))
+            continue
+        writes = sum(state['rates'].get(op, 0) for op in WRITE_OPERATIONS)
+        out.write("  %-30s searches/s %8.1f  writes/s %8.1f\n" % (name, state['rates'].get('Search', 0), writes))
+    for pair in report['pairs']:
+        changes = '?' if pair['changes'] is None else pair['changes']
+        out.write("  %s -> %s lag %.1f s, %s changes\n" % (pair['provider'], pair['consumer'], pair['seconds'], changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitors OpenLDAP replication lag and throughput")
+    parser.add_argument('-c', '--config', default='./output/replication.json',
+                        help="replication.json written by replication_tool.py")
+    parser.add_argument('-s', '--servers', help="comma separated server URLs instead of --config")
+    parser.add_argument('--providers', help="comma separated URLs of --servers others replicate from")
+    parser.add_argument('-D', '--bind-dn', default='cn=directory manager,o=gluu')
+    parser.add_argument('-w', '--bind-pw', required=True)
+    parser.add_argument('-i', '--interval', type=float, default=15, help="seconds between polls")
+    parser.add_argument('-n', '--count', type=int, default=0, help="number of polls, 0 runs until interrupted")
+    parser.add_argument('-p', '--prom-file', help="file the Prometheus metrics are written to")
+    parser.add_argument('--ldaps', action='store_true', help="connect with ldaps to servers of --config")
+    args = parser.parse_args(argv)
+
+    if not ldap:
+        parser.error("python-ldap is required")
+
+    suffix = 'o=gluu'
+    if args.servers:
+        servers = [server.strip() for server in args.servers.split(',')]
+        providers = [server.strip() for server in (args.providers or servers[0]).split(',')]
+    else:
+        with open(args.config) as f:
+            config = json.load(f)
+        scheme = 'ldaps' if args.ldaps else 'ldap'
+        providers = ['%s://%s' % (scheme, server) for server in config['masters']]
+        servers = providers + ['%s://%s' % (scheme, server) for server in config['slaves']]
+        suffix = config.get('suffix', suffix)
+
+    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+
+    def connect(url):
+        conn = ldap.initialize(url)
+        conn.protocol_version = ldap.VERSION3
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, 10)
+        conn.simple_bind_s(args.bind_dn, args.bind_pw)
+        return conn
+
+    monitor = ReplicationMonitor(servers, providers, connect, suffix)
+    polls = 0
+    while True:
+        started = time.time()
+        report = monitor.poll()
+        print_report(report)
+        if args.prom_file:
+            write_atomic(args.prom_file, prometheus_text(report))
+        polls += 1
+        if args.count and polls >= args.count:
+            break
+        time.sleep(max(0, args.interval - (time.time() - started)))
+
+
+if __name__ == '__main__':
+    main()
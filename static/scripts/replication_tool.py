@@ -1,12 +1,17 @@
 #!/usr/bin/python
 
 import sys
+import json
 import string
 import random
 import commands
 import random
 import getpass
 import os
+import argparse
+import subprocess
+
+from multiprocessing.pool import ThreadPool
 
 class ReplicationTool:
     def __init__(self):
@@ -17,6 +22,11 @@ class ReplicationTool:
         self.encode_pw = """/opt/opendj/bin/encode-password -c %s -s SSHA"""
         self.repMgrDN = 'cn=replication manager,o=gluu'
         self.repMgrPW = ''
+        self.suffix = 'o=gluu'
+        self.slapcat = '/opt/symas/bin/slapcat'
+        self.slapadd = '/opt/symas/bin/slapadd'
+        self.data_dir = '/opt/gluu/data/main_db'
+        self.threads = 8
 
     def duplicateServer(self, server):
         all_servers = self.master_list + self.slave_list
@@ -24,6 +34,17 @@ class ReplicationTool:
             return True
         return False
 
+    def parseServers(self, text):
+        servers = []
+        for server in text.split(','):
+            server = server.strip().lower()
+            host, port = server.split(':')
+            int(port)
+            if server in servers or self.duplicateServer(server):
+                raise ValueError("Duplicate server %s" % server)
+            servers.append(server)
+        return servers
+
     def getMasters(self):
         print
         while True:
@@ -106,119 +127,253 @@ userpassword: %s
 
 """ % self.repMgrPW
     
-    def getMasterConfigs(self):
-        master_configs = {}
-        for master in self.master_list:
-            conf = []
-            current_config = open(self.slapd_conf)
-            lines = current_config.readlines()
-            current_config.close()
-            loadModuleFlag = False
-            indexFlag = False
-            overlayFlag = False
-            for line in lines:
-                printAfter = ""
-                if not loadModuleFlag and self.beginsWith(line, 'moduleload'):
-                    conf.append('moduleload syncprov.la')
-                    loadModuleFlag = True
-        
-                if not indexFlag and self.beginsWith(line, 'index'):
-                    printAfter = "index entryCSN,entryUUID eq"
-                    indexFlag = True
-        
-                if not overlayFlag and self.beginsWith(line, 'overlay'):
-                    conf.append("""overlay syncprov
+    def readConfig(self):
+        current_config = open(self.slapd_conf)
+        lines = current_config.readlines()
+        current_config.close()
+        return lines
+
+    def getMasterConfig(self, master, lines):
+        conf = []
+        loadModuleFlag = False
+        indexFlag = False
+        overlayFlag = False
+        for line in lines:
+            printAfter = ""
+            if not loadModuleFlag and self.beginsWith(line, 'moduleload'):
+                conf.append('moduleload syncprov.la')
+                loadModuleFlag = True
+
+            if not indexFlag and self.beginsWith(line, 'index'):
+                printAfter = "index entryCSN,entryUUID eq"
+                indexFlag = True
+
+            if not overlayFlag and self.beginsWith(line, 'overlay'):
+                conf.append("""overlay syncprov
 syncprov-checkpoint 100 10
 syncprov-sessionlog 10000
 syncprov-reloadhint TRUE""")
-                    overlayFlag = True
+                overlayFlag = True
 
-                conf.append(line.strip())
-                if printAfter:
-                    conf.append(printAfter)
-            master_configs[master] = "\n".join(conf)
-        return master_configs
+            conf.append(line.strip())
+            if printAfter:
+                conf.append(printAfter)
+        return "\n".join(conf)
 
-    def getSlaveConfigs(self):
-        slave_configs = {}
-        for slave in self.slave_list:
-            conf = []
-            current_config = open(self.slapd_conf)
-            lines = current_config.readlines()
-            current_config.close()
-            loadModuleFlag = False
-            indexFlag = False
-            overlayFlag = False
-            directoryFlag = False
-            for line in lines: 
-                printAfter = ""
-                if not loadModuleFlag and self.beginsWith(line, 'moduleload'):
-                    conf.append("moduleload back_ldap.la")
-                    loadModuleFlag = True
-
-                if not overlayFlag and self.beginsWith(line, 'overlay'):
-                    conf.append('overlay chain')
-                    for master_server in self.master_list:
-                        conf.append('chain-uri "ldap://%s/"' % master_server)
-                    conf.append("""chain-idassert-bind bindmethod="simple"
+    def getSlaveConfig(self, slave, lines):
+        conf = []
+        loadModuleFlag = False
+        indexFlag = False
+        overlayFlag = False
+        directoryFlag = False
+        for line in lines:
+            printAfter = ""
+            if not loadModuleFlag and self.beginsWith(line, 'moduleload'):
+                conf.append("moduleload back_ldap.la")
+                loadModuleFlag = True
+
+            if not overlayFlag and self.beginsWith(line, 'overlay'):
+                conf.append('overlay chain')
+                for master_server in self.master_list:
+                    conf.append('chain-uri "ldap://%s/"' % master_server)
+                conf.append("""chain-idassert-bind bindmethod="simple"
 binddn="cn=replication Manager,o=gluu"
 credentials="%s"
 mode="self"
 chain-return-error TRUE""" % self.repMgrPW)
-                    overlayFlag = True
-    
-                if not indexFlag and self.beginsWith(line, 'index'):
-                    printAfter = "index entryCSN,entryUUID eq"
-                    indexFlag = True
-    
-                if not directoryFlag and self.beginsWith(line, 'directory'):
-                    conf.append("syncrepl")
-                    conf.append("rid=1")
-                    for master_server in self.master_list:
-                        conf.append(" provider=ldap://%s" % master_server)
-                    conf.append(""" binddn="cn=replication manager,o=gluu"
+                overlayFlag = True
+
+            if not indexFlag and self.beginsWith(line, 'index'):
+                printAfter = "index entryCSN,entryUUID eq"
+                indexFlag = True
+
+            if not directoryFlag and self.beginsWith(line, 'directory'):
+                conf.append("syncrepl")
+                conf.append("rid=1")
+                for master_server in self.master_list:
+                    conf.append(" provider=ldap://%s" % master_server)
+                conf.append(""" binddn="cn=replication manager,o=gluu"
  credentials=%s
  bindmethod=simple
  searchbase="o=gluu"
  type=refreshAndPersist
  retry="60 +" """ % self.repMgrPW)
-                    for master_server in self.master_list:
-                        conf.append("updateref=ldap://%s/" % master_server)
+                for master_server in self.master_list:
+                    conf.append("updateref=ldap://%s/" % master_server)
+
+            conf.append(line.strip())
+            if printAfter:
+                conf.append(printAfter)
+        return "\n".join(conf)
+
+    def generateConfigs(self, servers):
+        """Returns dict of server to its slapd.conf text for list of (server,
+        'master' or 'slave'), configs are generated in parallel"""
+        lines = self.readConfig()
+
+        def generate(job):
+            server, role = job
+            if role == 'master':
+                return server, self.getMasterConfig(server, lines)
+            return server, self.getSlaveConfig(server, lines)
 
-                conf.append(line.strip())
-                if printAfter: 
-                    conf.append(printAfter)
-            slave_configs[slave] = "\n".join(conf)
-        return slave_configs
+        pool = ThreadPool(max(1, min(self.threads, len(servers))))
+        try:
+            return dict(pool.map(generate, servers))
+        finally:
+            pool.close()
+            pool.join()
+
+    def getMasterConfigs(self):
+        return self.generateConfigs([(master, 'master') for master in self.master_list])
+
+    def getSlaveConfigs(self):
+        return self.generateConfigs([(slave, 'slave') for slave in self.slave_list])
+
+    def configFileName(self, outFolder, server):
+        return "%s/slapd.conf-%s" % (outFolder, server.replace(":", "_"))
+
+    def writeConfigs(self, outFolder):
+        """Writes slapd.conf of all masters and slaves and replication.json
+        listing them to outFolder"""
+        configs = self.generateConfigs([(master, 'master') for master in self.master_list] +
+                                       [(slave, 'slave') for slave in self.slave_list])
+
+        def write(server):
+            f = open(self.configFileName(outFolder, server), 'w')
+            f.write(configs[server])
+            f.close()
+
+        pool = ThreadPool(max(1, min(self.threads, len(configs))))
+        try:
+            pool.map(write, configs.keys())
+        finally:
+            pool.close()
+            pool.join()
+
+        f = open("%s/replication.json" % outFolder, 'w')
+        json.dump({'masters': self.master_list, 'slaves': self.slave_list, 'suffix': self.suffix}, f, indent=2)
+        f.close()
+
+    def makeSnapshot(self, snapshotFn):
+        """Dumps the local database with slapcat. slapcat reads a consistent
+        copy of mdb databases also while slapd is running."""
+        subprocess.check_call([self.slapcat, '-f', self.slapd_conf, '-b', self.suffix,
+                               '-o', 'ldif-wrap=no', '-l', snapshotFn])
+
+    def getContextCSN(self, snapshotFn):
+        """Returns contextCSN values of the suffix entry in snapshotFn"""
+        csns = []
+        state = {'inSuffix': False}
+
+        def handle(attribute):
+            name, _, value = attribute.partition(':')
+            if name.lower() == 'dn':
+                state['inSuffix'] = value.strip().lower() == self.suffix.lower()
+            elif state['inSuffix'] and name.lower() == 'contextcsn':
+                csns.append(value.strip())
+
+        current = None
+        for line in open(snapshotFn):
+            line = line.rstrip('\r\n')
+            if line.startswith(' ') and current is not None:
+                current += line[1:]
+                continue
+            if current is not None:
+                handle(current)
+            if not line and csns:
+                return csns
+            current = line or None
+        if current is not None:
+            handle(current)
+        return csns
+
+    def getSeedScript(self, slave, snapshotFn, csns):
+        confFn = os.path.basename(self.configFileName('.', slave))
+        return """#!/bin/sh
+# Seeds consumer %(slave)s with snapshot of %(suffix)s taken at contextCSN
+#   %(csns)s
+# syncrepl replays only the changes made after the snapshot.
+# Run on %(slave)s with %(snapshot)s and %(conf)s in the current folder.
+set -e
+SNAPSHOT=${1:-%(snapshot)s}
+CONF=${2:-%(conf)s}
+
+service solserver stop || true
+if [ -d %(data_dir)s ]; then
+    mv %(data_dir)s %(data_dir)s.bkp_$(date +%%Y%%m%%d%%H%%M%%S)
+fi
+mkdir -p %(data_dir)s
+cp $CONF %(slapd_conf)s
+%(slapadd)s -q -f %(slapd_conf)s -b %(suffix)s -l $SNAPSHOT
+chown -R ldap:ldap %(data_dir)s
+service solserver start
+""" % {'slave': slave, 'suffix': self.suffix, 'csns': '\n#   '.join(csns), 'snapshot': os.path.basename(snapshotFn),
+       'conf': confFn, 'data_dir': self.data_dir, 'slapd_conf': self.slapd_conf, 'slapadd': self.slapadd}
+
+    def writeSeedScripts(self, outFolder, snapshotFn):
+        """Writes seed-<slave>.sh for every slave, returns contextCSN of the
+        snapshot"""
+        csns = self.getContextCSN(snapshotFn)
+        if not csns:
+            raise ValueError("Snapshot %s has no contextCSN in %s, is syncprov enabled on this server?" % (snapshotFn, self.suffix))
+        for slave in self.slave_list:
+            fn = "%s/seed-%s.sh" % (outFolder, slave.replace(":", "_"))
+            f = open(fn, 'w')
+            f.write(self.getSeedScript(slave, snapshotFn, csns))
+            f.close()
+            os.chmod(fn, 0755)
+        return csns
 
 ########################################################################
 #                           MAIN PROGRAM                               #
 ########################################################################
 
-r = ReplicationTool()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates OpenLDAP syncrepl configuration for masters and slaves")
+    parser.add_argument('--masters', help="comma separated host:port of masters, asked for when not given")
+    parser.add_argument('--slaves', help="comma separated host:port of slaves, asked for when not given")
+    parser.add_argument('--output', default='./output', help="folder configs are written to")
+    parser.add_argument('--seed', action='store_true',
+                        help="snapshot the local database with slapcat and write seed scripts for the slaves")
+    parser.add_argument('--snapshot', help="seed from this slapcat LDIF instead of taking a new snapshot")
+    args = parser.parse_args(argv)
+
+    r = ReplicationTool()
+
+    try:
+        if args.masters:
+            r.master_list = r.parseServers(args.masters)
+        else:
+            r.getMasters()
+        if args.slaves:
+            r.slave_list = r.parseServers(args.slaves)
+        else:
+            r.getSlaves()
+    except ValueError, e:
+        print "Error parsing servers: %s" % e
+        sys.exit(2)
 
-r.getMasters()
-r.getSlaves()
+    pw = r.getPW(random.randint(10,15))
+    r.repMgrPW = r.encodePW(pw)
+    print "\n Replication Manager password is: %s\n" % pw
 
-pw = r.getPW(random.randint(10,15))
-r.repMgrPW = r.encodePW(pw)
-print "\n Replication Manager password is: %s\n" % pw
+    outFolder = args.output
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
 
-outFolder = "./output"
-if not os.path.exists(outFolder):
-    os.makedirs(outFolder)
+    r.writeConfigs(outFolder)
 
-master_dict = r.getMasterConfigs()
-for master in master_dict.keys():
-    fn = "%s/slapd.conf-%s" % (outFolder, master.replace(":", "_"))
-    f = open(fn, 'a')
-    f.write(master_dict[master])
-    f.close()
+    if args.seed or args.snapshot:
+        snapshotFn = args.snapshot
+        if not snapshotFn:
+            snapshotFn = "%s/%s-snapshot.ldif" % (outFolder, r.suffix.replace('=', '_'))
+            print "Taking snapshot of %s to %s" % (r.suffix, snapshotFn)
+            r.makeSnapshot(snapshotFn)
+        csns = r.writeSeedScripts(outFolder, snapshotFn)
+        print "Snapshot contextCSN: %s" % ', '.join(csns)
+        print "Copy %s, slapd.conf-<slave> and seed-<slave>.sh to each slave and run the script there" % snapshotFn
 
-slave_dict = r.getSlaveConfigs()
-for slave in slave_dict.keys():
-    fn = "%s/slapd.conf-%s" % (outFolder, slave.replace(":", "_"))
-    f = open(fn, 'a')
-    f.write(slave_dict[slave])
-    f.close()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+"""Runs a throwaway slapd from a generated slapd.conf, for load tests and
+replication monitor tests which shouldn't touch the installed server.
+
+The configuration is copied with database directories, pid and args files
+moved to a temporary folder and TLS settings commented out, optional LDIF
+files are loaded with slapadd and slapd listens on plain LDAP on localhost.
+
+    with SlapdStandIn('/opt/symas/etc/openldap/slapd.conf', ['o_gluu.ldif']) as standIn:
+        conn = ldap.initialize(standIn.url)
+"""
+
+import os
+import re
+import time
+import errno
+import shutil
+import socket
+import tempfile
+import subprocess
+
+directory_re = re.compile(r'^(directory\s+)"?([^"\s]+)"?\s*$', re.M)
+runfile_re = re.compile(r'^((?:pidfile|argsfile)\s+)"?([^"\s]+)"?\s*$', re.M)
+tls_re = re.compile(r'^(TLS\w+\s.*)$', re.M)
+suffix_re = re.compile(r'^suffix\s+"?([^"\n]+?)"?\s*$', re.M)
+
+
+def rewrite_slapd_conf(text, workDir):
+    """Returns slapd.conf text with database directories, pid and args
+    files under workDir and TLS settings commented out, and the list of
+    database directories"""
+    directories = []
+
+    def moveDirectory(match):
+        directory = os.path.join(workDir, 'db%d' % len(directories))
+        directories.append(directory)
+        return '%s"%s"' % (match.group(1), directory)
+
+    text = directory_re.sub(moveDirectory, text)
+    text = runfile_re.sub(lambda match: '%s"%s"' % (match.group(1), os.path.join(workDir, os.path.basename(match.group(2)))), text)
+    text = tls_re.sub(r'#\1', text)
+    return text, directories
+
+
+def ldif_suffix(ldifFn, suffixes):
+    """Returns the database suffix the first entry of ldifFn belongs to"""
+    with open(ldifFn) as f:
+        for line in f:
+            if line.lower().startswith('dn:'):
+                dn = line[3:].strip().lower()
+                for suffix in sorted(suffixes, key=len, reverse=True):
+                    if dn == suffix.lower() or dn.endswith(',' + suffix.lower()):
+                        return suffix
+                break
+    return None
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class SlapdStandIn(object):
+    """ Temporary slapd started from a copy of slapd.conf """
+
+    def __init__(self, slapdConf, ldifFiles=(), port=None, slapd='/opt/symas/lib64/slapd',
+                 slapadd='/opt/symas/bin/slapadd', startTimeout=30, keep=False):
+        self.slapdConf = slapdConf
+        self.ldifFiles = list(ldifFiles)
+        self.port = port
+        self.slapd = slapd
+        self.slapadd = slapadd
+        self.startTimeout = startTimeout
+        self.keep = keep
+        self.workDir = None
+        self.confFn = None
+        self.process = None
+
+    @property
+    def url(self):
+        return 'ldap://127.0.0.1:%d/' % self.port
+
+    def prepare(self):
+        self.workDir = tempfile.mkdtemp(prefix='slapd-standin-')
+        with open(self.slapdConf) as f:
+            text, directories = rewrite_slapd_conf(f.read(), self.workDir)
+        for directory in directories:
+            os.makedirs(directory)
+        self.confFn = os.path.join(self.workDir, 'slapd.conf')
+        with open(self.confFn, 'w') as f:
+            f.write(text)
+
+        suffixes = suffix_re.findall(text)
+        for ldifFn in self.ldifFiles:
+            suffix = ldif_suffix(ldifFn, suffixes)
+            if not suffix:
+                raise ValueError("No database in %s for entries of %s" % (self.slapdConf, ldifFn))
+            subprocess.check_call([self.slapadd, '-q', '-f', self.confFn, '-b', suffix, '-l', ldifFn])
+
+    def start(self):
+        try:
+            self.prepare()
+            self.port = self.port or free_port()
+            with open(os.path.join(self.workDir, 'slapd.log'), 'w') as log:
+                self.process = subprocess.Popen([self.slapd, '-f', self.confFn, '-h', self.url, '-d', '0'],
+                                                stdout=log, stderr=subprocess.STDOUT)
+        except:
+            self.stop()
+            raise
+
+        deadline = time.time() + self.startTimeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("slapd exited with %d, see %s/slapd.log" % (self.process.returncode, self.workDir))
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return self
+            except socket.error:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("slapd did not listen on %s in %d seconds" % (self.url, self.startTimeout))
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            deadline = time.time() + 10
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.process.poll() is None:
+                try:
+                    self.process.kill()
+                except OSError, e:
+                    if e.errno != errno.ESRCH:
+                        raise
+                self.process.wait()
+        if self.workDir and not self.keep:
+            shutil.rmtree(self.workDir, True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, tb):
+        self.stop()
@@ -22,57 +22,241 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import sys, ldap, getpass
+"""Verifies LDAP credentials or existence of accounts in bulk.
+
+Accounts are looked up by uid with asynchronous searches pipelined over a
+pool of connections bound as the directory manager, credentials are then
+checked with binds over a pool of reused user connections.
+
+Usage: python testBind.py [uid password]
+       python testBind.py -f users.txt [-c 8] [--exists]
+       cat users.txt | python testBind.py -f -
+
+users.txt has uid:password lines, or just uids with --exists. Prints uid,
+result and DN of every account, then throughput and latency of searches
+and binds. Exits with 1 when any account failed.
+"""
+
+import sys
+import time
+import Queue
+import getpass
+import argparse
+import threading
+
+import ldap
+import ldap.filter
+
+from ldap_load_test import LatencyStats, read_users, print_report
 
 host = "localhost"
 port = 1636
 ssl = True
 bindDN = "cn=directory manager"
-bindPW = "$ Enter the password before running the script"
+bindPW = None
 base = "o=gluu"
-scope =  ldap.SCOPE_SUBTREE
-attrVal = None
-userPassword = None
+scope = ldap.SCOPE_SUBTREE
 attr = "uid"
 
-# GET THE ARGS / PROMPT FOR ARGS IF NONE PROVIDED
-try:
-    attrVal = sys.argv[1]
-    userPassword = sys.argv[2]
-except:
-    attrVal = raw_input("Enter %s: " % attr)
-    userPassword = getpass.getpass("Enter password: ")
-
-# CREAT THE FILTER: FOR EXAMPLE UID=*FOO* ; SUBSTRING SEARCH
-filter = "%s=*%s*" % (attr, attrVal)
-
-# SPECIFY SSL
-protocol = "ldap"
-if ssl:
-    options = [(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)]
-    ldap.set_option(*options[0])
-    protocol = "ldaps"
-
-l = ldap.initialize("%s://%s:%s" % (protocol, host, port))
-l.protocol_version = ldap.VERSION3
-l.simple_bind_s(bindDN, bindPW)
-res = l.search_s(base, scope, filter)
-l.unbind_s()
-
-if len(res)==0:
-    print "%s not found" % attrVal
-    sys.exit(1)
-
-if len(res)>1:
-    print "Non deterministic uid. Found:"
-    for tup in res:
-        print "\t%s" % tup[0]
-    sys.exit(2)
-
-dn = res[0][0]
-
-# IF ONLY 1 MATCH IS FOUND: PRINT DN AND BIND AS THAT USER WITH THE DN
-print "Binding as: %s" % dn
-l = ldap.initialize("%s://%s:%s" % (protocol, host, port))
-l.protocol_version = ldap.VERSION3
-l.simple_bind_s(dn, userPassword)
+
+class ConnectionPool(object):
+    """ Reusable connections, bound when they are made """
+
+    def __init__(self, url, size, bindDN=None, bindPW=None):
+        self.url = url
+        self.bindDN = bindDN
+        self.bindPW = bindPW
+        self.connections = Queue.Queue()
+        for i in range(size):
+            self.connections.put(None)
+
+    def connect(self):
+        conn = ldap.initialize(self.url)
+        conn.protocol_version = ldap.VERSION3
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        if self.bindDN:
+            conn.simple_bind_s(self.bindDN, self.bindPW)
+        return conn
+
+    def get(self):
+        return self.connections.get() or self.connect()
+
+    def put(self, conn):
+        self.connections.put(conn)
+
+    def discard(self, conn):
+        """Drops broken connection, a new one is made when needed. conn is
+        None when making the connection failed."""
+        if conn:
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+        self.connections.put(None)
+
+    def close(self):
+        while not self.connections.empty():
+            conn = self.connections.get()
+            if conn:
+                try:
+                    conn.unbind_s()
+                except ldap.LDAPError:
+                    pass
+
+
+def run_parallel(function, jobs, threads):
+    """Calls function for every job from threads threads"""
+    queue = Queue.Queue()
+    for job in jobs:
+        queue.put(job)
+
+    def work():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            function(job)
+
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def lookup(pool, uids, stats, window=100, threads=4):
+    """Returns dict of uid to list of DNs found. Searches are sent window at
+    a time on each pooled connection before their results are read."""
+    found = {}
+    chunks = [uids[i:i + window] for i in range(0, len(uids), window)]
+
+    def searchChunk(chunk):
+        conn = None
+        try:
+            conn = pool.get()
+            sent = []
+            for uid in chunk:
+                searchFilter = "(%s=%s)" % (attr, ldap.filter.escape_filter_chars(uid))
+                sent.append((uid, conn.search_ext(base, scope, searchFilter, ['1.1']), time.time()))
+            for uid, msgid, started in sent:
+                try:
+                    rtype, rdata, rmsgid, serverctrls = conn.result3(msgid)
+                    found[uid] = [dn for dn, entry in rdata if dn]
+                    stats.add('search', time.time() - started)
+                except ldap.NO_SUCH_OBJECT:
+                    found[uid] = []
+                    stats.add('search', time.time() - started)
+            pool.put(conn)
+        except ldap.LDAPError, e:
+            for uid in chunk:
+                if uid not in found:
+                    found[uid] = e
+                    stats.add('search', 0, False)
+            pool.discard(conn)
+
+    run_parallel(searchChunk, chunks, threads)
+    return found
+
+
+def verify(pool, credentials, stats, threads=4):
+    """Returns list with an item for every (DN, password) of credentials,
+    True when the password is valid, False when not or the LDAP error. The
+    same DN may be listed with several passwords."""
+    results = [None] * len(credentials)
+
+    def bind(job):
+        index, (dn, password) = job
+        conn = None
+        try:
+            # errors of pool.get() are recorded for this DN too, the pool
+            # makes the connection again for the next one
+            conn = pool.get()
+            started = time.time()
+            try:
+                conn.simple_bind_s(dn, password)
+                results[index] = True
+            except ldap.INVALID_CREDENTIALS:
+                results[index] = False
+            stats.add('bind', time.time() - started)
+            pool.put(conn)
+        except ldap.LDAPError, e:
+            results[index] = e
+            stats.add('bind', 0, False)
+            pool.discard(conn)
+
+    run_parallel(bind, list(enumerate(credentials)), threads)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify LDAP credentials or accounts in bulk")
+    parser.add_argument('uid', nargs='?')
+    parser.add_argument('password', nargs='?')
+    parser.add_argument('-f', '--file', help="file with uid:password lines, - for stdin")
+    parser.add_argument('-H', '--url', default="%s://%s:%s" % ('ldaps' if ssl else 'ldap', host, port))
+    parser.add_argument('-D', '--bind-dn', default=bindDN)
+    parser.add_argument('-w', '--bind-pw', default=bindPW, help="prompted for when not given")
+    parser.add_argument('-c', '--connections', type=int, default=4, help="connections per pool")
+    parser.add_argument('--window', type=int, default=100, help="searches in flight per connection")
+    parser.add_argument('--exists', action='store_true', help="only check that accounts exist")
+    args = parser.parse_args(argv)
+
+    if args.file:
+        users = read_users(sys.stdin if args.file == '-' else open(args.file))
+    elif args.uid:
+        users = [(args.uid, args.password or '')]
+    else:
+        users = [(raw_input("Enter %s: " % attr), getpass.getpass("Enter password: "))]
+    if not users:
+        parser.error("No accounts to check")
+
+    if args.url.startswith('ldaps'):
+        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+    adminPW = args.bind_pw or getpass.getpass("Password of %s: " % args.bind_dn)
+
+    stats = LatencyStats()
+    started = time.time()
+    searchPool = ConnectionPool(args.url, args.connections, args.bind_dn, adminPW)
+    bindPool = ConnectionPool(args.url, args.connections)
+    try:
+        found = lookup(searchPool, [uid for uid, password in users], stats, args.window, args.connections)
+
+        # bind results are kept per line of users, a uid may be listed twice
+        checked = []
+        if not args.exists:
+            checked = [index for index, (uid, password) in enumerate(users)
+                       if isinstance(found.get(uid), list) and len(found[uid]) == 1]
+        results = verify(bindPool, [(found[users[index][0]][0], users[index][1]) for index in checked],
+                         stats, args.connections)
+        bound = dict(zip(checked, results))
+    finally:
+        searchPool.close()
+        bindPool.close()
+    elapsed = time.time() - started
+
+    failed = 0
+    for index, (uid, password) in enumerate(users):
+        dns = found.get(uid)
+        if not isinstance(dns, list):
+            result, dn = "error: %s" % dns, ''
+        elif not dns:
+            result, dn = 'not found', ''
+        elif len(dns) > 1:
+            result, dn = 'ambiguous', ' '.join(dns)
+        else:
+            dn = dns[0]
+            result = 'exists' if args.exists else {True: 'ok', False: 'invalid credentials'}.get(bound.get(index),
+                                                                                                   "error: %s" % bound.get(index))
+        if result not in ('ok', 'exists'):
+            failed += 1
+        print "%s\t%s\t%s" % (uid, result, dn)
+
+    sys.stderr.write("%d accounts, %d failed, %.1f accounts/sec\n" % (len(users), failed, len(users) / elapsed if elapsed else 0))
+    print_report(stats, elapsed, sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
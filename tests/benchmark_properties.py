@@ -0,0 +1,156 @@
+"""Compares the Properties parser with the one it replaced.
+
+Parses a generated setup.properties.last, as written by
+Setup.save_properties, many times with both parsers, checks they give the
+same properties and prints the time each took.
+
+Usage: python tests/benchmark_properties.py [-n 2000] [-k 300]
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Properties
+
+
+class LegacyProperties(Properties.Properties):
+    """ The parser of Properties before the single pass tokenizer """
+
+    def __init__(self):
+        Properties.Properties.__init__(self)
+        self.othercharre = re.compile(r'(?<!\\)(\s*\=)|(?<!\\)(\s*\:)')
+        self.othercharre2 = re.compile(r'(\s*\=)|(\s*\:)')
+        self.bspacere = re.compile(r'\\(?!\s$)')
+
+    def load(self, stream):
+        self.parse(stream.readlines())
+
+    def parse(self, lines):
+        i = iter(lines)
+        for line in i:
+            line = line.strip()
+            if not line: continue
+            if line[0] == '#': continue
+            sepidx = -1
+            m = self.othercharre.search(line)
+            if m:
+                first, last = m.span()
+                start, end = 0, first
+                wspacere = re.compile(r'(?<![\\\=\:])(\s)')
+            else:
+                if self.othercharre2.search(line):
+                    wspacere = re.compile(r'(?<![\\])(\s)')
+                start, end = 0, len(line)
+
+            m2 = wspacere.search(line, start, end)
+            if m2:
+                first, last = m2.span()
+                sepidx = first
+            elif m:
+                first, last = m.span()
+                sepidx = last - 1
+
+            while line[-1] == '\\':
+                nextline = i.next()
+                nextline = nextline.strip()
+                line = line[:-1] + nextline
+
+            if sepidx != -1:
+                key, value = line[:sepidx], line[sepidx+1:]
+            else:
+                key,value = line,''
+
+            self.processPair(key, value)
+
+    def processPair(self, key, value):
+        oldkey = key
+        oldvalue = value
+        keyparts = self.bspacere.split(key)
+        strippable = False
+        lastpart = keyparts[-1]
+        if lastpart.find('\\ ') != -1:
+            keyparts[-1] = lastpart.replace('\\','')
+        elif lastpart and lastpart[-1] == ' ':
+            strippable = True
+        key = ''.join(keyparts)
+        if strippable:
+            key = key.strip()
+            oldkey = oldkey.strip()
+        oldvalue = oldvalue.replace('\\:',':').replace('\\=','=')
+        value = value.replace('\\:',':').replace('\\=','=')
+        self._props[key] = value.strip()
+        if self._keymap.has_key(key):
+            oldkey = self._keymap.get(key)
+            self._origprops[oldkey] = oldvalue.strip()
+        else:
+            self._origprops[oldkey] = oldvalue.strip()
+            self._keymap[key] = oldkey
+
+    def getTypedDict(self, types=(bool,)):
+        # what Setup.load_properties did key by key
+        typed = {}
+        for prop in self._props.keys():
+            typed[prop] = self._props[prop]
+            if typed[prop] == 'True':
+                typed[prop] = True
+            elif typed[prop] == 'False':
+                typed[prop] = False
+        return typed
+
+
+def write_properties(fn, keys):
+    """Writes a properties file like Setup.save_properties does"""
+    p = Properties.Properties()
+    for n in range(keys):
+        if n % 3 == 0:
+            p['install%d' % n] = str(n % 2 == 0)
+        elif n % 3 == 1:
+            p['url%d' % n] = 'https://idp.example.org:8443/oxauth?x=%d' % n
+        else:
+            p['folder%d' % n] = '/opt/gluu/jetty/folder%d' % n
+    p.store(open(fn, 'w'), 'setup.properties.last')
+
+
+def measure(cls, fn, runs):
+    started = time.time()
+    for _ in xrange(runs):
+        p = cls()
+        with open(fn) as f:
+            p.load(f)
+        result = p.getTypedDict((bool,))
+    return time.time() - started, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the Properties parser")
+    parser.add_argument('-n', '--runs', type=int, default=2000, help="number of files parsed")
+    parser.add_argument('-k', '--keys', type=int, default=300, help="number of properties per file")
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmp_dir, 'setup.properties.last')
+        write_properties(fn, args.keys)
+        legacy, expected = measure(LegacyProperties, fn, args.runs)
+        current, result = measure(Properties.Properties, fn, args.runs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if result != expected:
+        print "Parsers disagree"
+        return 1
+    print "%d files of %d properties" % (args.runs, args.keys)
+    print "  previous parser %8.3f s" % legacy
+    print "  Properties      %8.3f s  %.1fx faster" % (current, legacy / current)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
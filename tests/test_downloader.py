@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
+
+from Downloader import Downloader, DownloadError
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves server.files, supports Range requests and counts requests"""
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        self.server.requests.append((self.command, self.path, self.headers.getheader('Range')))
+        content = self.server.files.get(self.path)
+        if content == None:
+            self.send_error(404)
+            return
+
+        start = 0
+        rangeHeader = self.headers.getheader('Range')
+        if rangeHeader and rangeHeader.startswith('bytes='):
+            start = int(rangeHeader[6:].split('-')[0])
+            if start >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', '"%s"' % hashlib.md5(content).hexdigest())
+        self.end_headers()
+        if body:
+            self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(files):
+    server = LocalServer(('127.0.0.1', 0), RangeHandler)
+    server.files = files
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def test_downloader():
+    war = os.urandom(700000)
+    jar = os.urandom(1000)
+    files = {'/oxauth.war': war,
+             '/oxauth.war.sha1': hashlib.sha1(war).hexdigest() + '  oxauth.war\n',
+             '/bad.war': war,
+             '/bad.war.sha1': hashlib.sha1('other').hexdigest(),
+             '/key.jar': jar}
+    server, base = start_server(files)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        downloader = Downloader(os.path.join(tmp_dir, 'cache'), tries=2)
+        downloader.retryDelay = 0
+
+        results = downloader.fetchAll([{'url': base + '/oxauth.war', 'dest': os.path.join(tmp_dir, 'dist', 'oxauth.war')},
+                                       {'url': base + '/key.jar', 'dest': os.path.join(tmp_dir, 'dist', 'key.jar')},
+                                       {'url': base + '/bad.war', 'dest': os.path.join(tmp_dir, 'dist', 'bad.war')}])
+        assert_equal(results[0], (hashlib.sha1(war).hexdigest(), True))
+        assert_equal(results[1], (hashlib.sha1(jar).hexdigest(), True))
+        assert_true(isinstance(results[2], DownloadError))
+        assert_false(os.path.exists(os.path.join(tmp_dir, 'dist', 'bad.war')))
+        with open(os.path.join(tmp_dir, 'dist', 'oxauth.war'), 'rb') as f:
+            assert_equal(f.read(), war)
+
+        # cached files are not downloaded again
+        del server.requests[:]
+        os.remove(os.path.join(tmp_dir, 'dist', 'oxauth.war'))
+        assert_equal(downloader.fetch(base + '/oxauth.war', os.path.join(tmp_dir, 'dist', 'oxauth.war'))[1], False)
+        assert_equal(downloader.fetch(base + '/key.jar', os.path.join(tmp_dir, 'dist', 'key.jar'))[1], False)
+        assert_equal([request[:2] for request in server.requests],
+                     [('GET', '/oxauth.war.sha1'), ('GET', '/key.jar.sha1'), ('HEAD', '/key.jar')])
+        with open(os.path.join(tmp_dir, 'dist', 'oxauth.war'), 'rb') as f:
+            assert_equal(f.read(), war)
+
+        # interrupted download is resumed with a range request
+        files['/new.war'] = war[::-1]
+        partial = downloader.partialPath(base + '/new.war')
+        with open(partial, 'wb') as f:
+            f.write(war[::-1][:300000])
+        del server.requests[:]
+        sha1, downloaded = downloader.fetch(base + '/new.war', os.path.join(tmp_dir, 'dist', 'new.war'), hashlib.sha1(war[::-1]).hexdigest())
+        assert_true(downloaded)
+        assert_equal(server.requests, [('GET', '/new.war', 'bytes=300000-')])
+        with open(os.path.join(tmp_dir, 'dist', 'new.war'), 'rb') as f:
+            assert_equal(f.read(), war[::-1])
+        assert_false(os.path.exists(partial))
+
+        assert_raises(DownloadError, downloader.fetch, base + '/missing.war', os.path.join(tmp_dir, 'missing.war'))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp_dir)
@@ -1,5 +1,5 @@
 from nose.tools import assert_true, assert_equal, assert_is_none, assert_false
-from setup import getOpts
+from setup import getOpts, SetupProfiler
 
 
 def test_getOpts():
@@ -66,3 +66,26 @@ def test_getOpts():
 
     setupOptions = getOpts(['-w'], setupOptions)
     assert_true(setupOptions['downloadWars'])
+
+
+def test_setup_profiler():
+    class Dummy(object):
+        def step(self):
+            return 'done'
+
+        def logIt(self, msg):
+            pass
+
+    profiler = SetupProfiler()
+    profiler.instrument(Dummy)
+    obj = Dummy()
+    obj.profiler = profiler
+
+    assert_equal(obj.step(), 'done')
+    obj.logIt('not recorded')
+    token = profiler.begin('true', 'command', {'cmd': '/bin/true'})
+    profiler.end(token)
+
+    assert_equal([e['name'] for e in profiler.events], ['step', 'true'])
+    assert_equal(profiler.events[1]['args']['cmd'], '/bin/true')
+    assert_true('step' in profiler.summary())
@@ -0,0 +1,39 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+import genSchemaMarkdown
+
+
+def test_published_markdown_layout():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ldif_fn = os.path.join(tmp_dir, '101-test.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write("dn: cn=schema\nobjectClass: top\ncn: schema\n"
+                    "attributeTypes: ( 1.2.3.1 NAME ( 'oxAssociatedClient' 'associatedClient' )\n"
+                    "  DESC 'Client of a person' )\n"
+                    "attributeTypes: ( 1.2.3.3 NAME 'oxId' )\n"
+                    "objectClasses: ( 1.2.3.2 NAME 'oxTest' DESC 'Test entry'\n  SUP ( top )\n  STRUCTURAL\n"
+                    "  MAY ( oxId $ associatedClient ) )\n"
+                    "objectClasses: ( 1.2.3.4 NAME 'gluuTest'\n  SUP ( top )\n  AUXILIARY\n"
+                    "  MAY ( cn ) )\n")
+        md_fn = os.path.join(tmp_dir, 'schema.md')
+        genSchemaMarkdown.main([ldif_fn, '-o', md_fn])
+        with open(md_fn) as f:
+            assert_equal(f.read(), "### Objectclass gluuTest\n"
+                                   " * __Description__ \n"
+                                   " * __cn__ \n"
+                                   "\n"
+                                   "### Objectclass oxTest\n"
+                                   " * __Description__ Test entry\n"
+                                   " * __oxId__ \n"
+                                   " * __associatedClient__ Client of a person\n"
+                                   "\n")
+    finally:
+        shutil.rmtree(tmp_dir)
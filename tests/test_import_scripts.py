@@ -0,0 +1,60 @@
+import os
+import sys
+import imp
+import types
+import logging
+import shutil
+import tempfile
+
+from nose.tools import assert_true
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+scripts_dir = os.path.join(root_dir, 'static', 'scripts')
+
+
+def load_script(name):
+    """Loads a script of static/scripts from another working folder with
+    the setup folder off sys.path, the way it runs during an upgrade"""
+    saved_path = sys.path[:]
+    saved_modules = dict(sys.modules)
+    saved_handlers = logging.getLogger('').handlers[:]
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # python-ldap's ldif module is the only one expected on sys.path
+        import ldif
+        sys.path[:] = [p for p in sys.path if os.path.abspath(p or '.') != root_dir]
+        for module in ('TreeSync', 'PermissionPlan'):
+            sys.modules.pop(module, None)
+        try:
+            import jsonmerge
+        except ImportError:
+            sys.modules['jsonmerge'] = types.ModuleType('jsonmerge')
+            sys.modules['jsonmerge'].merge = lambda base, head: head
+        os.chdir(tmp_dir)
+        return imp.load_source(name, os.path.join(scripts_dir, '%s.py' % name))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+        root = logging.getLogger('')
+        for handler in root.handlers[:]:
+            if handler not in saved_handlers:
+                root.removeHandler(handler)
+                handler.close()
+        sys.path[:] = saved_path
+        sys.modules.clear()
+        sys.modules.update(saved_modules)
+
+
+def test_import30_finds_setup_modules():
+    module = load_script('import30')
+    assert_true(module.TreeSync is not None)
+    assert_true(module.PermissionPlan is not None)
+    assert_true(module.LDIFValidator is not None)
+
+
+def test_import2431_finds_setup_modules():
+    module = load_script('import2431')
+    assert_true(module.TreeSync is not None)
+    assert_true(module.PermissionPlan is not None)
+    assert_true(module.LDIFValidator is not None)
@@ -0,0 +1,56 @@
+import os
+import sys
+
+from nose.tools import assert_equal, assert_raises
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from index_advisor import (parse_filter, read_ldif, DirectoryStats, Workload, IndexAdvisor, FilterError,
+                           load_indexes, updated_index_doc)
+
+
+def test_parse_filter():
+    assert_equal(parse_filter('(&(objectClass=oxAuthClient)(!(cn=a\\2ab*))(|(uid=*)(mail~=x)))'),
+                 ('and', [('item', 'objectClass', 'eq', 'oxAuthClient'),
+                          ('not', ('item', 'cn', 'subinitial', 'a*b')),
+                          ('or', [('item', 'uid', 'pres', None), ('item', 'mail', 'approx', 'x')])]))
+    assert_equal(parse_filter('oxAuthExpiration<=20170101000000Z'),
+                 ('item', 'oxAuthExpiration', 'le', '20170101000000Z'))
+    assert_raises(FilterError, parse_filter, '(&(uid=a)')
+
+
+def test_read_ldif():
+    lines = ['version: 1\n', 'dn: o=gluu\n', 'objectClass: top\n', '\n',
+             'dn: inum=1,ou=clients,\n', ' o=gluu\n', 'displayName:: Y2xpZW50\n']
+    assert_equal(list(read_ldif(lines)), [('o=gluu', [('objectClass', 'top')]),
+                                          ('inum=1,ou=clients,o=gluu', [('displayName', 'client')])])
+
+
+def test_index_advisor():
+    stats = DirectoryStats()
+    stats.addEntry('ou=clients,o=gluu', [('objectClass', 'organizationalUnit')])
+    for i in range(1000):
+        stats.addEntry('inum=%d,ou=clients,o=gluu' % i, [('objectClass', 'oxAuthClient'),
+                                                         ('oxAuthClientId', 'client%d' % i),
+                                                         ('oxAuthLogoutURI', 'https://rp/logout')])
+
+    workload = Workload()
+    for i in range(50):
+        workload.addSearch('(&(objectClass=oxAuthClient)(oxAuthClientId=client%d))' % i, 'ou=clients,o=gluu', '2')
+    workload.readStatsLog(['conn=1 op=2 SRCH base="o=gluu" scope=2 deref=0 filter="(oxAuthLogoutURI=x)"\n',
+                           'conn=1 op=3 MOD attr=oxAuthLogoutURI\n'])
+    assert_equal(sum(workload.searches.values()), 51)
+    assert_equal(workload.writes['oxauthlogouturi'], 1)
+
+    doc = {'indexes': [{'attribute': 'objectClass', 'index': 'eq'}, {'attribute': 'mail', 'index': 'eq'}]}
+    advisor = IndexAdvisor(workload, stats, load_indexes(doc))
+    assert_equal(advisor.totalCost(advisor.indexes), 50 * 1000 + 1001)
+
+    recommendations = advisor.advise()
+    assert_equal([(r['name'], r['index']) for r in recommendations], [('oxAuthClientId', 'eq')])
+    assert_equal(recommendations[0]['saved'], 50 * 999)
+    assert_equal(advisor.unused(), ['mail'])
+
+    updated = updated_index_doc(doc, recommendations, advisor.unused())
+    assert_equal(updated['indexes'], [{'attribute': 'objectClass', 'index': 'eq'},
+                                      {'attribute': 'oxAuthClientId', 'index': 'eq'}])
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import types
+import shutil
+import tempfile
+
+from StringIO import StringIO
+
+from nose.tools import assert_equal, assert_true
+
+
+class JavaString(str):
+    def toCharArray(self):
+        return list(self)
+
+
+class ByteArrayOutputStream(object):
+    def __init__(self):
+        self.data = []
+
+    def toString(self):
+        return ''.join(self.data)
+
+
+class PrintStream(object):
+    def __init__(self, out, autoFlush=False):
+        self.out = out
+
+    def println(self, text):
+        self.out.data.append('%s\n' % text)
+
+    def flush(self):
+        pass
+
+
+class SecurityException(Exception):
+    def getMessage(self):
+        return self.args[0]
+
+
+class System(object):
+    out = None
+    err = None
+
+    @classmethod
+    def setOut(cls, stream):
+        cls.out = stream
+
+    @classmethod
+    def setErr(cls, stream):
+        cls.err = stream
+
+
+class KeyStore(object):
+    @staticmethod
+    def getInstance(kind):
+        return KeyStore()
+
+    def load(self, stream, password):
+        pass
+
+    def store(self, out, password):
+        out.write('JKS')
+
+
+class FileOutputStream(object):
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+
+    def write(self, data):
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+
+class KeyGenerator(object):
+    calls = []
+
+    @classmethod
+    def main(cls, args):
+        cls.calls.append(list(args))
+        if '-expiration' in args and args[args.index('-expiration') + 1] == '0':
+            System.err.println('expiration must be positive')
+            raise SecurityException('exit 1')
+        System.out.println('{"keys": []}')
+        raise SecurityException('exit 0')
+
+
+def install_java_stubs():
+    modules = {
+        'jarray': {'array': lambda values, kind: list(values)},
+        'java': {},
+        'java.io': {'ByteArrayOutputStream': ByteArrayOutputStream, 'FileOutputStream': FileOutputStream,
+                    'PrintStream': PrintStream},
+        'java.lang': {'SecurityException': SecurityException, 'SecurityManager': object,
+                      'String': JavaString, 'System': System, 'Throwable': Exception},
+        'java.security': {'KeyStore': KeyStore},
+        'org': {},
+        'org.xdi': {},
+        'org.xdi.oxauth': {},
+        'org.xdi.oxauth.util': {'KeyExporter': KeyGenerator, 'KeyGenerator': KeyGenerator},
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+def test_daemon_loop_with_stub_keygenerator():
+    install_java_stubs()
+    System.out = PrintStream(ByteArrayOutputStream())
+    System.err = PrintStream(ByteArrayOutputStream())
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+    try:
+        import keygen_daemon
+    finally:
+        sys.path.pop(0)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        keystore = os.path.join(tmp_dir, 'scim-rs.jks')
+        genkeys = {'action': 'genkeys', 'keystore': keystore, 'password': 'secret',
+                   'algorithms': 'RS256', 'dnname': 'CN=oxAuth', 'expiration': 365}
+        requests = StringIO('\n'.join([
+            json.dumps(dict(genkeys, id=0)),
+            '',
+            json.dumps(dict(genkeys, id=1, expiration=0, create=False)),
+            json.dumps({'id': 2, 'action': 'unknown'}),
+            'not json',
+            json.dumps({'id': 3, 'action': 'quit'}),
+            json.dumps(dict(genkeys, id=4)),
+        ]) + '\n')
+        out = ByteArrayOutputStream()
+        keygen_daemon.serve(requests, PrintStream(out))
+
+        responses = [json.loads(line) for line in out.toString().splitlines()]
+        assert_equal([(r.get('id'), r['status']) for r in responses],
+                     [(0, 'ok'), (1, 'error'), (2, 'error'), (None, 'error')])
+        assert_equal(responses[0]['output'], '{"keys": []}\n')
+        assert_equal(responses[1]['error'], 'expiration must be positive\n')
+        assert_equal(responses[2]['error'], 'Unknown action unknown')
+        assert_equal(open(keystore).read(), 'JKS')
+        assert_equal(KeyGenerator.calls[0], ['-keystore', keystore, '-keypasswd', 'secret', '-algorithms', 'RS256',
+                                             '-dnname', 'CN=oxAuth', '-expiration', '365'])
+        # stdout of the utilities is restored after every call
+        assert_true(System.out is keygen_daemon.stdout)
+    finally:
+        shutil.rmtree(tmp_dir)
+        for name in ['keygen_daemon', 'jarray', 'java', 'java.io', 'java.lang', 'java.security',
+                     'org', 'org.xdi', 'org.xdi.oxauth', 'org.xdi.oxauth.util']:
+            sys.modules.pop(name, None)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+from nose.tools import assert_equal, assert_raises
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from ldap_load_test import parse_mix, percentile, read_users, LatencyStats, DEFAULT_MIX
+
+
+def test_parse_mix():
+    assert_equal(parse_mix(DEFAULT_MIX), {'client_lookup': 35.0, 'token_lookup': 20.0, 'user_bind': 15.0,
+                                          'token_add': 15.0, 'session_modify': 15.0})
+    assert_equal(parse_mix(' client_lookup=3, token_add '), {'client_lookup': 3.0, 'token_add': 1.0})
+    assert_raises(ValueError, parse_mix, 'client_lookup=1,delete_all=2')
+    assert_raises(ValueError, parse_mix, 'client_lookup=many')
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert_equal(percentile([], 50), 0.0)
+    assert_equal(percentile([7.0], 99), 7.0)
+    assert_equal(percentile(values, 0), 1.0)
+    assert_equal(percentile(values, 50), 50.0)
+    assert_equal(percentile(values, 95), 95.0)
+    assert_equal(percentile(values, 99), 99.0)
+    assert_equal(percentile(values, 100), 100.0)
+    assert_equal(percentile([1.0, 2.0, 3.0], 50), 2.0)
+
+
+def test_read_users():
+    assert_equal(read_users(['# uid:password\n', 'admin:se:cret\r\n', '\n', 'user']),
+                 [('admin', 'se:cret'), ('user', '')])
+
+
+def test_latency_stats():
+    first = LatencyStats()
+    for seconds in (0.001, 0.003, 0.002):
+        first.add('client_lookup', seconds)
+    first.add('user_bind', 0.010, False)
+    second = LatencyStats()
+    second.add('client_lookup', 0.004)
+    second.add('user_bind', 0.020)
+    second.add('user_bind', 0.030, False)
+
+    first.merge(second)
+    rows = first.report(2.0)
+    assert_equal([row[0] for row in rows], ['client_lookup', 'user_bind', 'total'])
+    name, ops, rate, p50, p95, p99, errors = rows[0]
+    assert_equal((ops, rate, errors), (4, 2.0, 0))
+    assert_equal((round(p50, 6), round(p95, 6), round(p99, 6)), (2.0, 4.0, 4.0))
+    assert_equal(rows[1][1:3] + rows[1][6:], (1, 0.5, 2))
+    assert_equal(rows[2][1:3] + rows[2][6:], (5, 2.5, 2))
+    assert_equal(round(rows[2][5], 6), 20.0)
+
+    # no elapsed time reports no rate instead of failing
+    assert_equal(LatencyStats().report(0), [('total', 0, 0.0, 0.0, 0.0, 0.0, 0)])
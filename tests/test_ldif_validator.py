@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from ldif_validator import LDIFValidator, SchemaRules, parse_entry, schema_files
+from model import SchemaModel
+
+SCHEMA = {
+    'oidMacros': {},
+    'attributeTypes': [
+        {'oid': '2.5.4.0', 'names': ['objectClass']},
+        {'oid': '2.5.4.3', 'names': ['cn', 'commonName']},
+        {'oid': '2.5.4.4', 'names': ['sn', 'surname']},
+        {'oid': '0.9.2342.19200300.100.1.1', 'names': ['uid', 'userid']},
+        {'oid': '1.2.3.1', 'names': ['oxId']},
+    ],
+    'objectClasses': [
+        {'oid': '2.5.6.0', 'names': ['top'], 'kind': 'ABSTRACT', 'must': ['objectClass']},
+        {'oid': '2.5.6.6', 'names': ['person'], 'kind': 'STRUCTURAL', 'sup': ['top'],
+         'must': ['sn', 'cn']},
+        {'oid': '1.2.3.2', 'names': ['gluuPerson'], 'kind': 'AUXILIARY', 'sup': ['top'],
+         'may': ['uid', 'oxId']},
+    ],
+}
+
+
+def test_rules_are_memoized_per_objectclass_set():
+    rules = SchemaRules(SchemaModel(SCHEMA))
+    first = rules.objectclassRules(['top', 'person', 'gluuPerson'])
+    assert_true(rules.objectclassRules(['GluuPerson', 'person', 'top']) is first)
+    assert_equal(first['must'], set(['objectclass', 'cn', 'sn']))
+    assert_equal(rules.superclasses('person'), set(['person', 'top']))
+
+    dn, entry = parse_entry("dn: uid=a,o=gluu\nobjectClass: top\nobjectClass: person\n"
+                            "objectClass: gluuPerson\ncommonName: A\nsurname: B\nuid: a\n"
+                            "entryUUID: 1\n")
+    assert_equal(rules.check(entry), [])
+    dn, entry = parse_entry("dn: uid=b,o=gluu\nobjectClass: top\nobjectClass: gluuPerson\n"
+                            "uid: b\nmail: b@example.com\n")
+    assert_equal(rules.check(entry), ['no structural objectClass', 'undefined attribute type mail'])
+    dn, entry = parse_entry("dn: uid=c,o=gluu\nobjectClass: top\nobjectClass: person\ncn: C\nuid: c\n")
+    assert_equal(rules.check(entry), ['attribute uid not allowed', 'missing required attribute sn'])
+
+
+def test_validate_writes_rejects():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        schema_fn = os.path.join(tmp_dir, 'test.json')
+        with open(schema_fn, 'w') as f:
+            json.dump(SCHEMA, f)
+        conf_fn = os.path.join(tmp_dir, 'slapd.conf')
+        with open(conf_fn, 'w') as f:
+            f.write('include\t\t"%s"\n#include\t\t"/opt/symas/etc/openldap/schema/misc.schema"\n'
+                    % os.path.join(tmp_dir, 'core.schema'))
+        assert_equal(schema_files(conf_fn), [os.path.join(tmp_dir, 'core.schema')])
+
+        ldif_fn = os.path.join(tmp_dir, 'o_gluu.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write("version: 1\n\n")
+            for i in range(50):
+                f.write("dn: uid=user%d,o=gluu\nobjectClass: top\nobjectClass: person\ncn: u\nsn: u\n\n" % i)
+            f.write("dn: uid=bad,o=gluu\nobjectClass: top\nobjectClass: person\ncn: u\n oxId: 1\n")
+
+        for processes in (1, 2):
+            stats = LDIFValidator([schema_fn], processes).validate(ldif_fn)
+            assert_equal((stats['entries'], stats['rejected']), (51, 1))
+            with open(stats['rejects']) as f:
+                assert_equal(f.read(), "# line 303: missing required attribute sn\n"
+                                       "dn: uid=bad,o=gluu\nobjectClass: top\nobjectClass: person\ncn: u\n oxId: 1\n\n")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_system_schema_is_built_in():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # core.schema of OpenLDAP leaves out top, alias and objectClass, slapd has them built in
+        core = dict(SCHEMA, attributeTypes=SCHEMA['attributeTypes'][1:], objectClasses=SCHEMA['objectClasses'][1:])
+        core_fn = os.path.join(tmp_dir, 'core.json')
+        with open(core_fn, 'w') as f:
+            json.dump(core, f)
+        # gluu.schema is generated from gluu_schema.json, .schema files need python-ldap
+        gluu_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schema', 'gluu_schema.json')
+
+        ldif_fn = os.path.join(tmp_dir, 'o_gluu.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write("dn: uid=a,o=gluu\nobjectClass: top\nobjectClass: person\ncn: A\nsn: A\n\n"
+                    "dn: inum=1,o=gluu\nobjectClass: top\nobjectClass: gluuPerson\n"
+                    "inum: 1\nuid: b\ncn: B\n\n"
+                    "dn: uid=c,ou=people,o=gluu\nobjectClass: alias\nobjectClass: extensibleObject\n"
+                    "aliasedObjectName: uid=a,o=gluu\nuid: c\n\n"
+                    "dn: ou=missing,o=gluu\nobjectClass: top\nobjectClass: glue\n\n"
+                    "dn: uid=d,o=gluu\nobjectClass: alias\n")
+
+        stats = LDIFValidator([core_fn, gluu_fn], 1).validate(ldif_fn)
+        assert_equal((stats['entries'], stats['rejected']), (5, 1))
+        with open(stats['rejects']) as f:
+            assert_equal(f.read(), "# line 24: missing required attribute aliasedobjectname\n"
+                                   "dn: uid=d,o=gluu\nobjectClass: alias\n\n")
+    finally:
+        shutil.rmtree(tmp_dir)
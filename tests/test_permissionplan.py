@@ -0,0 +1,85 @@
+import os
+import shutil
+import stat
+import tempfile
+
+from nose.tools import assert_equal, assert_raises
+from mock import patch
+
+from PermissionPlan import PermissionPlan, apply_symbolic_mode
+
+
+def mode(path):
+    return stat.S_IMODE(os.lstat(path).st_mode)
+
+
+def test_apply_symbolic_mode():
+    assert_equal(apply_symbolic_mode(0440, 'u+w'), 0640)
+    assert_equal(apply_symbolic_mode(0440, 'a+X'), 0440)
+    assert_equal(apply_symbolic_mode(0440, 'a+X', isDir=True), 0551)
+    assert_equal(apply_symbolic_mode(0640, 'ug=rw,o-rwx'), 0660)
+    assert_equal(apply_symbolic_mode(0700, 'ga+w'), 0722)
+    assert_raises(ValueError, apply_symbolic_mode, 0700, 'u*w')
+
+
+def test_permission_plan():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmp_dir, 'certs', 'sub'))
+        for fn in ['certs/a.key', 'certs/sub/b.sh', 'certs/sub/c.txt']:
+            open(os.path.join(tmp_dir, fn), 'w').close()
+            os.chmod(os.path.join(tmp_dir, fn), 0600)
+        os.chmod(os.path.join(tmp_dir, 'certs', 'sub'), 0700)
+        certs = os.path.join(tmp_dir, 'certs')
+        owner = '%d:%d' % (os.getuid(), os.getgid())
+
+        plan = PermissionPlan(dryRun=True)
+        plan.add(certs, owner=owner, mode={0700: 0755, 0600: 0644}, recursive=True)
+        plan.add(os.path.join(certs, 'sub'), mode=0755, recursive=True, pattern='*.sh')
+        plan.add(os.path.join(tmp_dir, 'missing'), mode=0644)
+        changes = plan.apply()
+
+        # dry run only reports changes
+        assert_equal(mode(os.path.join(certs, 'a.key')), 0600)
+        assert_equal(sorted((os.path.relpath(path, tmp_dir), wanted[2]) for path, current, wanted in changes),
+                     [('certs/a.key', 0644), ('certs/sub', 0755), ('certs/sub/b.sh', 0755), ('certs/sub/c.txt', 0644)])
+
+        plan.dryRun = False
+        plan.apply()
+        assert_equal(mode(os.path.join(certs, 'a.key')), 0644)
+        assert_equal(mode(os.path.join(certs, 'sub', 'b.sh')), 0755)
+        assert_equal(mode(os.path.join(certs, 'sub', 'c.txt')), 0644)
+
+        # nothing left to change
+        assert_equal(plan.apply(), [])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_permission_plan_skips_vanished_paths():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmp_dir, 'conf'))
+        for fn in ['a.conf', 'b.conf']:
+            open(os.path.join(tmp_dir, 'conf', fn), 'w').close()
+            os.chmod(os.path.join(tmp_dir, 'conf', fn), 0600)
+        os.symlink(os.path.join(tmp_dir, 'missing'), os.path.join(tmp_dir, 'dangling'))
+        vanished = os.path.join(tmp_dir, 'conf', 'a.conf')
+
+        plan = PermissionPlan()
+        plan.add(os.path.join(tmp_dir, 'dangling'), mode=0644)
+        plan.add(os.path.join(tmp_dir, 'conf'), mode={0600: 0644}, recursive=True)
+        # a.conf is removed after the walk listed it
+        lstat = os.lstat
+
+        def vanishing_lstat(path):
+            if path == vanished:
+                raise OSError(2, 'No such file or directory')
+            return lstat(path)
+
+        with patch('os.lstat', vanishing_lstat):
+            changes = plan.apply()
+        assert_equal([os.path.relpath(path, tmp_dir) for path, current, wanted in changes], ['conf/b.conf'])
+        assert_equal(mode(os.path.join(tmp_dir, 'conf', 'b.conf')), 0644)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_raises
+
+import Properties
+
+
+def load(text):
+    fd, fn = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        p = Properties.Properties()
+        with open(fn) as f:
+            p.load(f)
+        return p
+    finally:
+        os.remove(fn)
+
+
+def test_parse_separators_and_escapes():
+    p = load("# comment\n"
+             "key1     value\n"
+             "key2=value\n"
+             "key3:value\n"
+             "key4 = value1 value2\n"
+             "This key= this value\n"
+             "key5     value1,value2, \\\n"
+             "         value3\n"
+             "key6\n"
+             "url=https\\://idp.example.org\\:8443/?a\\=b\n"
+             "a\\:b\\ =c\n"
+             "\n")
+    assert_equal(p.getPropertyDict(), {
+        'key1': 'value',
+        'key2': 'value',
+        'key3': 'value',
+        'key4': 'value1 value2',
+        'This': 'key= this value',
+        'key5': 'value1,value2, value3',
+        'key6': '',
+        'url': 'https://idp.example.org:8443/?a=b',
+        'a:b ': 'c',
+    })
+
+
+def test_typed_accessors():
+    p = load("installLdap=True\ninstallSaml=false\nldap_port=1636\nhostname=idp.example.org\n")
+    assert_equal(p.getBoolean('installLdap'), True)
+    assert_equal(p.getBoolean('installSaml'), False)
+    assert_equal(p.getBoolean('hostname', True), True)
+    assert_equal(p.getInt('ldap_port'), 1636)
+    assert_equal(p.getInt('hostname'), None)
+    assert_equal(p.getInt('missing', 389), 389)
+    assert_equal(p.getTypedProperty('ldap_port'), 1636)
+    assert_equal(p.getTypedDict((bool,)), {'installLdap': True, 'installSaml': False,
+                                           'ldap_port': '1636', 'hostname': 'idp.example.org'})
+    assert_equal(Properties.typed_value('10', (bool, int)), 10)
+    assert_equal(Properties.typed_value('TRUE', (int,)), 'TRUE')
+
+
+def test_store_round_trip():
+    p = Properties.Properties()
+    p['url'] = 'https://idp.example.org:8443/?a=b'
+    p['installLdap'] = 'True'
+    assert_raises(TypeError, p.setProperty, 'port', 1636)
+
+    fd, fn = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        p.store(open(fn, 'w'), 'setup.properties')
+        with open(fn) as f:
+            text = f.read()
+        assert_equal(text.split('\n')[0], '#setup.properties')
+        assert_equal(load(text).getPropertyDict(), p.getPropertyDict())
+    finally:
+        os.remove(fn)
@@ -0,0 +1,85 @@
+import os
+import sys
+
+from StringIO import StringIO
+
+from nose.tools import assert_equal, assert_true
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from replication_monitor import parse_csn, lag, ReplicationMonitor, prometheus_text, print_report
+
+CSN_1 = '20170101120000.000000Z#000000#001#000000'
+CSN_1_LATER = '20170101120030.500000Z#000000#001#000000'
+CSN_2 = '20170101110000.000000Z#000000#002#000000'
+
+
+class FakeConnection(object):
+
+    def __init__(self, csns, completed):
+        self.csns = csns
+        self.completed = completed
+
+    def search_s(self, base, scope, filterstr, attrlist):
+        if base == 'o=gluu':
+            return [('o=gluu', {'contextCSN': self.csns})]
+        if self.completed is None:
+            raise Exception('No such object')
+        return [('cn=Operations,cn=Monitor', {'monitorOpCompleted': [str(sum(self.completed.values()))]})] + \
+               [('cn=%s,cn=Operations,cn=Monitor' % op, {'monitorOpCompleted': [str(count)]})
+                for op, count in self.completed.items()]
+
+    def search_ext(self, base, scope, filterstr, attrlist, sizelimit=0):
+        self.changesFilter = filterstr
+        return 1
+
+    def result(self, msgid):
+        return 101, [('uid=a,o=gluu', {}), ('uid=b,o=gluu', {}), ('uid=c,o=gluu', {})]
+
+
+def test_parse_csn_and_lag():
+    assert_equal(parse_csn(CSN_1), (1483272000.0, 0, '001', 0))
+    assert_equal(lag([CSN_1_LATER, CSN_2], [CSN_1, CSN_2]), (30.5, CSN_1))
+    assert_equal(lag([CSN_1], [CSN_1_LATER]), (0.0, None))
+    assert_equal(lag([CSN_1, CSN_2], [CSN_1]), (float('inf'), None))
+
+
+def test_replication_monitor_poll():
+    connections = {'ldap://m1': FakeConnection([CSN_1_LATER], {'Search': 100, 'Modify': 10}),
+                   'ldap://s1': FakeConnection([CSN_1], {'Search': 50, 'Modify': 0})}
+    monitor = ReplicationMonitor(['ldap://m1', 'ldap://s1', 'ldap://down'], ['ldap://m1'], lambda url: connections[url])
+
+    report = monitor.poll()
+    assert_equal(report['pairs'], [{'provider': 'ldap://m1', 'consumer': 'ldap://s1', 'seconds': 30.5, 'changes': 2}])
+    assert_equal(connections['ldap://m1'].changesFilter, '(entryCSN>=%s)' % CSN_1)
+    assert_equal(report['servers']['ldap://m1']['operations'], {'Search': 100, 'Modify': 10})
+    assert_equal(report['servers']['ldap://down']['up'], False)
+
+    connections['ldap://m1'].completed = {'Search': 200, 'Modify': 30}
+    monitor.previousTime -= 10
+    report = monitor.poll()
+    rates = report['servers']['ldap://m1']['rates']
+    assert_true(9 < rates['Search'] <= 10 and 1.8 < rates['Modify'] <= 2)
+
+    text = prometheus_text(report)
+    assert_true('gluu_ldap_up{server="ldap://down"} 0.0\n' in text)
+    assert_true('gluu_ldap_replication_lag_seconds{consumer="ldap://s1",provider="ldap://m1"} 30.5\n' in text)
+    assert_true('gluu_ldap_replication_lag_changes{consumer="ldap://s1",provider="ldap://m1"} 2.0\n' in text)
+
+
+def test_replication_monitor_without_counters():
+    connections = {'ldap://m1': FakeConnection([CSN_1_LATER], {'Search': 100}),
+                   'ldap://s1': FakeConnection([CSN_1], None)}
+    monitor = ReplicationMonitor(['ldap://m1', 'ldap://s1'], ['ldap://m1'], lambda url: connections[url])
+
+    report = monitor.poll()
+    consumer = report['servers']['ldap://s1']
+    assert_equal((consumer['up'], consumer['csns'], consumer['error']), (True, [CSN_1], None))
+    assert_equal((consumer['operations'], consumer['monitor_error']), ({}, 'No such object'))
+    assert_equal(report['pairs'], [{'provider': 'ldap://m1', 'consumer': 'ldap://s1', 'seconds': 30.5, 'changes': 2}])
+    assert_true('ldap://s1' not in monitor.previous)
+
+    out = StringIO()
+    print_report(report, out)
+    assert_true('ldap://s1                      no monitor counters: No such object\n' in out.getvalue())
+    assert_true('gluu_ldap_up{server="ldap://s1"} 1.0\n' in prometheus_text(report))
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_raises
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from replication_tool import ReplicationTool
+
+
+def test_write_configs_and_seed_scripts():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        conf_fn = os.path.join(tmp_dir, 'slapd.conf')
+        with open(conf_fn, 'w') as f:
+            f.write('moduleload\tback_mdb.la\ndatabase\tmdb\nsuffix\t"o=gluu"\nindex\tuid eq\n'
+                    'directory\t"/opt/gluu/data/main_db"\noverlay\tppolicy\n')
+        snapshot_fn = os.path.join(tmp_dir, 'o_gluu-snapshot.ldif')
+        with open(snapshot_fn, 'w') as f:
+            f.write('dn: o=gluu\nobjectClass: top\ncontextCSN: 20170101000000.000001Z#000000#001#00\n'
+                    ' 0000\ncontextCSN: 20170101000000.000002Z#000000#002#000000\n\n'
+                    'dn: ou=people,o=gluu\ncontextCSN: ignored\n')
+
+        r = ReplicationTool()
+        r.slapd_conf = conf_fn
+        r.master_list = r.parseServers('m1:1636,m2:1636')
+        r.slave_list = r.parseServers('s1:1636')
+        assert_raises(ValueError, r.parseServers, 'm1:1636')
+        r.repMgrPW = '{SSHA}secret'
+        r.writeConfigs(tmp_dir)
+
+        with open(os.path.join(tmp_dir, 'slapd.conf-m2_1636')) as f:
+            master = f.read()
+        assert_true('moduleload syncprov.la\nmoduleload\tback_mdb.la' in master)
+        assert_true('index\tuid eq\nindex entryCSN,entryUUID eq' in master)
+        with open(os.path.join(tmp_dir, 'slapd.conf-s1_1636')) as f:
+            slave = f.read()
+        assert_true(' provider=ldap://m1:1636\n provider=ldap://m2:1636' in slave)
+        with open(os.path.join(tmp_dir, 'replication.json')) as f:
+            assert_equal(json.load(f)['slaves'], ['s1:1636'])
+
+        csns = r.writeSeedScripts(tmp_dir, snapshot_fn)
+        assert_equal(csns, ['20170101000000.000001Z#000000#001#000000', '20170101000000.000002Z#000000#002#000000'])
+        with open(os.path.join(tmp_dir, 'seed-s1_1636.sh')) as f:
+            script = f.read()
+        assert_true('/opt/symas/bin/slapadd -q -f %s -b o=gluu -l $SNAPSHOT' % conf_fn in script)
+        assert_true('CONF=${2:-slapd.conf-s1_1636}' in script)
+    finally:
+        shutil.rmtree(tmp_dir)
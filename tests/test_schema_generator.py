@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+schema_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schema')
+sys.path.insert(0, schema_dir)
+
+from generator import SchemaGenerator
+from schema_parser import LDAPSchemaParser
+import manager
+
+
+def test_generate_all_matches_single_formats():
+    with open(os.path.join(schema_dir, 'gluu_schema.json')) as f:
+        gen = SchemaGenerator(f.read(), u'# header')
+    schema, ldif = gen.generate_all()
+    assert_equal(schema, gen.generate_schema())
+    assert_equal(ldif, gen.generate_ldif())
+    assert_true(schema.startswith(u'# header\nobjectIdentifier'))
+    assert_true(u'\ndn: cn=schema\n' in ldif)
+
+    with open(os.path.join(os.path.dirname(schema_dir), 'static', 'openldap', 'gluu.schema')) as f:
+        assert_equal(SchemaGenerator(json.dumps(gen.data)).generate_schema().encode('utf-8'), f.read())
+
+
+def test_parse_json_uses_cache():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        schema_fn = os.path.join(tmp_dir, 'test.schema')
+        with open(schema_fn, 'w') as f:
+            f.write("attributetype ( 1.2.3 NAME 'test' )\n")
+        with open(schema_fn, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        cached = {'objectClasses': [], 'attributeTypes': [{'oid': '1.2.3', 'names': ['test']}], 'oidMacros': {}}
+        with open(os.path.join(tmp_dir, '%s-0.json' % digest), 'w') as f:
+            json.dump(cached, f)
+
+        assert_equal(LDAPSchemaParser(schema_fn).parse_json(cache_dir=tmp_dir), cached)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_autogenerate_skips_unchanged():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        manager.autogenerate(tmp_dir, tmp_dir, cache_dir)
+        schema_fn = os.path.join(tmp_dir, 'gluu.schema')
+        with open(os.path.join(schema_dir, 'gluu_schema.json')) as f:
+            schema, ldif = SchemaGenerator(f.read()).generate_all()
+        with open(schema_fn) as f:
+            assert_equal(f.read(), schema.encode('utf-8'))
+        with open(os.path.join(tmp_dir, '101-ox.ldif')) as f:
+            assert_equal(f.read(), ldif.encode('utf-8'))
+
+        mtime = os.path.getmtime(os.path.join(cache_dir, 'autogenerate.json'))
+        os.utime(schema_fn, (0, 0))
+        manager.autogenerate(tmp_dir, tmp_dir, cache_dir)
+        assert_equal(os.path.getmtime(schema_fn), 0)
+        assert_equal(os.path.getmtime(os.path.join(cache_dir, 'autogenerate.json')), mtime)
+
+        # an edited output is generated again
+        with open(schema_fn, 'w') as f:
+            f.write('edited')
+        manager.autogenerate(tmp_dir, tmp_dir, cache_dir)
+        with open(schema_fn) as f:
+            assert_equal(f.read(), schema.encode('utf-8'))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schema'))
+
+from model import SchemaModel, parse_definition, render_markdown, render_html
+
+
+def test_parse_definition():
+    definition = parse_definition("( 1.2.3.4 NAME ( 'oxAssociatedClient' 'associatedClient' ) "
+                                  "DESC 'Client of a person' EQUALITY distinguishedNameMatch "
+                                  "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE X-ORIGIN 'Gluu' )")
+    assert_equal(definition, {'oid': '1.2.3.4', 'names': ['oxAssociatedClient', 'associatedClient'],
+                              'desc': 'Client of a person', 'equality': 'distinguishedNameMatch',
+                              'syntax': '1.3.6.1.4.1.1466.115.121.1.12', 'single_value': True,
+                              'x_origin': 'Gluu'})
+    definition = parse_definition("( 1.2.3.5 NAME 'gluuPerson' SUP ( top ) AUXILIARY "
+                                  "MUST objectClass MAY ( cn $ oxAssociatedClient ) )")
+    assert_equal(definition['sup'], ['top'])
+    assert_equal(definition['kind'], 'AUXILIARY')
+    assert_equal(definition['must'], ['objectClass'])
+    assert_equal(definition['may'], ['cn', 'oxAssociatedClient'])
+
+
+def test_indexes_and_docs():
+    schema = SchemaModel({
+        'oidMacros': {'oxOrgOID': '1.2.3', 'oxAttribute': 'oxOrgOID:1'},
+        'attributeTypes': [{'oid': 'oxAttribute:1', 'names': ['oxAssociatedClient', 'associatedClient'],
+                            'desc': 'Client'}],
+        'objectClasses': [{'oid': 'oxOrgOID:2', 'names': ['gluuPerson'], 'desc': 'Person',
+                           'may': ['associatedclient', 'cn']}],
+    })
+    attr = schema.attributeTypes[0]
+    assert_true(schema.attribute('ASSOCIATEDCLIENT') is attr)
+    assert_true(schema.attribute('oxAttribute:1') is attr)
+    assert_true(schema.attribute('1.2.3.1.1') is attr)
+    assert_true(schema.objectclass('gluuperson') is schema.objectClasses[0])
+    assert_equal(schema.attribute('unknown'), None)
+
+    docs = schema.docs()
+    assert_equal(render_markdown(docs), u"\n\n## gluuPerson\n_Person_"
+                                        u"\n* __oxAssociatedClient (or) associatedClient__:  Client\n* __cn__")
+    assert_true(u"<li><strong>cn</strong></li>" in render_html(docs))
+
+
+def test_ldif_schema_matches_json():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ldif_fn = os.path.join(tmp_dir, '101-test.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write("dn: cn=schema\nobjectClass: top\ncn: schema\n"
+                    "attributeTypes: ( 1.2.3.1 NAME 'oxId'\n  DESC 'Identifier'\n"
+                    "  SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )\n"
+                    "objectClasses: ( 1.2.3.2 NAME 'oxTest'\n  SUP ( top )\n  STRUCTURAL\n"
+                    "  MAY ( oxId ) )\n")
+        schema = SchemaModel.from_ldif_file(ldif_fn)
+        assert_equal(json.loads(json.dumps(schema.objectClasses)),
+                     [{'oid': '1.2.3.2', 'names': ['oxTest'], 'sup': ['top'], 'kind': 'STRUCTURAL', 'may': ['oxId']}])
+        assert_equal(schema.attribute('oxid')['desc'], 'Identifier')
+    finally:
+        shutil.rmtree(tmp_dir)
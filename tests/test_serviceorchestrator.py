@@ -0,0 +1,47 @@
+import socket
+import threading
+
+from nose.tools import assert_equal, assert_true, assert_raises
+
+from ServiceOrchestrator import ServiceOrchestrator, tcp_probe, http_probe
+
+
+def test_service_orchestrator():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+
+    events = []
+    lock = threading.Lock()
+
+    def starter(name, action=None):
+        def start():
+            with lock:
+                events.append(name)
+            if action:
+                action()
+        return start
+
+    # ldap becomes ready only when it starts listening
+    orchestrator = ServiceOrchestrator(pollInterval=0.05)
+    orchestrator.add('oxauth', starter('oxauth'), requires=['ldap'])
+    orchestrator.add('identity', starter('identity'), requires=['oxauth', 'not-installed'])
+    orchestrator.add('ldap', starter('ldap', lambda: threading.Timer(0.2, listener.listen, [5]).start()),
+                     probe=tcp_probe('127.0.0.1', port), timeout=10)
+    orchestrator.add('apache', starter('apache'))
+    orchestrator.add('broken', starter('broken'), probe=http_probe('http://127.0.0.1:1/'), timeout=0.2)
+
+    timings = orchestrator.start()
+    listener.close()
+
+    assert_true(events.index('ldap') < events.index('oxauth') < events.index('identity'))
+    assert_equal([(name, ok) for name, ok, waited, took in timings],
+                 [('oxauth', True), ('identity', True), ('ldap', True), ('apache', True), ('broken', False)])
+    assert_true(dict((name, waited) for name, ok, waited, took in timings)['oxauth'] >= 0.2)
+
+
+def test_service_orchestrator_circular_dependency():
+    orchestrator = ServiceOrchestrator()
+    orchestrator.add('a', lambda: None, requires=['b'])
+    orchestrator.add('b', lambda: None, requires=['a'])
+    assert_raises(ValueError, orchestrator.start)
@@ -1,4 +1,12 @@
-from nose.tools import assert_equal
+import ast
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 from mock import patch
 
 from setup import Setup
@@ -49,3 +57,517 @@ def test_setup_load_properties(mock_logIt):
     assert_equal(obj.installAsimba, True)
     assert_equal(obj.installCas, False)
     assert_equal(obj.installOxAuthRP, True)
+
+
+def test_setup_logIt():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        obj = Setup(tmp_dir)
+        obj.logJson = True
+        obj.logIt('first message')
+        obj.logIt('error message', True)
+        obj.close_logger()
+
+        log = open(obj.log).read()
+        assert_true('first message' in log)
+        assert_true('error message' in log)
+        assert_equal(open(obj.logError).read().count('message'), 1)
+        records = [json.loads(line) for line in open(obj.logJsonFn)]
+        assert_equal([r['level'] for r in records], ['INFO', 'ERROR'])
+
+        obj.remove_logs()
+        obj.close_logger()
+        assert_false(os.path.exists(obj.logError))
+        # the JSON log is written again after it was removed
+        records = [json.loads(line) for line in open(obj.logJsonFn)]
+        assert_equal([r['message'] for r in records],
+                      ['Removed %s' % fn for fn in (obj.log, obj.logError, obj.logJsonFn)])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_render_template(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        obj = Setup(tmp_dir)
+        template_fn = os.path.join(tmp_dir, 'sample.conf')
+        with open(template_fn, 'w') as f:
+            f.write('host=%(hostname)s ratio=50% mem=%(max_mem)s%')
+
+        obj.hostname = 'idp.example.org'
+        obj.templateRenderingDict['max_mem'] = 256
+        output_dir = os.path.join(tmp_dir, 'output')
+        os.mkdir(output_dir)
+        obj.renderTemplateInOut(template_fn, tmp_dir, output_dir)
+        rendered = open(os.path.join(output_dir, 'sample.conf')).read()
+        assert_equal(rendered, 'host=idp.example.org ratio=50% mem=256%')
+
+        # compiled template is reused until the file changes
+        compiled = obj.compileTemplate(template_fn)
+        assert_true(obj.compileTemplate(template_fn) is compiled)
+        with open(template_fn, 'w') as f:
+            f.write('changed %(hostname)s')
+        os.utime(template_fn, (0, 0))
+        assert_equal(obj.compileTemplate(template_fn) % obj.get_rendering_context(), 'changed idp.example.org')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_render_template_jobs(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        obj = Setup(tmp_dir)
+        obj.templateFolder = os.path.join(tmp_dir, 'templates')
+        obj.outputFolder = os.path.join(tmp_dir, 'output')
+        os.makedirs(os.path.join(obj.templateFolder, 'jetty'))
+        for i in range(20):
+            with open(os.path.join(obj.templateFolder, 'jetty', 'app%d' % i), 'w') as f:
+                f.write('JAVA_HOME=%(jre_home)s\nAPP=' + str(i))
+
+        obj.render_jetty_templates()
+
+        for i in range(20):
+            rendered = open(os.path.join(obj.outputFolder, 'jetty', 'app%d' % i)).read()
+            assert_equal(rendered, 'JAVA_HOME=/opt/jre\nAPP=%d' % i)
+        # no temporary files are left behind
+        assert_equal(len(os.listdir(os.path.join(obj.outputFolder, 'jetty'))), 20)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_copy_output(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        obj = Setup(tmp_dir)
+        obj.outputFolder = os.path.join(tmp_dir, 'output')
+        etc = os.path.join(tmp_dir, 'etc')
+        os.makedirs(obj.outputFolder)
+        os.makedirs(etc)
+        for fn in ('hosts', 'hostname', 'network'):
+            with open(os.path.join(obj.outputFolder, fn), 'w') as f:
+                f.write('new %s\n' % fn)
+        with open(os.path.join(etc, 'hosts.real'), 'w') as f:
+            f.write('old hosts\n')
+        os.symlink('hosts.real', os.path.join(etc, 'hosts'))
+        with open(os.path.join(etc, 'hostname'), 'w') as f:
+            f.write('old hostname\n')
+        inode = os.stat(os.path.join(etc, 'hostname')).st_ino
+        obj.ce_templates = {os.path.join(etc, 'hosts'): True,
+                            os.path.join(etc, 'missing', 'network'): True,
+                            os.path.join(tmp_dir, 'output', 'hosts', 'broken'): True,
+                            os.path.join(etc, 'hostname'): True,
+                            os.path.join(etc, 'skipped'): False}
+        # only the copied files are inputs of the step, not all of outputFolder
+        assert_equal(sorted(set(fn for fn, dest_fn in obj.get_output_pairs())),
+                     [os.path.join(obj.outputFolder, fn) for fn in ('broken', 'hostname', 'hosts', 'network')])
+
+        obj.copy_output()
+
+        # destinations are written in place, one failing file doesn't stop the others
+        assert_true(os.path.islink(os.path.join(etc, 'hosts')))
+        assert_equal(open(os.path.join(etc, 'hosts.real')).read(), 'new hosts\n')
+        assert_equal(os.stat(os.path.join(etc, 'hostname')).st_ino, inode)
+        assert_equal(open(os.path.join(etc, 'hostname')).read(), 'new hostname\n')
+        assert_equal(open(os.path.join(etc, 'missing', 'network')).read(), 'new network\n')
+        mock_logIt.assert_any_call("Failed to copy 1 files from %s to final destinations" % obj.outputFolder, True)
+
+        # unchanged destinations are skipped
+        obj.ce_templates = {os.path.join(etc, 'hostname'): True}
+        os.utime(os.path.join(etc, 'hostname'), (0, 0))
+        obj.copy_output()
+        assert_equal(os.path.getmtime(os.path.join(etc, 'hostname')), 0)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_setup_script_files_have_their_modules():
+    obj = Setup(os.path.abspath('.'))
+    scripts_dir = os.path.join(obj.install_dir, 'static', 'scripts')
+    for script in obj.gluuScriptFiles:
+        if not script.endswith('.py'):
+            continue
+        with open(script) as f:
+            tree = ast.parse(f.read())
+        modules = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                modules.add(node.module.split('.')[0])
+        for module in modules:
+            module_fn = os.path.join(scripts_dir, '%s.py' % module)
+            if os.path.exists(module_fn):
+                assert_true(module_fn in obj.gluuScriptFiles, "%s needs %s" % (script, module_fn))
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_add_jks_trusted_certs(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        obj = Setup(tmp_dir)
+        jks_fn = os.path.join(tmp_dir, 'cacerts')
+        password = ''.join('\x00' + c for c in 'changeit')
+        body = struct.pack('>III', 0xFEEDFEED, 2, 0)
+        with open(jks_fn, 'wb') as f:
+            f.write(body + hashlib.sha1(password + 'Mighty Aphrodite' + body).digest())
+
+        obj.add_jks_trusted_certs(jks_fn, 'changeit', [('Host_httpd', 'der1'), ('host_openldap', 'der2')])
+        obj.add_jks_trusted_certs(jks_fn, 'changeit', [('host_httpd', 'der3')])
+
+        data = open(jks_fn, 'rb').read()
+        body, digest = data[:-20], data[-20:]
+        assert_equal(hashlib.sha1(password + 'Mighty Aphrodite' + body).digest(), digest)
+        assert_equal(struct.unpack('>III', body[:12]), (0xFEEDFEED, 2, 2))
+        assert_true('host_openldap' in body and 'host_httpd' in body)
+        assert_true('der3' in body and 'der1' not in body)
+
+        # a wrong password must not produce a store keytool rejects
+        assert_raises(ValueError, obj.add_jks_trusted_certs, jks_fn, 'wrongpass', [('host_oxauth', 'der4')])
+        assert_equal(open(jks_fn, 'rb').read(), data)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_extract_archive_members(mock_logIt):
+    import zipfile
+    obj = Setup()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        war = os.path.join(tmp_dir, 'oxauth.war')
+        with zipfile.ZipFile(war, 'w') as archive:
+            archive.writestr('WEB-INF/lib/bcprov-jdk15on-1.54.jar', 'bcprov')
+            archive.writestr('WEB-INF/lib/oxauth-model-3.1.0.jar', 'model')
+            archive.writestr('WEB-INF/lib/weld-core-2.3.jar', 'weld')
+            archive.writestr('WEB-INF/classes/oxauth-model-x.jar', 'class')
+            archive.writestr('index.html', 'html')
+
+        out_dir = os.path.join(tmp_dir, 'lib')
+        patterns = ['bcprov-jdk15on-*.jar', 'oxauth-model-*.jar']
+        files = obj.extractArchiveMembers(war, patterns, 'WEB-INF/lib', out_dir)
+        assert_equal(sorted(os.path.basename(fn) for fn in files),
+                     ['bcprov-jdk15on-1.54.jar', 'oxauth-model-3.1.0.jar'])
+        assert_equal(sorted(fn for fn in os.listdir(out_dir) if not fn.startswith('.')),
+                     ['bcprov-jdk15on-1.54.jar', 'oxauth-model-3.1.0.jar'])
+        with open(os.path.join(out_dir, 'oxauth-model-3.1.0.jar')) as f:
+            assert_equal(f.read(), 'model')
+
+        # unchanged archive is not extracted again
+        with patch('zipfile.ZipFile') as mock_zip:
+            assert_equal(obj.extractArchiveMembers(war, patterns, 'WEB-INF/lib', out_dir), files)
+            assert_false(mock_zip.called)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+@patch.object(Setup, 'logCommand')
+def test_setup_run(mock_logCommand, mock_logIt):
+    obj = Setup()
+
+    code = obj.run(['/bin/sh', '-c', 'echo first; echo second >&2; exit 3'])
+    assert_equal(code, 3)
+    mock_logCommand.assert_any_call('first', False)
+    mock_logCommand.assert_any_call('second', True)
+    assert_equal(obj.commandResults[-1]['code'], 3)
+    assert_false(obj.commandResults[-1]['timed_out'])
+
+    # timeout kills the command and the processes it started
+    command = obj.run_async(['/bin/sh', '-c', 'sleep 30 & sleep 30'], timeout=0.5)
+    assert_true(command.wait() != 0)
+    assert_true(command.timedOut)
+    assert_true(command.duration < 10)
+
+    assert_equal(obj.run(['/nonexistent/command']), None)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_start_services_without_httpd(mock_logIt):
+    added = []
+
+    class Orchestrator(object):
+        def __init__(self, logIt):
+            pass
+
+        def add(self, name, start, requires=(), probe=None, timeout=300):
+            added.append(name)
+
+        def start(self):
+            return []
+
+    obj = Setup()
+    obj.installLdap = False
+    for configuration in obj.jetty_app_configuration.values():
+        configuration['installed'] = False
+    with patch('setup.ServiceOrchestrator', Orchestrator):
+        obj.start_services()
+        assert_equal(added, ['apache', 'memcached'])
+        del added[:]
+        obj.installHttpd = False
+        obj.start_services()
+        assert_equal(added, ['memcached'])
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_calculate_aplications_memory(mock_logIt):
+    obj = Setup()
+    obj.application_max_ram = '8192'
+    obj.installSaml = True
+
+    with patch.object(Setup, 'get_host_resources', return_value=(4096, 3000, 4)):
+        obj.calculate_aplications_memory()
+
+    # 4096 MB host keeps 512 MB for os, 1024 MB for slapd, 64 MB for memcached, 128 MB for httpd
+    total = sum(obj.templateRenderingDict['%s_max_mem' % app] for app in ['oxauth', 'identity', 'idp'])
+    assert_true(total <= 4096 - 512 - 1024 - 64 - 128)
+    assert_equal(obj.templateRenderingDict['oxauth_max_heap_mem'] + obj.templateRenderingDict['oxauth_max_meta_mem'],
+                 obj.templateRenderingDict['oxauth_max_mem'])
+    assert_true(obj.templateRenderingDict['oxauth_max_threads'] > obj.templateRenderingDict['identity_max_threads'])
+    assert_true(obj.templateRenderingDict['oxauth_min_threads'] <= obj.templateRenderingDict['oxauth_max_threads'])
+    assert_true('GC' in obj.templateRenderingDict['oxauth_gc_options'])
+
+    context = obj.get_rendering_context()
+    for app in ['oxauth', 'identity', 'idp', 'asimba', 'oxauth-rp']:
+        rendered = obj.compileTemplate('templates/jetty/%s' % app) % context
+        assert_true('jetty.threadPool.maxThreads=%s' % obj.templateRenderingDict['%s_max_threads' % app] in rendered)
+
+    with patch.object(Setup, 'get_host_resources', return_value=(None, None, 1)):
+        obj.calculate_aplications_memory()
+    assert_equal(obj.templateRenderingDict['oxauth_gc_options'], '-XX:+UseSerialGC')
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_openldap_profiles(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ldif_fn = os.path.join(tmp_dir, 'base.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write('dn: o=gluu\nobjectClass: top\n\ndn: ou=people,o=gluu\nobjectClass: top\n')
+
+        obj = Setup()
+        obj.openldapDataFolder = tmp_dir
+        obj.opendlapIndexDef = 'static/openldap/index.json'
+        with patch.object(Setup, 'get_host_resources', return_value=(16384, 8000, 16)):
+            bulk_load, production = obj.get_openldap_profiles([ldif_fn])
+
+        assert_equal(production['entries'], 2)
+        assert_equal(production['threads'], 64)
+        assert_equal(production['listener_threads'], 2)
+        assert_equal(production['main_maxsize'], 1024 ** 3)
+        assert_equal((bulk_load['dbnosync'], bulk_load['checkpoint']), (True, None))
+        assert_equal((production['dbnosync'], production['checkpoint']), (False, (1024, 5)))
+
+        # 256MB reserved for slapd on a 1GB host fits 32 thread stacks
+        with patch.object(Setup, 'get_host_resources', return_value=(1024, 800, 16)):
+            assert_equal(obj.get_openldap_profiles([ldif_fn])[1]['threads'], 32)
+        with patch.object(Setup, 'get_host_resources', return_value=(256, 200, 16)):
+            assert_equal(obj.get_openldap_profiles([ldif_fn])[1]['threads'], 16)
+
+        obj.templateRenderingDict.update({'openldap_indexes': obj.get_openldap_indexes(),
+                                          'openldap_accesslog_conf': '', 'openldap_gluu_accesslog': ''})
+        for profile, synced in [(bulk_load, False), (production, True)]:
+            context = obj.get_rendering_context()
+            context.update(obj.get_openldap_profile_context(profile))
+            rendered = obj.compileTemplate('templates/slapd.conf') % context
+            assert_true('threads\t64\n' in rendered)
+            assert_true('maxsize 1073741824\n' in rendered)
+            assert_equal('\ndbnosync\n' in rendered, not synced)
+            assert_equal('\ncheckpoint\t1024 5\n' in rendered, synced)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_run_step_resume(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        calls = []
+
+        class StepSetup(Setup):
+            def make_secret(self):
+                calls.append('make_secret')
+                self.secret = 'generated-%d' % len(calls)
+                self.templateRenderingDict['secret_rendered'] = self.secret
+
+            def use_secret(self):
+                calls.append('use_secret')
+                self.used = self.secret
+
+        input_fn = os.path.join(tmp_dir, 'input.txt')
+        with open(input_fn, 'w') as f:
+            f.write('a')
+
+        obj = StepSetup()
+        obj.stateFn = os.path.join(tmp_dir, 'setup_state.json')
+        obj.save_initial_state()
+        obj.run_step(obj.make_secret)
+        obj.run_step(obj.use_secret, [input_fn])
+
+        # resumed install restores what skipped steps produced
+        resumed = StepSetup()
+        resumed.stateFn = obj.stateFn
+        resumed.resume = True
+        assert_true(resumed.load_setup_state())
+        assert_true(resumed.restore_initial_state())
+        assert_false(resumed.run_step(resumed.make_secret))
+        assert_false(resumed.run_step(resumed.use_secret, [input_fn]))
+        assert_equal(calls, ['make_secret', 'use_secret'])
+        assert_equal(resumed.used, 'generated-1')
+        assert_equal(resumed.templateRenderingDict['secret_rendered'], 'generated-1')
+
+        # changed input file runs the step again
+        with open(input_fn, 'w') as f:
+            f.write('changed')
+        assert_true(resumed.run_step(resumed.use_secret, [input_fn]))
+        assert_equal(calls, ['make_secret', 'use_secret', 'use_secret'])
+
+        # failed step is recorded and runs again on resume
+        def failing_step():
+            raise ValueError('failed')
+        assert_raises(ValueError, resumed.run_step, failing_step)
+        with open(resumed.stateFn) as f:
+            assert_equal(json.load(f)['steps']['failing_step']['status'], 'failed')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_setup_run_step_logged_error():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        calls = []
+
+        class StepSetup(Setup):
+            def install_service(self):
+                calls.append('install_service')
+                try:
+                    raise OSError('service failed')
+                except:
+                    self.logIt("Error installing service", True)
+
+            def enable_service(self):
+                calls.append('enable_service')
+                self.run(['/bin/sh', '-c', 'echo Created symlink >&2; exit 1'])
+
+        obj = StepSetup(tmp_dir)
+        obj.save_initial_state()
+        assert_true(obj.run_step(obj.install_service))
+        # stderr and exit codes of commands the step doesn't check are not errors
+        assert_true(obj.run_step(obj.enable_service))
+        obj.close_logger()
+        with open(obj.stateFn) as f:
+            steps = json.load(f)['steps']
+        assert_equal((steps['install_service']['status'], steps['install_service']['errors']), ('failed', 1))
+        assert_equal(steps['enable_service']['status'], 'done')
+        with open(obj.logError) as f:
+            assert_true('Created symlink' in f.read())
+
+        # step which logged an error runs again on resume
+        resumed = StepSetup(tmp_dir)
+        resumed.resume = True
+        assert_true(resumed.load_setup_state())
+        assert_true(resumed.restore_initial_state())
+        assert_true(resumed.run_step(resumed.install_service))
+        assert_false(resumed.run_step(resumed.enable_service))
+        resumed.close_logger()
+        assert_equal(calls, ['install_service', 'enable_service', 'install_service'])
+        with open(obj.logError) as f:
+            assert_true('Step install_service logged 1 errors, it runs again on resume' in f.read())
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_fleet_bundle(mock_logIt):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        class FleetSetup(Setup):
+            def calculate_aplications_memory(self):
+                self.templateRenderingDict['node_memory'] = self.hostResources[0]
+
+            def render_templates(self):
+                self.writeRenderedTemplate('%s/node.conf' % self.outputFolder,
+                                           'cert=%s/httpd.crt\n' % self.certFolder)
+
+            def generate_base64_configuration(self):
+                pass
+
+            def render_configuration_template(self):
+                pass
+
+            def render_service_templates(self):
+                pass
+
+            def render_test_templates(self):
+                pass
+
+        shared_certs = os.path.join(tmp_dir, 'fleet', 'shared', 'certs')
+        os.makedirs(shared_certs)
+        with open(os.path.join(shared_certs, 'shared.key'), 'w') as f:
+            f.write('key')
+
+        obj = FleetSetup()
+        obj.install_dir = tmp_dir
+        obj.certFolder = '/etc/certs'
+        obj.outputFolder = os.path.join(tmp_dir, 'output')
+        obj.copyHashCache = None
+        obj.generatedCerts = [['gluu_httpd', '%s/httpd.crt' % shared_certs]]
+        obj.redirect_attributes(shared_certs, obj.certFolder)
+        assert_equal(obj.generatedCerts, [['gluu_httpd', '/etc/certs/httpd.crt']])
+
+        node = {'name': 'node1', 'ip': '10.0.0.11', 'memory_mb': 4096, 'cpus': 2, 'certs': []}
+        bundle_fn = obj.build_fleet_node(node, os.path.join(tmp_dir, 'fleet'), shared_certs, obj.certFolder)
+        assert_true(os.path.exists(bundle_fn))
+        assert_equal(obj.ip, None)
+
+        # node unpacks the bundle and resumes with pinned steps
+        node_dir = os.path.join(tmp_dir, 'node')
+        applied = FleetSetup()
+        applied.certFolder = os.path.join(node_dir, 'certs')
+        applied.outputFolder = os.path.join(node_dir, 'output')
+        applied.stateFn = os.path.join(node_dir, 'setup_state.json')
+        applied.copyHashCache = None
+        applied.apply_bundle(bundle_fn)
+        assert_true(applied.resume)
+        with open(os.path.join(applied.certFolder, 'shared.key')) as f:
+            assert_equal(f.read(), 'key')
+        with open(os.path.join(applied.outputFolder, 'node.conf')) as f:
+            assert_equal(f.read(), 'cert=/etc/certs/httpd.crt\n')
+
+        assert_true(applied.load_setup_state())
+        assert_true(applied.restore_initial_state())
+        assert_equal(applied.ip, '10.0.0.11')
+        assert_equal(applied.templateRenderingDict['node_memory'], 4096)
+        assert_equal(applied.stateFn, os.path.join(node_dir, 'setup_state.json'))
+        assert_false(applied.run_step(applied.render_templates))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@patch.object(Setup, 'logIt')
+def test_setup_keygen_daemon_requests(mock_logIt):
+    import subprocess
+    import sys
+    obj = Setup()
+    echo = ("import sys, json\n"
+            "for line in iter(sys.stdin.readline, ''):\n"
+            "    request = json.loads(line)\n"
+            "    print json.dumps({'id': request['id'], 'status': 'ok', 'output': request['keystore'], 'error': ''})\n"
+            "    sys.stdout.flush()\n")
+    obj.attach_keygen_daemon(subprocess.Popen([sys.executable, '-c', echo], stdin=subprocess.PIPE,
+                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+    responses = obj.keygen_daemon_requests([{'keystore': 'a.jks'}, {'keystore': 'b.jks'}])
+    assert_equal([r['output'] for r in responses], ['a.jks', 'b.jks'])
+    obj.stop_keygen_daemon()
+
+    # a hung daemon is killed and the requests fall back to the commands
+    hung = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    obj.attach_keygen_daemon(hung)
+    obj.keygenDaemonTimeout = 1
+    assert_equal(obj.keygen_daemon_requests([{'keystore': 'a.jks'}]), [None])
+    assert_true(hung.poll() is not None)
+    assert_equal(obj.keygen_daemon, None)
+    assert_false(obj.useKeyGeneratorDaemon)
@@ -0,0 +1,38 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'scripts'))
+
+from slapd_standin import rewrite_slapd_conf, ldif_suffix
+
+
+def test_rewrite_slapd_conf():
+    with open('templates/slapd.conf') as f:
+        text = f.read()
+    rewritten, directories = rewrite_slapd_conf(text, '/tmp/standin')
+
+    assert_equal(directories, ['/tmp/standin/db0', '/tmp/standin/db1'])
+    lines = [line for line in rewritten.splitlines() if line.startswith(('directory', 'pidfile', 'TLS', '#TLS'))]
+    assert_equal(lines, ['#TLSCACertificateFile "%(openldapTLSCACert)s"',
+                                     '#TLSCertificateFile "%(openldapTLSCert)s"',
+                                     '#TLSCertificateKeyFile "%(openldapTLSKey)s"',
+                                     '#TLSCipherSuite HIGH:MEDIUM',
+                                     'pidfile\t\t\t"/tmp/standin/slapd.pid"',
+                                     'directory\t"/tmp/standin/db0"',
+                                     'directory\t"/tmp/standin/db1"'])
+
+
+def test_ldif_suffix():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ldif_fn = os.path.join(tmp_dir, 'site.ldif')
+        with open(ldif_fn, 'w') as f:
+            f.write('version: 1\ndn: ou=cache-refresh,O=Site\nobjectClass: top\n')
+        assert_equal(ldif_suffix(ldif_fn, ['o=gluu', 'o=site']), 'o=site')
+        assert_equal(ldif_suffix(ldif_fn, ['o=gluu']), None)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+from mock import patch
+
+from TreeSync import TreeSync
+
+
+def write(path, text):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_treesync_sync_tree():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp_dir, 'src')
+        dst = os.path.join(tmp_dir, 'dst')
+        cache = os.path.join(tmp_dir, 'hashes.json')
+        write(os.path.join(src, 'a.txt'), 'aaaa')
+        write(os.path.join(src, 'sub', 'b.txt'), 'bb')
+        write(os.path.join(src, 'sub', 'empty'), '')
+        os.chmod(os.path.join(src, 'a.txt'), 0640)
+
+        stats = TreeSync(cache).syncTree(src, dst)
+        assert_equal(stats, {'files_copied': 3, 'bytes_copied': 6, 'files_skipped': 0, 'bytes_skipped': 0})
+        assert_equal(read(os.path.join(dst, 'a.txt')), 'aaaa')
+        assert_equal(read(os.path.join(dst, 'sub', 'b.txt')), 'bb')
+        assert_equal(os.stat(os.path.join(dst, 'a.txt')).st_mode & 0777, 0640)
+        assert_true(os.path.exists(cache))
+
+        # same content with a different mtime is not copied again
+        os.utime(os.path.join(src, 'a.txt'), (0, 0))
+        write(os.path.join(src, 'sub', 'b.txt'), 'cc')
+        stats = TreeSync(cache).syncTree(src, dst)
+        assert_equal(stats, {'files_copied': 1, 'bytes_copied': 2, 'files_skipped': 2, 'bytes_skipped': 4})
+        assert_equal(read(os.path.join(dst, 'sub', 'b.txt')), 'cc')
+
+        stats = TreeSync(cache).syncTree(src, dst, overwrite=True)
+        assert_equal(stats['files_copied'], 3)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_treesync_copy_without_sendfile():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        write(os.path.join(tmp_dir, 'src', 'a.bin'), 'x' * 3000000)
+        syncer = TreeSync()
+        with patch('TreeSync.sendfile', side_effect=OSError(38, 'Function not implemented')):
+            syncer.syncFiles([(os.path.join(tmp_dir, 'src', 'a.bin'), os.path.join(tmp_dir, 'out', 'a.bin'))])
+        assert_equal(read(os.path.join(tmp_dir, 'out', 'a.bin')), 'x' * 3000000)
+        assert_equal(syncer.useSendfile, False)
+    finally:
+        shutil.rmtree(tmp_dir)